@@ -10,12 +10,17 @@ from types import GeneratorType
 from adminapi import api
 from adminapi.datatype import validate_value, json_to_datatype
 from adminapi.filters import Any, BaseFilter, ContainedOnlyBy
-from adminapi.request import send_request, json_encode_extra
+from adminapi.request import (
+    json_encode_extra,
+    send_request,
+    send_stream_request,
+)
 from adminapi.exceptions import DatasetError, AdminapiException
 
 NEW_OBJECT_ENDPOINT = '/dataset/new_object'
 COMMIT_ENDPOINT = '/dataset/commit'
 QUERY_ENDPOINT = '/dataset/query'
+MULTI_QUERY_ENDPOINT = '/dataset/multi_query'
 
 
 class BaseQuery(object):
@@ -264,6 +269,30 @@ class BaseQuery(object):
 
 
 class Query(BaseQuery):
+    @classmethod
+    def batch(cls, queries):
+        """Fetch the results of multiple queries with a single request
+
+        The queries are executed on the same snapshot of the database, so
+        their results are consistent with each other.  The given queries
+        are returned with their results, ready to be used as usual.
+        """
+        pending = [
+            q for q in queries if q._results is None and q._filters is not None
+        ]
+        if not pending:
+            return queries
+
+        response = send_request(MULTI_QUERY_ENDPOINT, post_params={
+            'queries': [q._build_request_data() for q in pending],
+        })
+        if response['status'] == 'error':
+            _handle_exception(response)
+        for query, results in zip(pending, response['results']):
+            query._results = [_format_obj(s) for s in results]
+
+        return queries
+
     def _fetch_new_object(self, servertype):
         response = send_request(
             NEW_OBJECT_ENDPOINT, [('servertype', servertype)]
@@ -281,17 +310,45 @@ class Query(BaseQuery):
         for obj in self:
             obj._confirm_changes()
 
+    def stream(self):
+        """Iterate the objects while they are being received
+
+        The objects are not kept on the query, so it is possible to process
+        large number of them without holding all in memory.
+        """
+        if self._results is not None:
+            return iter(self._results)
+
+        return self._stream_results()
+
+    def _stream_results(self):
+        request_data = self._build_request_data()
+        request_data['stream'] = True
+
+        response = send_stream_request(
+            QUERY_ENDPOINT, post_params=request_data
+        )
+        if response['status'] == 'error':
+            _handle_exception(response)
+        for obj in response['result']:
+            yield _format_obj(obj)
+
     def _fetch_results(self):
+        request_data = self._build_request_data()
+
+        response = send_request(QUERY_ENDPOINT, post_params=request_data)
+        if response['status'] == 'error':
+            _handle_exception(response)
+        return [_format_obj(s) for s in response['result']]
+
+    def _build_request_data(self):
         request_data = {'filters': self._filters}
         if self._restrict is not None:
             request_data['restrict'] = self._restrict
         if self._order_by is not None:
             request_data['order_by'] = self._order_by
 
-        response = send_request(QUERY_ENDPOINT, post_params=request_data)
-        if response['status'] == 'error':
-            _handle_exception(response)
-        return [_format_obj(s) for s in response['result']]
+        return request_data
 
 
 class DatasetObject(dict):
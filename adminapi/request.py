@@ -43,6 +43,16 @@ from adminapi.exceptions import (
 
 logger = logging.getLogger(__name__)
 
+# The streamed responses are framed as a JSON array with one item per line,
+# so that they can be parsed as a whole like the other responses too.
+STREAM_HEADER = '{"status": "success", "result": ['
+STREAM_FOOTER = ']}'
+
+SESSION_ENDPOINT = '/session'
+
+# The session to sign the requests with instead of the SSH keys
+_session = None
+
 
 def load_private_key_file(private_key_path):
     """Try to load a private ssh key from disk
@@ -73,6 +83,9 @@ class Settings:
     tries = 3
     sleep_interval = 5
     grace_period = 15  # <= serveradmin.api.decorators.TIMESTAMP_GRACE_PERIOD
+    # Authenticate with the SSH keys once, and sign the following requests
+    # with a session token
+    use_sessions = bool(os.environ.get('SERVERADMIN_SESSIONS'))
 
 
 def calc_message(timestamp, data=None):
@@ -127,9 +140,37 @@ def calc_app_id(auth_token):
 
 
 def send_request(endpoint, get_params=None, post_params=None):
+    response = _open_request(endpoint, get_params, post_params)
+
+    return json.loads(response.read().decode())
+
+
+def send_stream_request(endpoint, get_params=None, post_params=None):
+    """Send the request and parse the response incrementally
+
+    The result is returned as a generator, if the response is streamed.
+    The other responses are returned as they are.
+    """
+    response = _open_request(endpoint, get_params, post_params)
+    line = response.readline().decode()
+    if line.rstrip('\n') != STREAM_HEADER:
+        return json.loads(line + response.read().decode())
+
+    return {'status': 'success', 'result': _iter_stream(response)}
+
+
+def _open_request(endpoint, get_params, post_params):
     for retry in reversed(range(Settings.tries)):
         request = _build_request(endpoint, get_params, post_params)
-        response = _try_request(request, retry)
+        try:
+            response = _try_request(request, retry)
+        except ApiError as error:
+            if not _drop_session(request, error):
+                raise
+
+            # Try once more with a new session
+            request = _build_request(endpoint, get_params, post_params)
+            response = _try_request(request, retry)
         if response:
             break
 
@@ -138,14 +179,74 @@ def send_request(endpoint, get_params=None, post_params=None):
     else:
         assert False    # Cannot happen
 
-    return json.loads(response.read().decode())
+    return response
+
+
+def _get_session():
+    """Return the session to sign the requests with
+
+    The session is created by authenticating with the SSH keys, and renewed
+    before it expires.  None is returned, if the sessions are not enabled,
+    or a pre shared key is used, which is cheap to sign with anyway.
+    """
+    global _session
+
+    if not Settings.use_sessions or (
+        Settings.auth_token and not Settings.auth_key
+    ):
+        return None
+
+    if _session is None or (
+        _session['expires'] - Settings.grace_period < time.time()
+    ):
+        response = send_request(SESSION_ENDPOINT, post_params={})
+        _session = {
+            'session_id': response['session_id'],
+            'session_token': response['session_token'],
+            'expires': time.time() + response['expires_in'],
+        }
+
+    return _session
+
+
+def _drop_session(request, error):
+    """Forget the session, if the request signed with it was denied
+
+    The session might not be accepted anymore before it expires, for
+    example, when the auth token of the application is changed.  Return
+    whether the request should be tried again.
+    """
+    global _session
+
+    if error.status_code != 403 or not request.get_header('X-session'):
+        return False
+
+    _session = None
+    return True
+
+
+def _iter_stream(response):
+    while True:
+        try:
+            line = response.readline().decode().rstrip('\n')
+        except (SSLError, timeout, IncompleteRead) as error:
+            raise ApiError('Reading the response failed: {}'.format(error))
+
+        if line == STREAM_FOOTER:
+            return
+        if not line:
+            raise ApiError('Response ended before it was complete')
+
+        # All items except the first one are prefixed with a comma.
+        yield json.loads(line.lstrip(','))
 
 
 def _build_request(endpoint, get_params, post_params, retry=1):
     """Wrap request data in an urllib Request instance
 
     Aside from preparing the get and post data for transport, this function
-    authenticates the request using either an auth token or ssh keys.
+    authenticates the request using either an auth token, ssh keys or
+    a session created with the ssh keys.
 
     Returns an urllib Request.
     """
@@ -161,7 +262,13 @@ def _build_request(endpoint, get_params, post_params, retry=1):
         'X-API-Version': '.'.join(str(v) for v in VERSION),
     }
 
-    if Settings.auth_key:
+    session = None if endpoint == SESSION_ENDPOINT else _get_session()
+    if session:
+        headers['X-Session'] = session['session_id']
+        headers['X-SecurityToken'] = calc_security_token(
+            session['session_token'], timestamp, post_data
+        )
+    elif Settings.auth_key:
         headers['X-PublicKeys'] = Settings.auth_key.get_base64()
         headers['X-Signatures'] = calc_signature(
             Settings.auth_key, timestamp, post_data
@@ -172,19 +279,7 @@ def _build_request(endpoint, get_params, post_params, retry=1):
             Settings.auth_token, timestamp, post_data
         )
     else:
-        try:
-            agent = Agent()
-            agent_keys = agent.get_keys()
-        except SSHException:
-            raise AuthenticationError('No token and ssh agent found')
-
-        if not agent_keys:
-            raise AuthenticationError('No token and ssh agent keys found')
-
-        key_signatures = calc_signatures(agent_keys, timestamp, post_data)
-        if not key_signatures:
-            raise AuthenticationError('No token and ssh agent keys found')
-
+        key_signatures = _calc_agent_signatures(timestamp, post_data)
         headers['X-PublicKeys'] = ','.join(key_signatures.keys())
         headers['X-Signatures'] = ','.join(key_signatures.values())
 
@@ -211,6 +306,24 @@ def _build_request(endpoint, get_params, post_params, retry=1):
     return Request(url, post_data, headers)
 
 
+def _calc_agent_signatures(timestamp, data=None):
+    """Sign the request with all keys of the ssh agent"""
+    try:
+        agent = Agent()
+        agent_keys = agent.get_keys()
+    except SSHException:
+        raise AuthenticationError('No token and ssh agent found')
+
+    if not agent_keys:
+        raise AuthenticationError('No token and ssh agent keys found')
+
+    key_signatures = calc_signatures(agent_keys, timestamp, data)
+    if not key_signatures:
+        raise AuthenticationError('No token and ssh agent keys found')
+
+    return key_signatures
+
+
 def _try_request(request, retry=False):
     try:
         return urlopen(request, timeout=Settings.timeout)
@@ -0,0 +1,155 @@
+"""Serveradmin - Access Control Registry
+
+Copyright (c) 2024 InnoGames GmbH
+"""
+
+from time import monotonic
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_migrate,
+    post_save,
+)
+from django.dispatch import receiver
+
+from serveradmin.access_control.models import AccessControlGroup
+from serveradmin.common.cache_version import CacheVersion
+from serveradmin.serverdb.metadata import get_metadata
+from serveradmin.serverdb.models import Attribute
+
+VERSION_CACHE_KEY = 'serveradmin_access_control_version'
+
+_version = CacheVersion(VERSION_CACHE_KEY)
+
+_registry = None
+
+
+class CompiledAccessControlGroup:
+    """The access control group prepared to check the commits in memory
+
+    The filters are parsed, and the attributes the group permits to change
+    are resolved once.  The objects are shared between all of the commits.
+    They must not be modified.
+    """
+
+    def __init__(self, group, attribute_ids, all_attribute_ids):
+        self.pk = group.pk
+        self.name = group.name
+        self.filters = group.get_filters()
+
+        # See AccessControlGroup.get_permissible_attribute_ids()
+        if group.is_whitelist:
+            self.permissible_attribute_ids = frozenset(attribute_ids)
+        else:
+            self.permissible_attribute_ids = frozenset(
+                all_attribute_ids.difference(attribute_ids)
+            )
+
+    def __str__(self):
+        return self.name
+
+
+class AccessControlRegistry:
+    """Snapshot of the access control groups of the users and the apps
+
+    Everything needed to check the commits is loaded at once, so that they
+    can be checked without hitting the database.  The permitted attributes
+    of the blacklists depend on the metadata, so the snapshot is bound to
+    a version of it.
+    """
+
+    def __init__(self, version, metadata):
+        self.version = version
+        self.metadata_version = metadata.version
+        self.loaded_at = monotonic()
+
+        attribute_ids = {}
+        for group_id, attribute_id in (
+            AccessControlGroup.attributes.through.objects
+            .values_list('accesscontrolgroup_id', 'attribute_id')
+        ):
+            attribute_ids.setdefault(group_id, set()).add(attribute_id)
+        all_attribute_ids = (
+            set(metadata.attributes) | set(Attribute.specials)
+        )
+        groups = {
+            g.pk: CompiledAccessControlGroup(
+                g, attribute_ids.get(g.pk, ()), all_attribute_ids
+            )
+            for g in AccessControlGroup.objects.all()
+        }
+
+        self._user_groups = {}
+        for group_id, user_id in (
+            AccessControlGroup.members.through.objects
+            .values_list('accesscontrolgroup_id', 'user_id')
+        ):
+            self._user_groups.setdefault(user_id, []).append(groups[group_id])
+        self._app_groups = {}
+        for group_id, app_id in (
+            AccessControlGroup.applications.through.objects
+            .values_list('accesscontrolgroup_id', 'application_id')
+        ):
+            self._app_groups.setdefault(app_id, []).append(groups[group_id])
+
+        # The attributes related via another one are changed on the related
+        # objects, so they are not checked against the groups.
+        self._related_via_attribute_ids = {
+            servertype_id: frozenset(
+                sa.attribute_id
+                for sa in metadata.get_servertype_attributes(
+                    servertype_id
+                ).values()
+                if sa.related_via_attribute_id is not None
+            )
+            for servertype_id in metadata.servertypes
+        }
+
+    def get_groups(self, user=None, app=None):
+        """Return the groups of the app, or if not given of the user"""
+        if app:
+            return self._app_groups.get(app.pk, [])
+        if user:
+            return self._user_groups.get(user.pk, [])
+        return []
+
+    def get_related_via_attribute_ids(self, servertype_id):
+        return self._related_via_attribute_ids.get(servertype_id, frozenset())
+
+
+def get_access_control(reload=False):
+    """Return the current access control snapshot
+
+    It is loaded again from the database, if the groups or the metadata
+    were changed since the last time.  See get_metadata() for the timeout.
+    """
+    global _registry
+
+    version = _version.get()
+    metadata = get_metadata()
+    registry = _registry
+    if (
+        reload or
+        registry is None or
+        registry.version != version or
+        registry.metadata_version != metadata.version or
+        registry.loaded_at + settings.METADATA_CACHE_TIMEOUT < monotonic()
+    ):
+        registry = _registry = AccessControlRegistry(version, metadata)
+
+    return registry
+
+
+@receiver(post_save, sender=AccessControlGroup)
+@receiver(post_delete, sender=AccessControlGroup)
+@receiver(m2m_changed, sender=AccessControlGroup.attributes.through)
+@receiver(m2m_changed, sender=AccessControlGroup.members.through)
+@receiver(m2m_changed, sender=AccessControlGroup.applications.through)
+@receiver(post_migrate)
+def invalidate_access_control(sender, **kwargs):
+    # See invalidate_metadata() for why we invalidate twice.
+    _version.bump()
+    transaction.on_commit(_version.bump)
@@ -0,0 +1,27 @@
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+
+from serveradmin.access_control.models import AccessControlGroup
+from serveradmin.access_control.registry import get_access_control
+
+
+class TestAccessControlRegistry(TransactionTestCase):
+    fixtures = ['auth_user.json', 'test_dataset.json']
+
+    def test_invalidated_on_changes(self):
+        user = User.objects.first()
+        acl = AccessControlGroup.objects.create(
+            name='test', query='servertype=vm', is_whitelist=False
+        )
+        acl.members.add(user)
+        groups = get_access_control().get_groups(user=user)
+        self.assertEqual([g.pk for g in groups], [acl.pk])
+        self.assertIn('os', groups[0].permissible_attribute_ids)
+        self.assertIn('servertype', groups[0].filters)
+
+        acl.attributes.add('os')
+        groups = get_access_control().get_groups(user=user)
+        self.assertNotIn('os', groups[0].permissible_attribute_ids)
+
+        acl.members.remove(user)
+        self.assertEqual(get_access_control().get_groups(user=user), [])
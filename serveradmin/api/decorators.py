@@ -15,9 +15,10 @@ from django.core.exceptions import (
     SuspiciousOperation,
     ValidationError,
 )
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.utils.crypto import constant_time_compare
+from django.utils.crypto import constant_time_compare, salted_hmac
 from django.utils import timezone, dateformat
 
 from paramiko.message import Message
@@ -28,8 +29,10 @@ from adminapi.request import (
     json_encode_extra,
 )
 from adminapi.filters import FilterValueError
-from serveradmin.apps.models import Application, PublicKey
+from serveradmin.apps.auth_cache import get_application, get_public_keys
+from serveradmin.apps.logins import record_login
 from serveradmin.api import AVAILABLE_API_FUNCTIONS
+from serveradmin.serverdb.routers import client_context
 
 logger = getLogger('serveradmin')
 
@@ -52,6 +55,7 @@ def api_view(view):
         signatures = request.META.get('HTTP_X_SIGNATURES')
         app_id = request.META.get('HTTP_X_APPLICATION')
         token = request.META.get('HTTP_X_SECURITYTOKEN')
+        session_id = request.META.get('HTTP_X_SESSION')
         then = datetime.utcfromtimestamp(
             int(request.META['HTTP_X_TIMESTAMP'])
         ).replace(tzinfo=timezone.utc)
@@ -60,9 +64,11 @@ def api_view(view):
 
         try:
             app = authenticate_app(
-                public_keys, signatures, app_id, token, then, now, body
+                public_keys, signatures, app_id, token, then, now, body,
+                session_id,
             )
-            return_value = view(request, app, body_json)
+            with client_context(app=app):
+                return_value = view(request, app, body_json)
 
             logger.info('api: Call: ' + (', '.join([
                 'Method: {}'.format(view.__name__),
@@ -101,6 +107,12 @@ def api_view(view):
                 }
             }
 
+        # The views can stream their results.  The errors occurring while
+        # streaming cannot be reported, because the response has already
+        # started.  The clients would notice it by the response being cut.
+        if isinstance(return_value, StreamingHttpResponse):
+            return return_value
+
         return HttpResponse(
             json.dumps(return_value, default=json_encode_extra),
             content_type='application/x-json',
@@ -111,7 +123,7 @@ def api_view(view):
 
 
 def authenticate_app(
-    public_keys, signatures, app_id, token, then, now, body
+    public_keys, signatures, app_id, token, then, now, body, session_id=None
 ):
     """Authenticate requests
 
@@ -119,7 +131,8 @@ def authenticate_app(
     contained in the request is no more than TIMESTAMP_GRACE_PERIOD seconds
     removed from the current server time or raise PermissionDenied.
 
-    Hand over the real verification of auth token HMACs to authenticate_app_psk
+    Hand over the real verification of auth token HMACs to
+    authenticate_app_psk, session token HMACs to authenticate_app_session
     or public key signatures to authenticate_app_ssh.
 
     Ensure that the application and applications owner aren't deactivated or
@@ -139,6 +152,10 @@ def authenticate_app(
     timestamp = dateformat.format(then, u'U')
     if public_keys and signatures:
         app = authenticate_app_ssh(public_keys, signatures, timestamp, body)
+    elif session_id and token:
+        app = authenticate_app_session(
+            session_id, token, timestamp, body, now
+        )
     elif app_id and token:
         app = authenticate_app_psk(app_id, token, timestamp, body)
     else:
@@ -150,12 +167,9 @@ def authenticate_app(
     if app.disabled:
         raise PermissionDenied('Disabled application {}'.format(app.id))
 
-    # Note when this app was last used. We don't update this information more
-    # than once every minute. Some apps authenticate thousand of times per
-    # minute, that would be a lot of useless commits.
-    if not app.last_login or (now - app.last_login) > timedelta(minutes=1):
-        app.last_login = now
-        app.save()
+    # Note when this app was last used.  It is written to the database
+    # after the request.
+    record_login(app, now)
 
     return app
 
@@ -171,10 +185,9 @@ def authenticate_app_psk(app_id, security_token, timestamp, body):
 
     Return the app the user authenticated to
     """
-    try:
-        app = Application.objects.get(app_id=app_id)
-    except Application.DoesNotExist as error:
-        raise PermissionDenied(error)
+    app = get_application(app_id)
+    if app is None:
+        raise PermissionDenied('Application matching query does not exist.')
 
     expected_proof = calc_security_token(app.auth_token, timestamp, body)
     if not constant_time_compare(expected_proof, security_token):
@@ -183,6 +196,68 @@ def authenticate_app_psk(app_id, security_token, timestamp, body):
     return app
 
 
+def authenticate_app_session(session_id, security_token, timestamp, body, now):
+    """Authenticate request HMAC made with a session token
+
+    The session tokens are handed out by create_session() to the clients
+    authenticated with their SSH keys.  They are not stored anywhere, but
+    derived from the session id, so we can recreate them to verify
+    the security token the same way as authenticate_app_psk() does.
+
+    If the session is expired, or the security token doesn't match, we
+    raise PermissionDenied.
+
+    Return the app the user authenticated to
+    """
+    try:
+        app_id, expires = session_id.split(':')
+        expires = int(expires)
+    except ValueError:
+        raise SuspiciousOperation('Malformed session id')
+
+    if expires < now.timestamp():
+        raise PermissionDenied('Session expired')
+
+    app = get_application(app_id)
+    if app is None:
+        raise PermissionDenied('Application matching query does not exist.')
+
+    expected_proof = calc_security_token(
+        get_session_token(app, session_id), timestamp, body
+    )
+    if not constant_time_compare(expected_proof, security_token):
+        raise PermissionDenied('Invalid security token')
+
+    return app
+
+
+def create_session(app, now):
+    """Create a session for the app
+
+    The session id consists of the app_id and the expiry timestamp.
+
+    Return the session id and the session token
+    """
+    session_id = '{}:{:.0f}'.format(
+        app.app_id, now.timestamp() + settings.API_SESSION_TIMEOUT
+    )
+
+    return session_id, get_session_token(app, session_id)
+
+
+def get_session_token(app, session_id):
+    """Derive the session token from the session id
+
+    The auth token of the app is mixed in, so that the sessions are
+    invalidated together with it.
+    """
+    return salted_hmac(
+        'serveradmin.api.session',
+        session_id + ':' + app.auth_token,
+        algorithm='sha256',
+    ).hexdigest()
+
+
 def authenticate_app_ssh(public_keys, signatures, timestamp, body):
     """Authenticate request signature
 
@@ -203,7 +278,7 @@ def authenticate_app_ssh(public_keys, signatures, timestamp, body):
     Return the app the user authenticated to
     """
 
-    def verify_signature(public_key, signature):
+    def verify_signature(public_key, loaded_key, signature):
         """Verify a single signature
 
         Raise PermissionDenied if the signature is invalid
@@ -211,7 +286,7 @@ def authenticate_app_ssh(public_keys, signatures, timestamp, body):
         Return the public key on success
         """
         expected_message = calc_message(timestamp, body)
-        if not public_key.load().verify_ssh_sig(
+        if not loaded_key.verify_ssh_sig(
             data=expected_message.encode(),
             msg=Message(b64decode(signature))
         ):
@@ -223,11 +298,11 @@ def authenticate_app_ssh(public_keys, signatures, timestamp, body):
     if len(key_signatures) > 20:
         raise SuspiciousOperation('Over 20 signatures in one request')
 
+    # The public keys are cached already loaded.
     verified_keys = {
-        verify_signature(public_key, key_signatures[public_key.key_base64])
-        for public_key in PublicKey.objects.filter(
-            key_base64__in=key_signatures.keys()
-        )
+        verify_signature(public_key, loaded_key, key_signatures[key_base64])
+        for key_base64, (public_key, loaded_key)
+        in get_public_keys(key_signatures.keys()).items()
     }
 
     if not verified_keys:
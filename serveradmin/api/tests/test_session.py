@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.exceptions import PermissionDenied
+from django.test import TransactionTestCase
+from django.utils import dateformat, timezone
+
+from adminapi.request import calc_security_token
+from serveradmin.api.decorators import authenticate_app, create_session
+from serveradmin.apps.models import Application
+
+
+class SessionTest(TransactionTestCase):
+    fixtures = ['auth_user.json']
+
+    def setUp(self):
+        self.app = Application.objects.create(
+            name='test', owner=User.objects.first(), location='test'
+        )
+        self.now = timezone.now()
+
+    def authenticate(self, session_id, session_token, now):
+        timestamp = dateformat.format(now, 'U')
+        token = calc_security_token(session_token, timestamp, '{}')
+        return authenticate_app(
+            None, None, None, token, now, now, '{}', session_id
+        )
+
+    def test_authenticate(self):
+        session_id, session_token = create_session(self.app, self.now)
+        self.assertEqual(
+            self.authenticate(session_id, session_token, self.now), self.app
+        )
+
+    def test_expired(self):
+        session_id, session_token = create_session(self.app, self.now)
+        with self.assertRaisesMessage(PermissionDenied, 'Session expired'):
+            self.authenticate(
+                session_id, session_token, self.now + timedelta(hours=1)
+            )
+
+    def test_extended(self):
+        session_id, session_token = create_session(self.app, self.now)
+        session_id = session_id.rsplit(':', 1)[0] + ':9999999999'
+        with self.assertRaisesMessage(PermissionDenied, 'security token'):
+            self.authenticate(session_id, session_token, self.now)
+
+    def test_auth_token_changed(self):
+        session_id, session_token = create_session(self.app, self.now)
+        self.app.auth_token = ''
+        self.app.save()
+        with self.assertRaises(PermissionDenied):
+            self.authenticate(session_id, session_token, self.now)
@@ -8,15 +8,19 @@ from django.urls import path
 from serveradmin.api.views import (
     health_check,
     dataset_query,
+    dataset_multi_query,
     dataset_commit,
     dataset_new_object,
     api_call,
+    api_session,
 )
 
 urlpatterns = [
     path('health_check', health_check),
     path('dataset/query', dataset_query),
+    path('dataset/multi_query', dataset_multi_query),
     path('dataset/commit', dataset_commit),
     path('dataset/new_object', dataset_new_object),
     path('call', api_call),
+    path('session', api_session),
 ]
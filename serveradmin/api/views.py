@@ -3,21 +3,32 @@
 Copyright (c) 2019 InnoGames GmbH
 """
 
+import json
+
+from django.conf import settings
 from django.core.exceptions import (
     SuspiciousOperation,
     PermissionDenied,
     ValidationError,
 )
+from django.http import StreamingHttpResponse
 from django.template.response import HttpResponse
+from django.utils import timezone
 
 from adminapi.filters import BaseFilter, FilterValueError
+from adminapi.request import STREAM_FOOTER, STREAM_HEADER, json_encode_extra
 from serveradmin.api import ApiError, AVAILABLE_API_FUNCTIONS
-from serveradmin.api.decorators import api_view
+from serveradmin.api.decorators import api_view, create_session
 from serveradmin.serverdb.query_committer import commit_query
-from serveradmin.serverdb.query_executer import execute_query
+from serveradmin.serverdb.query_executer import (
+    execute_queries,
+    execute_query,
+    execute_query_stream,
+)
 from serveradmin.serverdb.query_materializer import (
     get_default_attribute_values
 )
+from serveradmin.serverdb.query_profile import QueryProfile
 
 
 class StringEncoder(object):
@@ -43,23 +54,53 @@ def health_check(request):
     return HttpResponse(status=242)
 
 
+@api_view
+def api_session(request, app, data):
+    """Create a session to sign the following requests with
+
+    Signing with the SSH keys is expensive, especially with the ones on
+    the hardware tokens.  The clients authenticated with them can sign
+    the following requests with the session token instead until the
+    session expires.  Sessions cannot be created with the sessions,
+    so they cannot be extended without the keys.
+    """
+    if not (
+        request.META.get('HTTP_X_PUBLICKEYS') and
+        request.META.get('HTTP_X_SIGNATURES')
+    ):
+        raise PermissionDenied(
+            'Sessions can only be created authenticating with SSH keys'
+        )
+
+    session_id, session_token = create_session(app, timezone.now())
+
+    return {
+        'status': 'success',
+        'session_id': session_id,
+        'session_token': session_token,
+        'expires_in': settings.API_SESSION_TIMEOUT,
+    }
+
+
 @api_view
 def dataset_query(request, app, data):
     try:
-        if 'filters' not in data or not isinstance(data['filters'], dict):
-            raise SuspiciousOperation('Filters must be a dictionary')
-        filters = {}
-        for attr, filter_obj in data['filters'].items():
-            filters[attr] = BaseFilter.deserialize(filter_obj)
-
-        # Empty list means query all attributes to the older versions of
-        # the adminapi.
-        if not data.get('restrict'):
-            restrict = None
-        else:
-            restrict = data['restrict']
+        filters, restrict, order_by = _parse_query(data)
+
+        if data.get('stream'):
+            if data.get('profile'):
+                raise SuspiciousOperation(
+                    'Streamed queries cannot be profiled'
+                )
+            return StreamingHttpResponse(
+                _stream_results(
+                    execute_query_stream(filters, restrict, order_by)
+                ),
+                content_type='application/x-json',
+            )
 
-        order_by = data.get('order_by')
+        if data.get('profile'):
+            return _profile_query(filters, restrict, order_by)
 
         return {
             'status': 'success',
@@ -73,6 +114,78 @@ def dataset_query(request, app, data):
         }
 
 
+@api_view
+def dataset_multi_query(request, app, data):
+    if 'queries' not in data or not isinstance(data['queries'], list):
+        raise SuspiciousOperation('Queries must be a list')
+
+    try:
+        queries = [_parse_query(q) for q in data['queries']]
+
+        return {
+            'status': 'success',
+            'results': execute_queries(queries),
+        }
+    except (FilterValueError, ValidationError) as error:
+        return {
+            'status': 'error',
+            'type': 'ValueError',
+            'message': str(error),
+        }
+
+
+def _parse_query(data):
+    if (
+        not isinstance(data, dict) or
+        'filters' not in data or
+        not isinstance(data['filters'], dict)
+    ):
+        raise SuspiciousOperation('Filters must be a dictionary')
+    filters = {}
+    for attr, filter_obj in data['filters'].items():
+        filters[attr] = BaseFilter.deserialize(filter_obj)
+
+    # Empty list means query all attributes to the older versions of
+    # the adminapi.
+    if not data.get('restrict'):
+        restrict = None
+    else:
+        restrict = data['restrict']
+
+    return filters, restrict, data.get('order_by')
+
+
+def _profile_query(filters, restrict, order_by):
+    profile = QueryProfile()
+    with profile.measure('total'):
+        result = execute_query(filters, restrict, order_by, profile=profile)
+
+    # The response is going to be serialized once more by the decorator.
+    # We serialize the result in here only to measure how long it takes.
+    with profile.measure('serialization'):
+        json.dumps(result, default=json_encode_extra)
+
+    return {
+        'status': 'success',
+        'result': result,
+        'profile': profile.serialize(),
+    }
+
+
+def _stream_results(chunks):
+    """Serialize the results as JSON array with one object per line"""
+    yield STREAM_HEADER
+    separator = '\n'
+    for chunk in chunks:
+        lines = []
+        for obj in chunk:
+            lines.append(separator)
+            lines.append(json.dumps(obj, default=json_encode_extra))
+            separator = '\n,'
+        yield ''.join(lines)
+    yield '\n' + STREAM_FOOTER
+
+
 @api_view
 def dataset_new_object(request, app, data):
     try:
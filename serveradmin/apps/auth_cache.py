@@ -0,0 +1,148 @@
+"""Serveradmin - Authentication Cache
+
+Copyright (c) 2024 InnoGames GmbH
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from serveradmin.apps.models import Application, PublicKey
+from serveradmin.common.cache_version import CacheVersion
+
+VERSION_CACHE_KEY = 'serveradmin_auth_cache_version'
+
+# The unknown app_ids and public keys are cached too, so that the clients
+# sending them don't cost a database query on every request.  The number of
+# the entries is limited, because anybody can send those.
+AUTH_CACHE_MAX_ENTRIES = 10000
+
+# The marker for the entries not on the cache
+MISSING = object()
+
+
+class AuthCache:
+    """LRU cache of the records needed to authenticate the API requests
+
+    The entries are tagged with the version they are loaded in.  Every
+    change on the applications, their public keys and their owners bumps
+    the version, so everything cached before it becomes stale at once.
+    The entries also expire after AUTH_CACHE_TIMEOUT, because the models
+    can be changed without emitting the signals.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is None or
+                entry[0] != version or
+                entry[1] < monotonic()
+            ):
+                return MISSING
+
+            self._entries.move_to_end(key)
+
+        return entry[2]
+
+    def set(self, key, version, value):
+        expires = monotonic() + settings.AUTH_CACHE_TIMEOUT
+        with self._lock:
+            self._entries.pop(key, None)
+            while len(self._entries) >= AUTH_CACHE_MAX_ENTRIES:
+                self._entries.popitem(last=False)
+            self._entries[key] = (version, expires, value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+auth_cache = AuthCache()
+auth_cache_version = CacheVersion(VERSION_CACHE_KEY)
+
+
+def get_application(app_id):
+    """Return the application with its owner or None if it doesn't exist
+
+    The returned objects are shared between the requests.  They must not
+    be modified, except for recording the last login.
+    """
+    # The version has to be fetched before loading from the database.  If
+    # a change happens in between, what we would cache is going to be
+    # considered stale already.
+    version = auth_cache_version.get()
+    key = ('application', app_id)
+    application = auth_cache.get(key, version)
+    if application is MISSING:
+        application = (
+            Application.objects
+            .select_related('owner')
+            .filter(app_id=app_id)
+            .first()
+        )
+        auth_cache.set(key, version, application)
+
+    return application
+
+
+def get_public_keys(keys_base64):
+    """Return the known ones of the given public keys
+
+    They are returned indexed by the key_base64 as the PublicKey objects
+    with their applications and their owners, together with the loaded
+    keys ready to verify the signatures.  The returned objects are shared
+    between the requests.  They must not be modified.
+    """
+    version = auth_cache_version.get()
+    public_keys = {}
+    missing = []
+    for key_base64 in keys_base64:
+        entry = auth_cache.get(('public_key', key_base64), version)
+        if entry is MISSING:
+            missing.append(key_base64)
+        elif entry is not None:
+            public_keys[key_base64] = entry
+
+    if missing:
+        loaded = {
+            k.key_base64: (k, k.load())
+            for k in (
+                PublicKey.objects
+                .select_related('application__owner')
+                .filter(key_base64__in=missing)
+            )
+        }
+        for key_base64 in missing:
+            entry = loaded.get(key_base64)
+            auth_cache.set(('public_key', key_base64), version, entry)
+            if entry is not None:
+                public_keys[key_base64] = entry
+
+    return public_keys
+
+
+@receiver(post_save, sender=Application)
+@receiver(post_delete, sender=Application)
+@receiver(post_save, sender=PublicKey)
+@receiver(post_delete, sender=PublicKey)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_auth_cache(sender, update_fields=None, **kwargs):
+    # Recording the logins doesn't change anything we cache.
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+
+    # See invalidate_metadata() for why we invalidate twice.
+    auth_cache_version.bump()
+    transaction.on_commit(auth_cache_version.bump)
@@ -0,0 +1,107 @@
+"""Serveradmin - Application Logins
+
+Copyright (c) 2024 InnoGames GmbH
+"""
+
+import atexit
+from datetime import timedelta
+from logging import getLogger
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import DatabaseError, connection
+from django.dispatch import receiver
+
+from serveradmin.apps.models import Application
+
+logger = getLogger('serveradmin')
+
+# We don't record the logins of an app more than once every minute.  Some
+# apps authenticate thousand of times per minute.
+LAST_LOGIN_RESOLUTION = timedelta(minutes=1)
+
+# The query to update the last logins of many apps at once.  The concurrent
+# processes might flush out of order, so the later logins always win.
+LAST_LOGINS_UPDATE_QUERY = (
+    'UPDATE {0} AS app'
+    ' SET last_login = logins.last_login'
+    ' FROM unnest(%s::integer[], %s::timestamptz[])'
+    ' AS logins(app_id, last_login)'
+    ' WHERE app.id = logins.app_id'
+    ' AND (app.last_login IS NULL OR app.last_login < logins.last_login)'
+).format(Application._meta.db_table)
+
+_lock = Lock()
+_pending_logins = {}
+_flushed_at = monotonic()
+
+
+def record_login(app, now):
+    """Note when the app was last used
+
+    The logins are buffered by the process, and written by flush_logins()
+    after the requests in bulk.  The given app is updated right away, so
+    that the following requests with the same cached app are not recorded
+    again.
+    """
+    if app.last_login and now - app.last_login <= LAST_LOGIN_RESOLUTION:
+        return
+
+    app.last_login = now
+    with _lock:
+        _pending_logins[app.pk] = now
+
+
+def flush_logins(force=False):
+    """Write the buffered logins to the database
+
+    They are written at most once every LAST_LOGINS_FLUSH_INTERVAL, unless
+    forced.  They are put back to be written with the next flush, if
+    writing them fails.
+    """
+    global _flushed_at
+
+    with _lock:
+        if not _pending_logins or (
+            not force and
+            _flushed_at + settings.LAST_LOGINS_FLUSH_INTERVAL > monotonic()
+        ):
+            return
+
+        logins = dict(_pending_logins)
+        _pending_logins.clear()
+        _flushed_at = monotonic()
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                LAST_LOGINS_UPDATE_QUERY,
+                [list(logins), list(logins.values())],
+            )
+    except DatabaseError:
+        # The apps might have logged in again in the meantime.
+        with _lock:
+            for app_id, last_login in logins.items():
+                _pending_logins[app_id] = max(
+                    last_login, _pending_logins.get(app_id, last_login)
+                )
+        raise
+
+
+@receiver(request_finished)
+def flush_logins_after_request(sender, **kwargs):
+    # The response is already sent to the client at this point.
+    try:
+        flush_logins()
+    except DatabaseError as error:
+        logger.error('Writing the last logins failed: {}'.format(error))
+
+
+@atexit.register
+def flush_logins_on_exit():
+    try:
+        flush_logins(force=True)
+    except DatabaseError as error:
+        logger.error('Writing the last logins failed: {}'.format(error))
@@ -0,0 +1,43 @@
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase
+
+from serveradmin.apps.auth_cache import auth_cache, get_application
+from serveradmin.apps.models import Application
+
+
+class AuthCacheTest(TransactionTestCase):
+    fixtures = ['auth_user.json']
+
+    def setUp(self):
+        auth_cache.clear()
+        self.app = Application.objects.create(
+            name='test', owner=User.objects.first(), location='test'
+        )
+
+    def test_cache_hit(self):
+        app = get_application(self.app.app_id)
+        self.assertEqual(app, self.app)
+        with self.assertNumQueries(0):
+            self.assertIs(get_application(self.app.app_id), app)
+            self.assertTrue(get_application(app.app_id).owner.is_active)
+
+    def test_unknown_cached(self):
+        self.assertIsNone(get_application('unknown'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_application('unknown'))
+
+    def test_last_login_does_not_invalidate(self):
+        app = get_application(self.app.app_id)
+        app.save(update_fields=['last_login'])
+        self.assertIs(get_application(self.app.app_id), app)
+
+    def test_changes_invalidate(self):
+        self.assertFalse(get_application(self.app.app_id).disabled)
+        self.app.disabled = True
+        self.app.save()
+        self.assertTrue(get_application(self.app.app_id).disabled)
+
+        owner = self.app.owner
+        owner.is_active = False
+        owner.save()
+        self.assertFalse(get_application(self.app.app_id).owner.is_active)
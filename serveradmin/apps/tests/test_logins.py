@@ -0,0 +1,67 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from serveradmin.apps.logins import (
+    flush_logins,
+    flush_logins_after_request,
+    record_login,
+)
+from serveradmin.apps.models import Application
+
+
+class LoginsTest(TransactionTestCase):
+    fixtures = ['auth_user.json']
+
+    def setUp(self):
+        self.app = Application.objects.create(
+            name='test', owner=User.objects.first(), location='test'
+        )
+
+    def get_last_login(self):
+        return Application.objects.get(pk=self.app.pk).last_login
+
+    def test_buffered(self):
+        now = timezone.now()
+        record_login(self.app, now)
+        self.assertEqual(self.app.last_login, now)
+        self.assertIsNone(self.get_last_login())
+
+        flush_logins(force=True)
+        self.assertEqual(self.get_last_login(), now)
+
+    def test_not_recorded_again(self):
+        now = timezone.now()
+        record_login(self.app, now)
+        record_login(self.app, now + timedelta(seconds=30))
+        flush_logins(force=True)
+        self.assertEqual(self.get_last_login(), now)
+
+    def test_later_login_wins(self):
+        now = timezone.now()
+        record_login(self.app, now)
+        flush_logins(force=True)
+
+        stale = Application.objects.get(pk=self.app.pk)
+        stale.last_login = None
+        record_login(stale, now - timedelta(minutes=5))
+        flush_logins(force=True)
+        self.assertEqual(self.get_last_login(), now)
+
+    @override_settings(LAST_LOGINS_FLUSH_INTERVAL=0)
+    def test_requeued_on_error(self):
+        now = timezone.now()
+        record_login(self.app, now)
+        with patch(
+            'serveradmin.apps.logins.LAST_LOGINS_UPDATE_QUERY',
+            'SELECT %s::integer[], %s::timestamptz[], 1 / 0',
+        ):
+            with self.assertLogs('serveradmin', 'ERROR'):
+                flush_logins_after_request(None)
+        self.assertIsNone(self.get_last_login())
+
+        flush_logins(force=True)
+        self.assertEqual(self.get_last_login(), now)
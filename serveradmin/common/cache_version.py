@@ -0,0 +1,48 @@
+"""Serveradmin - Cache Version
+
+Copyright (c) 2024 InnoGames GmbH
+"""
+
+from time import monotonic, time_ns
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class CacheVersion:
+    """Version of the data cached by every process
+
+    The version is kept on the Django cache framework for the changes made
+    by one process to reach the others, as long as a shared cache backend
+    is configured.  Reading it costs a round trip to the shared backend, so
+    we read it at most once every CACHE_VERSION_CHECK_INTERVAL.  The changes
+    made by this process are noticed right away.
+
+    The versions start from the current time instead of 0, so that they
+    don't repeat the ones seen before, if the cache backend loses them.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self._version = None
+        self._checked_at = 0.0
+
+    def get(self):
+        now = monotonic()
+        if (
+            self._version is None or
+            self._checked_at + settings.CACHE_VERSION_CHECK_INTERVAL < now
+        ):
+            self._version = cache.get_or_set(
+                self.key, time_ns, timeout=None
+            )
+            self._checked_at = now
+
+        return self._version
+
+    def bump(self):
+        try:
+            cache.incr(self.key)
+        except ValueError:
+            cache.set(self.key, time_ns(), timeout=None)
+        self._version = None
@@ -3,15 +3,74 @@
 Copyright (c) 2019 InnoGames GmbH
 """
 
-from adminapi.dataset import BaseQuery, DatasetObject as ApiDatasetObject
+from weakref import finalize, ref
+
+from adminapi.dataset import (
+    BaseQuery,
+    DatasetObject as ApiDatasetObject,
+    MultiAttr,
+)
+from adminapi.exceptions import DatasetError
+from serveradmin.serverdb.metadata import get_metadata
+from serveradmin.serverdb.models import Attribute
 from serveradmin.serverdb.query_committer import commit_query
-from serveradmin.serverdb.query_executer import execute_query
+from serveradmin.serverdb.query_executer import (
+    execute_count,
+    execute_lazy_query,
+    execute_query,
+    materialize_attributes,
+)
 from serveradmin.serverdb.query_materializer import (
     get_default_attribute_values
 )
+from serveradmin.serverdb.query_profile import QueryProfile
 
 
 class Query(BaseQuery):
+    def __init__(
+        self,
+        filters=None,
+        restrict=['hostname'],
+        order_by=None,
+        limit=None,
+        offset=0,
+        profile=False,
+        lazy=False,
+    ):
+        super().__init__(filters, restrict, order_by)
+        self._limit = limit
+        self._offset = offset
+        # The details of the execution are recorded on the profile, after
+        # the results are fetched.
+        self.profile = QueryProfile() if profile else None
+
+        # The lazy queries materialize only the special attributes first.
+        # The rest of the attributes are materialized the first time they
+        # are accessed on any of the objects.
+        if lazy and restrict is not None:
+            raise DatasetError('Only the queries without restrict can be lazy')
+        self._lazy = lazy
+        self._loader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the snapshot of the lazy query
+
+        The attributes not materialized yet cannot be accessed afterwards.
+        """
+        if self._loader is not None:
+            self._loader.close()
+
+    def count(self):
+        """Count all of the matching objects ignoring the limit and offset"""
+        if self._filters is None:
+            return 0
+        return execute_count(self._filters)
 
     def _fetch_new_object(self, servertype):
         return DatasetObject(get_default_attribute_values(servertype))
@@ -22,7 +81,21 @@ class Query(BaseQuery):
         self._confirm_changes()
 
     def _fetch_results(self):
-        return execute_query(self._filters, self._restrict, self._order_by)
+        if self._lazy:
+            snapshot, results = execute_lazy_query(
+                self._filters, self._order_by, self._limit, self._offset
+            )
+            self._loader = _LazyLoader(snapshot)
+            return self._loader.create_objects(results)
+
+        return execute_query(
+            self._filters,
+            self._restrict,
+            self._order_by,
+            self._limit,
+            self._offset,
+            self.profile,
+        )
 
 
 class DatasetObject(ApiDatasetObject):
@@ -30,3 +103,149 @@ class DatasetObject(ApiDatasetObject):
         commit_obj = self._build_commit_object()
         commit_query(app=app, user=user, **commit_obj)
         self._confirm_changes()
+
+
+# The marker for the attribute values not materialized yet
+NOT_LOADED = object()
+
+
+class LazyDatasetObject(DatasetObject):
+    """The objects of the lazy queries
+
+    The values of the attributes are materialized for all of the objects
+    of the query at once, the first time they are accessed.  The methods
+    returning all of the values materialize all of the attributes.
+    """
+
+    def __init__(self, attributes, object_id, loader):
+        super().__init__(attributes, object_id)
+        self._loader = loader
+
+    __hash__ = DatasetObject.__hash__
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if value is NOT_LOADED:
+            self._loader.load([key])
+            value = super().__getitem__(key)
+        return value
+
+    def __iter__(self):
+        # Overriding this prevents dict() and the like from accessing
+        # the values without calling __getitem__().
+        return super().__iter__()
+
+    def __eq__(self, other):
+        self._loader.load()
+        if isinstance(other, LazyDatasetObject):
+            other._loader.load()
+        return super().__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        self._loader.load()
+        return super().__repr__()
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self[key]
+
+    def items(self):
+        self._loader.load()
+        return super().items()
+
+    def values(self):
+        self._loader.load()
+        return super().values()
+
+    def copy(self):
+        self._loader.load()
+        return super().copy()
+
+
+class _LazyLoader:
+    """Materialize the attributes of the objects of a lazy query
+
+    The loader keeps the snapshot of the database the query is executed
+    on.  The snapshot is closed, after all of the attributes are
+    materialized, the query is closed, the snapshot is left idle for
+    QUERY_SNAPSHOT_TIMEOUT, or the objects are garbage collected.  The
+    attributes cannot be materialized after the snapshot is gone.
+
+    The objects reference the loader, but the loader references them only
+    weakly, so that it is freed together with the last one of them.
+    """
+
+    def __init__(self, snapshot):
+        self._snapshot = snapshot
+        self._close = finalize(self, snapshot.close)
+        self._pending = set()
+        self._objects = []
+
+    def create_objects(self, results):
+        metadata = get_metadata()
+        objects = []
+        for result in results:
+            attributes = dict(result)
+            for attribute_id in metadata.get_servertype_attributes(
+                result['servertype']
+            ):
+                if attribute_id not in Attribute.specials:
+                    attributes[attribute_id] = NOT_LOADED
+                    self._pending.add(attribute_id)
+            obj = LazyDatasetObject(attributes, result.object_id, self)
+            self._objects.append(ref(obj))
+            objects.append(obj)
+
+        if not self._pending:
+            self.close()
+
+        return objects
+
+    def close(self):
+        self._close()
+
+    def load(self, attribute_ids=None):
+        """Materialize the attributes of all of the objects
+
+        All of the pending attributes are materialized, if none are given.
+        """
+        if attribute_ids is None:
+            attribute_ids = set(self._pending)
+        else:
+            attribute_ids = self._pending.intersection(attribute_ids)
+        if not attribute_ids:
+            return
+        if not self._close.alive:
+            raise DatasetError('The snapshot of the query is closed')
+
+        objects = [o for o in (r() for r in self._objects) if o is not None]
+        results = {
+            r.object_id: r
+            for r in materialize_attributes(
+                self._snapshot,
+                [o.object_id for o in objects],
+                list(attribute_ids),
+            )
+        }
+        for obj in objects:
+            result = results.get(obj.object_id, {})
+            for attribute_id in attribute_ids:
+                if dict.get(obj, attribute_id) is not NOT_LOADED:
+                    continue
+                if attribute_id not in result:
+                    # The attribute must have been added to the servertype
+                    # after the snapshot.
+                    dict.__delitem__(obj, attribute_id)
+                    continue
+                value = result[attribute_id]
+                if isinstance(value, MultiAttr):
+                    value = MultiAttr(value, obj, attribute_id)
+                dict.__setitem__(obj, attribute_id, value)
+
+        self._pending -= attribute_ids
+        if not self._pending:
+            self.close()
@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class ServerdbConfig(AppConfig):
+    name = 'serveradmin.serverdb'
+    verbose_name = "Serverdb"
+
+    def ready(self):
+        # Connect the signal receivers invalidating the caches
+        import serveradmin.serverdb.metadata # noqa
+        import serveradmin.serverdb.query_cache # noqa
+        import serveradmin.serverdb.routers # noqa
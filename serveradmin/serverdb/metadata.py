@@ -0,0 +1,131 @@
+"""Serveradmin - Metadata Registry
+
+Copyright (c) 2024 InnoGames GmbH
+"""
+
+from time import monotonic
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from serveradmin.common.cache_version import CacheVersion
+from serveradmin.serverdb.models import (
+    Attribute,
+    Servertype,
+    ServertypeAttribute,
+)
+
+VERSION_CACHE_KEY = 'serveradmin_metadata_version'
+
+_version = CacheVersion(VERSION_CACHE_KEY)
+
+_metadata = None
+
+
+class Metadata:
+    """Snapshot of the attributes, servertypes and their relations
+
+    The metadata is changed very rarely, but it is needed by all of
+    the queries and commits.  We load all of it at once, and link the model
+    objects to each other, so that following the relations including
+    the related via attributes doesn't hit the database.  The objects are
+    shared between all of the users of the snapshot.  They must not be
+    modified.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.loaded_at = monotonic()
+        self.servertypes = {s.pk: s for s in Servertype.objects.all()}
+        self.attributes = {a.pk: a for a in Attribute.objects.all()}
+        for attribute in self.attributes.values():
+            if attribute.target_servertype_id:
+                attribute.target_servertype = (
+                    self.servertypes[attribute.target_servertype_id]
+                )
+            if attribute.reversed_attribute_id:
+                attribute.reversed_attribute = (
+                    self.attributes[attribute.reversed_attribute_id]
+                )
+
+        self._servertype_attributes = {s: {} for s in self.servertypes}
+        self._attribute_servertype_attributes = {
+            a: [] for a in self.attributes
+        }
+        for sa in ServertypeAttribute.objects.all():
+            sa.servertype = self.servertypes[sa.servertype_id]
+            sa.attribute = self.attributes[sa.attribute_id]
+            sa.related_via_attribute = self.attributes.get(
+                sa.related_via_attribute_id
+            )
+            sa.consistent_via_attribute = self.attributes.get(
+                sa.consistent_via_attribute_id
+            )
+            attributes = self._servertype_attributes[sa.servertype_id]
+            attributes[sa.attribute_id] = sa
+            self._attribute_servertype_attributes[sa.attribute_id].append(sa)
+
+    def get_servertype(self, servertype_id):
+        try:
+            return self.servertypes[servertype_id]
+        except KeyError:
+            raise Servertype.DoesNotExist(
+                'No servertype "{}"'.format(servertype_id)
+            )
+
+    def get_servertype_attributes(self, servertype_id):
+        """Return the servertype attributes indexed by the attribute_id"""
+        return self._servertype_attributes.get(servertype_id, {})
+
+    def get_servertype_attribute(self, servertype_id, attribute_id):
+        try:
+            return self._servertype_attributes[servertype_id][attribute_id]
+        except KeyError:
+            raise ServertypeAttribute.DoesNotExist(
+                'No attribute "{}" on servertype "{}"'
+                .format(attribute_id, servertype_id)
+            )
+
+    def get_attribute_servertype_attributes(self, attribute_id):
+        """Return the servertype attributes of all servertypes having
+        the attribute"""
+        return self._attribute_servertype_attributes.get(attribute_id, [])
+
+
+def get_metadata(reload=False):
+    """Return the current metadata snapshot
+
+    It is loaded again from the database, if it was changed since the last
+    time.  The changes made by other processes cannot be noticed without
+    a shared cache backend, so we also load it again after a timeout.
+    """
+    global _metadata
+
+    version = _version.get()
+    metadata = _metadata
+    if (
+        reload or
+        metadata is None or
+        metadata.version != version or
+        metadata.loaded_at + settings.METADATA_CACHE_TIMEOUT < monotonic()
+    ):
+        metadata = _metadata = Metadata(version)
+
+    return metadata
+
+
+@receiver(post_save, sender=Attribute)
+@receiver(post_save, sender=Servertype)
+@receiver(post_save, sender=ServertypeAttribute)
+@receiver(post_delete, sender=Attribute)
+@receiver(post_delete, sender=Servertype)
+@receiver(post_delete, sender=ServertypeAttribute)
+@receiver(post_migrate)
+def invalidate_metadata(sender, **kwargs):
+    # We invalidate the metadata right away for the current process to
+    # see the changes.  Other processes might load the old state again until
+    # the transaction is committed, so we invalidate once more after it.
+    _version.bump()
+    transaction.on_commit(_version.bump)
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('serverdb', '0019_drop_intern_ip_constraint'),
+    ]
+
+    operations = [
+        # The supernet attributes are materialized by joining the networks
+        # containing the intern_ip of the servers.
+        migrations.RunSQL(
+            'CREATE EXTENSION IF NOT EXISTS btree_gist',
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS server_intern_ip_gist '
+            'ON server USING gist (servertype_id, intern_ip inet_ops)',
+            'DROP INDEX IF EXISTS server_intern_ip_gist',
+        ),
+    ]
@@ -22,8 +22,7 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import RegexValidator
-from django.db import models
-from django.db.models import Q
+from django.db import connection, models
 from django.utils.timezone import now
 from django.utils.translation import gettext as _
 from netaddr import EUI
@@ -52,6 +51,55 @@ IP_ADDR_TYPES = [
     ('network', 'network: intern_ip and inet must be an ip network, not overlapping with same servertype'),
 ]
 
+# The query to find the IP addresses conflicting with the given ones.
+# The addresses of the hosts must not be used by any other object except
+# the networks.  The networks must not overlap with the other networks of
+# the same servertype.
+IP_CONFLICTS_QUERY = (
+    'WITH given AS ('
+    ' SELECT * FROM unnest('
+    '  %s::integer[],'
+    '  %s::integer[],'
+    '  %s::text[],'
+    '  %s::inet[],'
+    '  %s::text[],'
+    '  %s::boolean[]'
+    ' ) AS given(item, server_id, attribute_id, value, servertype_id, network)'
+    ')'
+    ' SELECT given.item, server.server_id, NULL, server.intern_ip'
+    ' FROM given'
+    ' JOIN server ON server.intern_ip = given.value'
+    ' JOIN servertype ON servertype.servertype_id = server.servertype_id'
+    ' WHERE NOT given.network'
+    " AND servertype.ip_addr_type != 'network'"
+    ' AND server.server_id IS DISTINCT FROM given.server_id'
+    ' UNION ALL'
+    ' SELECT given.item, sa.server_id, sa.attribute_id, sa.value'
+    ' FROM given'
+    ' JOIN server_inet_attribute AS sa ON sa.value = given.value'
+    ' JOIN server ON server.server_id = sa.server_id'
+    ' JOIN servertype ON servertype.servertype_id = server.servertype_id'
+    ' WHERE NOT given.network'
+    " AND servertype.ip_addr_type != 'network'"
+    ' AND sa.server_id IS DISTINCT FROM given.server_id'
+    ' AND (given.attribute_id IS NULL OR sa.attribute_id = given.attribute_id)'
+    ' UNION ALL'
+    ' SELECT given.item, server.server_id, NULL, server.intern_ip'
+    ' FROM given'
+    ' JOIN server ON server.servertype_id = given.servertype_id'
+    ' WHERE given.network'
+    ' AND server.intern_ip && given.value'
+    ' AND server.server_id IS DISTINCT FROM given.server_id'
+    ' UNION ALL'
+    ' SELECT given.item, sa.server_id, sa.attribute_id, sa.value'
+    ' FROM given'
+    ' JOIN server_inet_attribute AS sa ON sa.value && given.value'
+    ' JOIN server ON server.server_id = sa.server_id'
+    ' WHERE given.network'
+    ' AND server.servertype_id = given.servertype_id'
+    ' AND sa.server_id IS DISTINCT FROM given.server_id'
+)
+
 LOOKUP_ID_VALIDATORS = [
     RegexValidator(r'\A[a-z][a-z0-9_]+\Z', 'Invalid id'),
 ]
@@ -95,53 +143,6 @@ def is_ip_address(ip_interface: Union[IPv4Interface, IPv6Interface]) -> None:
             'Netmask length must be {0}'.format(max_prefix_length))
 
 
-def is_unique_ip(ip_interface: Union[IPv4Interface, IPv6Interface],
-                 object_id: int,
-                 attribute_id: str = None) -> None:
-    """Validate if IPv4/IPv6 address is unique
-
-    Raises a ValidationError if intern_ip or any other attribute of type inet
-    with this ip_address already exists.
-
-    :param ip_interface:
-    :param object_id:
-    :param attribute_id:
-    :return:
-    """
-
-    # We avoid querying the duplicate hosts here and giving the user
-    # detailed information because checking with exists is cheaper than
-    # querying the server and this is a validation and should be fast.
-
-    # Always exclude the current object_id from the query because we allow
-    # duplication of data between the legacy (intern_ip, primary_ip6) and
-    # the modern (ipv4, ipv6) attributes.
-
-    # When operating on real attributes (not on intern_ip) find duplicates
-    # only withing the same attribute id. That means different hosts can have
-    # the same IP address as long as it is in different attributes.
-
-    # TODO: Make "aid" mandatory when intern_ip is gone.
-    if attribute_id:
-        object_attribute_condition = Q(server_id=object_id) | ~Q(attribute_id=attribute_id)
-    else:
-        object_attribute_condition = Q(server_id=object_id)
-
-    has_duplicates = (
-        # TODO: Remove intern_ip.
-        Server.objects.filter(intern_ip=ip_interface).exclude(
-            Q(servertype__ip_addr_type='network') |
-            Q(server_id=object_id)
-        ).exists() or
-        ServerInetAttribute.objects.filter(value=ip_interface).exclude(
-            Q(server__servertype__ip_addr_type='network') | object_attribute_condition
-        ).exists()
-    )
-    if has_duplicates:
-        raise ValidationError(
-            'An object with {0} already exists'.format(str(ip_interface)))
-
-
 def is_network(ip_interface: Union[IPv4Interface, IPv6Interface]) -> None:
     """Validate if IPv4/IPv6 interface is a network
 
@@ -173,39 +174,169 @@ def inet_to_python(obj: object) -> Union[IPv4Interface, IPv6Interface]:
         raise ValidationError(str(error))
 
 
-def network_overlaps(ip_interface: Union[IPv4Interface, IPv6Interface],
-                     servertype_id: str, object_id: int) -> None:
-    """Validate if network overlaps with other objects of the servertype_id
+def validate_ip_conflicts(inet_values) -> None:
+    """Validate the IP addresses of the objects all at once
 
-    Raises a ValidationError if the ip network overlaps with any other existing
-    objects network of the given servertype.
+    The values are given as tuples of the servers, the attribute_ids, or
+    None for intern_ip, and the ip_interfaces.  The IP addresses of
+    the objects with ip_addr_type "host" must be unique, and the networks
+    of the objects with ip_addr_type "network" must not overlap with any
+    other network of the same servertype.
 
-    :param ip_interface:
-    :param servertype_id:
-    :param object_id:
+    The values are checked against the database with a single query, and
+    against each other in memory.  The given values found on the database
+    are ignored, so they can be validated after they are saved.  Raises
+    a ValidationError with all of the violations.
+
+    :param inet_values:
     :return:
     """
 
-    overlaps = (
-        Server.objects.filter(
-            servertype=servertype_id,
-            intern_ip__net_overlaps=ip_interface
-        ).exclude(
-            server_id=object_id
-        ).exists() or
-        # TODO: We should filter for attribute id here as well to have
-        # consistent bebaviour with ip_addr_type: host and is_unique.
-        ServerInetAttribute.objects.filter(
-            server__servertype=servertype_id,
-            value__net_overlaps=ip_interface
-        ).exclude(
-            server_id=object_id
-        ).exists()
+    inet_values = list(inet_values)
+    violations = _get_ip_conflicts_on_database(inet_values)
+    violations.update(_get_duplicate_ips(inet_values))
+    violations.update(_get_overlapping_networks(inet_values))
+    if violations:
+        raise ValidationError([
+            message.format(str(inet_values[i][2]))
+            for i, message in sorted(violations.items())
+        ])
+
+
+def _get_ip_conflicts_on_database(inet_values):
+    """Find the conflicting IP addresses on the database
+
+    The violations are returned indexed by the positions of the values.
+    """
+
+    # Always exclude the current object from the query because we allow
+    # duplication of data between the legacy (intern_ip, primary_ip6) and
+    # the modern (ipv4, ipv6) attributes.
+    #
+    # When operating on real attributes (not on intern_ip) find duplicates
+    # only withing the same attribute id. That means different hosts can have
+    # the same IP address as long as it is in different attributes.
+    #
+    # TODO: We should filter for attribute id for the networks as well to
+    # have consistent bebaviour with ip_addr_type: host.
+    values = [
+        (i, s, a, v)
+        for i, (s, a, v) in enumerate(inet_values)
+        if s.servertype.ip_addr_type in ('host', 'network')
+    ]
+    if not values:
+        return {}
+
+    given = {(s.server_id, a, v) for s, a, v in inet_values}
+    violations = {}
+    with connection.cursor() as cursor:
+        cursor.execute(IP_CONFLICTS_QUERY, [
+            [i for i, s, a, v in values],
+            [s.server_id for i, s, a, v in values],
+            [a for i, s, a, v in values],
+            [str(v) for i, s, a, v in values],
+            [s.servertype_id for i, s, a, v in values],
+            [s.servertype.ip_addr_type == 'network' for i, s, a, v in values],
+        ])
+        for index, server_id, attribute_id, value in cursor.fetchall():
+            if (server_id, attribute_id, inet_to_python(value)) in given:
+                continue
+            violations[index] = _get_ip_conflict_message(inet_values[index])
+
+    return violations
+
+
+def _get_duplicate_ips(inet_values):
+    """Find the duplicate IP addresses of the hosts between the values"""
+
+    values_by_ip = {}
+    for index, (server, attribute_id, value) in enumerate(inet_values):
+        if server.servertype.ip_addr_type != 'network':
+            values_by_ip.setdefault(value, []).append(index)
+
+    violations = {}
+    for indexes in values_by_ip.values():
+        for index in indexes:
+            server, attribute_id, value = inet_values[index]
+            if server.servertype.ip_addr_type != 'host':
+                continue
+            for other_index in indexes:
+                other_server, other_attribute_id, _ = inet_values[other_index]
+                if _is_same_server(server, other_server):
+                    continue
+                if (
+                    attribute_id is None or
+                    other_attribute_id is None or
+                    attribute_id == other_attribute_id
+                ):
+                    violations[index] = 'An object with {0} already exists'
+                    break
+
+    return violations
+
+
+def _get_overlapping_networks(inet_values):
+    """Find the overlapping networks of the same servertype
+
+    The networks are swept in the order of their first addresses.  We keep
+    track of the network reaching the farthest, and the one reaching
+    the farthest from another server.  A network overlaps with another
+    one, if it starts before one of them ends.
+    """
+
+    networks = sorted(
+        (
+            server.servertype_id,
+            value.version,
+            int(value.network.network_address),
+            int(value.network.broadcast_address),
+            index,
+        )
+        for index, (server, attribute_id, value) in enumerate(inet_values)
+        if server.servertype.ip_addr_type == 'network'
+    )
+
+    violations = {}
+    message = '{0} overlaps with network of another object'
+    farthest = other_farthest = group = None
+    for servertype_id, version, start, end, index in networks:
+        if group != (servertype_id, version):
+            group = servertype_id, version
+            farthest = other_farthest = None
+
+        server = inet_values[index][0]
+        for other in farthest, other_farthest:
+            if other is None or other[0] < start:
+                continue
+            if not _is_same_server(server, inet_values[other[1]][0]):
+                violations[index] = violations[other[1]] = message
+                break
+
+        if farthest is None or end > farthest[0]:
+            if farthest is not None and not _is_same_server(
+                server, inet_values[farthest[1]][0]
+            ):
+                other_farthest = farthest
+            farthest = end, index
+        elif not _is_same_server(server, inet_values[farthest[1]][0]) and (
+            other_farthest is None or end > other_farthest[0]
+        ):
+            other_farthest = end, index
+
+    return violations
+
+
+def _get_ip_conflict_message(inet_value):
+    if inet_value[0].servertype.ip_addr_type == 'network':
+        return '{0} overlaps with network of another object'
+    return 'An object with {0} already exists'
+
+
+def _is_same_server(server, other_server):
+    return server is other_server or (
+        server.server_id is not None and
+        server.server_id == other_server.server_id
     )
-    if overlaps:
-        raise ValidationError(
-            '{0} overlaps with network of another object'.format(
-                str(ip_interface)))
 
 
 class Servertype(models.Model):
@@ -475,6 +606,12 @@ class Server(models.Model):
     def clean(self):
         super(Server, self).clean()
 
+        self.clean_intern_ip()
+        if self.intern_ip is not None:
+            validate_ip_conflicts([(self, None, self.intern_ip)])
+
+    def clean_intern_ip(self):
+        """Validate the intern_ip without comparing it to the others"""
         ip_addr_type = self.servertype.ip_addr_type
         if ip_addr_type == 'null':
             if self.intern_ip is not None:
@@ -493,15 +630,10 @@ class Server(models.Model):
             if type(self.intern_ip) not in [IPv4Interface, IPv6Interface]:
                 self.intern_ip = inet_to_python(self.intern_ip)
 
-            if ip_addr_type == 'host':
-                is_ip_address(self.intern_ip)
-                is_unique_ip(self.intern_ip, self.server_id)
-            elif ip_addr_type == 'loadbalancer':
+            if ip_addr_type in ('host', 'loadbalancer'):
                 is_ip_address(self.intern_ip)
             elif ip_addr_type == 'network':
                 is_network(self.intern_ip)
-                network_overlaps(self.intern_ip, self.servertype.servertype_id,
-                                 self.server_id)
 
     def get_attributes(self, attribute):
         model = ServerAttribute.get_model(attribute.type)
@@ -532,11 +664,14 @@ class ServerAttribute(models.Model):
         return self.value
 
     def save_value(self, value):
-        # Normally, there shouldn't be any transformation necessary.
-        self.value = value
+        self.set_value(value)
         self.full_clean()
         self.save()
 
+    def set_value(self, value):
+        # Normally, there shouldn't be any transformation necessary.
+        self.value = value
+
     @staticmethod
     def get_model(attribute_type):
         if attribute_type in 'string':
@@ -572,7 +707,7 @@ class ServerStringAttribute(ServerAttribute):
         unique_together = [['server', 'attribute', 'value']]
         index_together = [['attribute', 'value']]
 
-    def save_value(self, value):
+    def set_value(self, value):
         for char in '\'"':
             if char in value:
                 raise ValidationError(
@@ -586,7 +721,7 @@ class ServerStringAttribute(ServerAttribute):
                     .format(value, datatype.__name__)
                 )
 
-        super().save_value(value)
+        super().set_value(value)
 
 
 class ServerRelationAttributeManager(models.Manager):
@@ -701,6 +836,11 @@ class ServerInetAttribute(ServerAttribute):
     def clean(self):
         super(ServerAttribute, self).clean()
 
+        self.clean_value()
+        validate_ip_conflicts([(self.server, self.attribute_id, self.value)])
+
+    def clean_value(self):
+        """Validate the value without comparing it to the others"""
         if self.attribute.inet_address_family == Attribute.InetAddressFamilyChoice.IPV4:
             allowed_types = (IPv4Interface,)
         elif self.attribute.inet_address_family == Attribute.InetAddressFamilyChoice.IPV6:
@@ -726,15 +866,10 @@ class ServerInetAttribute(ServerAttribute):
             raise ValidationError(
                 _('%(attribute_id)s must be null'), code='invalid value',
                 params={'attribute_id': self.attribute_id})
-        elif ip_addr_type == 'host':
-            is_ip_address(self.value)
-            is_unique_ip(self.value, self.server.server_id, self.attribute_id)
-        elif ip_addr_type == 'loadbalancer':
+        elif ip_addr_type in ('host', 'loadbalancer'):
             is_ip_address(self.value)
         elif ip_addr_type == 'network':
             is_network(self.value)
-            network_overlaps(self.value, self.server.servertype_id,
-                             self.server.server_id)
 
 
 class ServerMACAddressAttribute(ServerAttribute):
@@ -0,0 +1,132 @@
+"""Serveradmin - Query Cache
+
+Copyright (c) 2024 InnoGames GmbH
+"""
+
+import json
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
+
+from adminapi.dataset import DatasetObject, MultiAttr
+from adminapi.request import json_encode_extra
+from serveradmin.common.cache_version import CacheVersion
+from serveradmin.serverdb.signals import post_commit
+
+GENERATION_CACHE_KEY = 'serveradmin_query_cache_generation'
+
+
+class QueryCache:
+    """LRU cache of the query results
+
+    The entries are tagged with the generation they are created in.  Every
+    commit bumps the generation, so everything cached before it becomes
+    stale at once.  The entries also expire after QUERY_CACHE_TIMEOUT,
+    because the servers can be changed without going through the commits.
+    The size of the cache is limited by the total number of objects in
+    the cached results.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._num_objects = 0
+        self._lock = Lock()
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if (
+                entry is None or
+                entry[0] != generation or
+                entry[1] < monotonic()
+            ):
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        return [_copy_object(o) for o in entry[2]]
+
+    def set(self, key, generation, results):
+        max_objects = settings.QUERY_CACHE_MAX_OBJECTS
+        if len(results) > max_objects:
+            return
+
+        results = [_copy_object(o) for o in results]
+        expires = monotonic() + settings.QUERY_CACHE_TIMEOUT
+        with self._lock:
+            self._remove(key)
+            while self._entries and (
+                self._num_objects + len(results) > max_objects
+            ):
+                self._remove(next(iter(self._entries)))
+            self._entries[key] = (generation, expires, results)
+            self._num_objects += len(results)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._num_objects = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._num_objects -= len(entry[2])
+
+
+query_results = QueryCache()
+_generation = CacheVersion(GENERATION_CACHE_KEY)
+
+
+def is_enabled():
+    return settings.QUERY_CACHE_MAX_OBJECTS > 0
+
+
+def get_generation():
+    return _generation.get()
+
+
+def get_cache_key(filters, restrict, order_by, limit=None, offset=0):
+    """Build the key for the query from its canonical representation"""
+    return json.dumps(
+        [
+            {a: f.serialize() for a, f in filters.items()},
+            restrict,
+            order_by,
+            limit,
+            offset,
+        ],
+        default=json_encode_extra,
+        sort_keys=True,
+    )
+
+
+@receiver(post_commit)
+def invalidate_query_cache(sender, **kwargs):
+    # The commit might still be a part of an outer transaction.  Other
+    # processes shouldn't start caching the old state after we bumped
+    # the generation, so we wait for the data to be visible to them.
+    transaction.on_commit(_generation.bump)
+
+
+def _copy_object(obj):
+    """Copy the results, because the callers are free to modify them"""
+    attributes = {}
+    for attribute_id, value in obj.items():
+        if isinstance(value, DatasetObject):
+            value = _copy_object(value)
+        elif isinstance(value, MultiAttr):
+            value = [
+                _copy_object(v) if isinstance(v, DatasetObject) else v
+                for v in value
+            ]
+        attributes[attribute_id] = value
+
+    return DatasetObject(attributes, obj.object_id)
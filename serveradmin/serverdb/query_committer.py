@@ -7,30 +7,54 @@ import logging
 from itertools import chain
 from typing import Optional
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied, ValidationError
-from django.db import IntegrityError, transaction
+from django.db import DataError, IntegrityError, connection, transaction
 
 from adminapi.dataset import DatasetCommit
 from adminapi.request import json_encode_extra
+from serveradmin.access_control.registry import get_access_control
 from serveradmin.apps.models import Application
+from serveradmin.serverdb.metadata import get_metadata
 from serveradmin.serverdb.models import (
     Servertype,
     Attribute,
     Server,
     ServerAttribute,
+    ServerBooleanAttribute,
+    ServerInetAttribute,
     ServerRelationAttribute,
     ChangeCommit,
-    Change, ServertypeAttribute,
+    Change,
+    validate_ip_conflicts,
 )
 from serveradmin.serverdb.query_materializer import (
     QueryMaterializer,
     get_default_attribute_values,
 )
+from serveradmin.serverdb.query_executer import get_matching_object_ids
 from serveradmin.serverdb.signals import pre_commit, post_commit
 
 logger = logging.getLogger(__name__)
 
+# The queries to delete the given values of the multi attributes
+VALUES_DELETE_QUERY = (
+    'DELETE FROM {0} AS sa'
+    ' USING unnest(%s::integer[], %s::{1}[]) AS removed(server_id, value)'
+    ' WHERE sa.server_id = removed.server_id'
+    ' AND sa.value = removed.value'
+    ' AND sa.attribute_id = %s'
+)
+RELATION_VALUES_DELETE_QUERY = (
+    'DELETE FROM {0} AS sa'
+    ' USING unnest(%s::integer[], %s::text[]) AS removed(server_id, hostname)'
+    ' JOIN server AS related ON related.hostname = removed.hostname'
+    ' WHERE sa.server_id = removed.server_id'
+    ' AND sa.value = related.server_id'
+    ' AND sa.attribute_id = %s'
+)
+
 
 class CommitError(ValidationError):
     pass
@@ -60,13 +84,23 @@ def commit_query(created=[], changed=[], deleted=[], app=None, user=None):
         commit_query, created=created, changed=changed, deleted=deleted
     )
 
-    # TODO: Find out which attributes we actually need
-    attribute_lookup = {a.pk: a for a in Attribute.objects.all()}
+    attribute_lookup = _get_attribute_lookup(created, changed)
     joined_attributes = {
         a: None
         for a
         in list(attribute_lookup.values()) + list(Attribute.specials.values())
     }
+    # The filters of the ACLs are evaluated on the database for the large
+    # commits, instead of checking the materialized objects against them.
+    acl_groups = _get_database_acl_groups(
+        user, app, len(created) + len(changed) + len(deleted)
+    )
+    # The complete created and deleted objects are logged, but only
+    # the attributes to validate and to check the ACLs against are needed
+    # for the changed ones.
+    changed_attributes = _get_changed_attributes(
+        attribute_lookup, changed, user, app, acl_groups
+    )
 
     # TODO: We rely on the "protocol" that everything that creates or changes
     #       one or more Server(s) uses this API or also acquires an exclusive
@@ -81,10 +115,15 @@ def commit_query(created=[], changed=[], deleted=[], app=None, user=None):
     #       # "repeatable read".
     with transaction.atomic():
         changed_servers = _fetch_servers(set(c['object_id'] for c in changed))
-        unchanged_objects = _materialize(changed_servers, joined_attributes)
+        unchanged_objects = _materialize(changed_servers, changed_attributes)
 
         deleted_servers = _fetch_servers(deleted)
         deleted_objects = _materialize(deleted_servers, joined_attributes)
+        # The existing objects are checked against the ACLs as they are
+        # before the changes.
+        acl_coverage = _get_acl_coverage(
+            acl_groups, chain(changed_servers, deleted_servers)
+        )
         # TODO: Refactor validation
         #
         # This methods calls a set of functions to validate if changes to
@@ -109,17 +148,27 @@ def commit_query(created=[], changed=[], deleted=[], app=None, user=None):
         # Changes should be applied in order to prevent integrity errors.
         _delete_attributes(attribute_lookup, changed, changed_servers, deleted)
         _delete_servers(changed, deleted, deleted_servers)
-        created_servers = _create_servers(attribute_lookup, created)
+        # The IP addresses are validated after all of the changes are
+        # applied, so that they are validated against each other too.
+        inet_values = []
+        created_servers = _create_servers(
+            attribute_lookup, created, inet_values
+        )
         created_objects = _materialize(created_servers, joined_attributes)
-        _update_servers(changed, changed_servers)
-        _upsert_attributes(attribute_lookup, changed, changed_servers)
-        changed_objects = _materialize(changed_servers, joined_attributes)
+        # The new objects are checked as they are going to be.
+        _update_acl_coverage(acl_coverage, acl_groups, created_servers)
+        _update_servers(changed, changed_servers, inet_values)
+        _upsert_attributes(
+            attribute_lookup, changed, changed_servers, inet_values
+        )
+        validate_ip_conflicts(inet_values)
+        changed_objects = _materialize(changed_servers, changed_attributes)
 
         # TODO Improve this function by checking only attributes of ACLs that
         #      have actually changed and not all.
         _access_control(
             user, app, unchanged_objects,
-            created_objects, changed_objects, deleted_objects
+            created_objects, changed_objects, deleted_objects, acl_coverage,
         )
 
         _log_changes(user, app, changed, created_objects, deleted_objects)
@@ -175,6 +224,11 @@ def _validate(attribute_lookup, changed, changed_objects):
 
 
 def _delete_attributes(attribute_lookup, changed, changed_servers, deleted):
+    """Delete the attribute values in bulk
+
+    The values are grouped by the attributes, and deleted with a single
+    query per attribute.
+    """
     # We first have to delete all of the relation attributes
     # to avoid integrity errors.  Other attributes will just go away
     # with the servers.
@@ -185,6 +239,8 @@ def _delete_attributes(attribute_lookup, changed, changed_servers, deleted):
             .delete()
         )
 
+    deleted_server_ids = {}
+    removed_values = {}
     for changes in changed:
         object_id = changes['object_id']
 
@@ -192,21 +248,55 @@ def _delete_attributes(attribute_lookup, changed, changed_servers, deleted):
             if attribute_id in Attribute.specials:
                 continue
 
-            server = changed_servers[object_id]
             attribute = attribute_lookup[attribute_id]
             action = change['action']
 
             if action == 'delete' or (
                 action == 'update' and change['new'] is None
             ):
-                server.get_attributes(attribute).delete()
+                deleted_server_ids.setdefault(attribute, []).append(object_id)
             elif action == 'multi' and change['remove']:
-                for server_attribute in server.get_attributes(attribute):
-                    value = server_attribute.get_value()
-                    if isinstance(value, Server):
-                        value = value.hostname
-                    if value in change['remove']:
-                        server_attribute.delete()
+                removed_values.setdefault(attribute, []).extend(
+                    (object_id, v) for v in change['remove']
+                )
+
+    for attribute, server_ids in deleted_server_ids.items():
+        ServerAttribute.get_model(attribute.type).objects.filter(
+            attribute=attribute, server_id__in=server_ids
+        ).delete()
+    for attribute, values in removed_values.items():
+        _delete_attribute_values(attribute, values)
+
+
+def _delete_attribute_values(attribute, values):
+    """Delete the values of the multi attribute with a single query
+
+    The values are given as tuples of the server_ids and the values.  They
+    are compared on the database, so they can be passed as strings.  The
+    values of the relations are the hostnames of the related servers.
+    The values the database cannot cast to the type of the attribute are
+    rejected.
+    """
+    model = ServerAttribute.get_model(attribute.type)
+    field = model._meta.get_field('value')
+    if attribute.type == 'relation':
+        sql_query = RELATION_VALUES_DELETE_QUERY.format(model._meta.db_table)
+    else:
+        sql_query = VALUES_DELETE_QUERY.format(
+            model._meta.db_table, field.db_type(connection)
+        )
+
+    server_ids, values = zip(*values)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql_query, [
+                list(server_ids), [str(v) for v in values], attribute.pk
+            ])
+    except DataError as error:
+        raise CommitError(
+            'Cannot remove the values of attribute "{}": {}'
+            .format(attribute, error)
+        )
 
 
 def _delete_servers(changed, deleted, deleted_servers):
@@ -228,8 +318,15 @@ def _delete_servers(changed, deleted, deleted_servers):
             del changed[server_id]
 
 
-def _create_servers(attribute_lookup, created):
-    created_servers = {}
+def _create_servers(attribute_lookup, created, inet_values):
+    """Create the servers with their attributes in bulk
+
+    Everything that can be validated in memory is validated first.  Then
+    the servers and the attribute values are inserted with a single query
+    per table.  The IP addresses are added to the inet_values to be
+    validated afterwards.
+    """
+    new_servers = []
     for attributes in created:
         if not attributes.get('hostname'):
             raise CommitError('"hostname" attribute is required.')
@@ -244,19 +341,31 @@ def _create_servers(attribute_lookup, created):
         attributes = dict(_get_real_attributes(attributes, attribute_lookup))
         _validate_real_attributes(servertype, attributes)
 
-        server = _insert_server(hostname, intern_ip, servertype, attributes)
+        server = Server(
+            hostname=hostname,
+            intern_ip=intern_ip,
+            servertype=servertype,
+        )
+        new_servers.append((server, attributes))
 
-        created_server = {k.pk: v for k, v in attributes.items()}
-        created_server['hostname'] = hostname
-        created_server['servertype'] = servertype.pk
-        created_server['intern_ip'] = intern_ip
+    _insert_servers([s for s, a in new_servers])
+    inet_values.extend(
+        (s, None, s.intern_ip) for s, a in new_servers if s.intern_ip
+    )
 
-        created_servers[server.server_id] = server
+    server_attributes = _get_server_attributes([
+        (server, attribute, v)
+        for server, attributes in new_servers
+        for attribute, value in attributes.items()
+        for v in (value if attribute.multi else [value])
+    ])
+    _insert_server_attributes(server_attributes)
+    inet_values.extend(_get_inet_values(server_attributes))
 
-    return created_servers
+    return {s.server_id: s for s, a in new_servers}
 
 
-def _update_servers(changed, changed_servers):
+def _update_servers(changed, changed_servers, inet_values):
     really_changed = set()
     for changes in changed:
         object_id = changes['object_id']
@@ -275,11 +384,26 @@ def _update_servers(changed, changed_servers):
             really_changed.add(server)
 
     for server in really_changed:
-        server.full_clean()
+        server.clean_fields()
+        server.clean_intern_ip()
+        server.validate_unique()
         server.save()
+        if server.intern_ip is not None:
+            inet_values.append((server, None, server.intern_ip))
+
 
+def _upsert_attributes(
+    attribute_lookup, changed, changed_servers, inet_values
+):
+    """Insert the new attribute values in bulk
 
-def _upsert_attributes(attribute_lookup, changed, changed_servers):
+    The values are validated the same way as the values of the created
+    servers.  The old values of the single value attributes are deleted
+    with a single query per attribute, and the new ones are inserted with
+    a single query per attribute table.
+    """
+    updates = []
+    replaced_server_ids = {}
     for changes in changed:
         object_id = changes['object_id']
 
@@ -292,8 +416,7 @@ def _upsert_attributes(attribute_lookup, changed, changed_servers):
 
             action = change['action']
             if action == 'multi':
-                for value in change['add']:
-                    server.add_attribute(attribute, value)
+                updates.extend((server, attribute, v) for v in change['add'])
                 continue
 
             if action not in ('new', 'update'):
@@ -301,17 +424,24 @@ def _upsert_attributes(attribute_lookup, changed, changed_servers):
             if change['new'] is None:
                 continue
 
-            try:
-                server_attribute = server.get_attributes(attribute).get()
-            except ServerAttribute.get_model(attribute.type).DoesNotExist:
-                server.add_attribute(attribute, change['new'])
-            else:
-                server_attribute.save_value(change['new'])
+            replaced_server_ids.setdefault(attribute, []).append(object_id)
+            updates.append((server, attribute, change['new']))
+
+    server_attributes = _get_server_attributes(updates)
+    for attribute, server_ids in replaced_server_ids.items():
+        ServerAttribute.get_model(attribute.type).objects.filter(
+            attribute=attribute, server_id__in=server_ids
+        ).delete()
+
+    # The values already there are left as they are.
+    _insert_server_attributes(server_attributes, ignore_conflicts=True)
+    inet_values.extend(_get_inet_values(server_attributes))
 
 
 def _access_control(
     user: Optional[User], app: Optional[Application], unchanged_objects: dict,
     created_objects: dict, changed_objects: dict, deleted_objects: dict,
+    acl_coverage: Optional[dict] = None,
 ) -> None:
     """Enforce serveradmin ACLs
 
@@ -331,6 +461,9 @@ def _access_control(
     its ACLs, the error message can become rather complex, listing all the
     reasons all the users ACLs were not applicable.
 
+    If acl_coverage is given, the filters of the ACLs were already evaluated
+    on the database.  See _get_acl_coverage().
+
     Raises PermissionDenied if a change is not permissible.
     Returns None on success.
     """
@@ -339,16 +472,23 @@ def _access_control(
     if (user and user.is_superuser) or (app and app.superuser):
         return None
 
+    # The groups are compiled once, and cached by every process.  The whole
+    # commit is checked in memory.
+    registry = get_access_control()
     entities = []
     if app:
-        entities.append(('application', app, list(app.access_control_groups.all())))
+        entities.append(('application', app, registry.get_groups(app=app)))
     elif user:
-        entities.append(('user', user, list(user.access_control_groups.all())))
+        entities.append(('user', user, registry.get_groups(user=user)))
     else:
         # This should not be possible as it means not authenticated but better
         # safe than sorry.
         raise PermissionDenied('Missing authentication!')
 
+    # The default values are the same for all of the new objects of
+    # a servertype.
+    default_objects = {}
+
     # Check all objects touched by this commit
     for obj in chain(
         created_objects.values(),
@@ -358,7 +498,10 @@ def _access_control(
         # Check app or if not present user permissions
         for entity_class, entity_name, groups in entities:
             acl_violations = {
-                acl: _acl_violations(unchanged_objects, obj, acl)
+                acl: _acl_violations(
+                    unchanged_objects, obj, acl, registry, default_objects,
+                    acl_coverage,
+                )
                 for acl in groups
             }
 
@@ -376,7 +519,10 @@ def _access_control(
                 raise PermissionDenied(msg)
 
 
-def _acl_violations(touched_objects, pending_changes, acl):
+def _acl_violations(
+    touched_objects, pending_changes, acl, registry, default_objects,
+    acl_coverage=None,
+):
     """Check if ACL allows all the changes to obj
 
     An ACL can fail to validate in two ways.  Every ACL has a filter describing
@@ -393,33 +539,18 @@ def _acl_violations(touched_objects, pending_changes, acl):
     Returns None on success.
     """
 
-    violations = []
-
-    # Check whether the object matches all the attribute filters of the ACL
-    for attribute_id, attribute_filter in acl.get_filters().items():
-        # TODO: This relies on the object to have all attributes that are
-        #  present in the attribute_filter which currently works because
-        #  we fetch all attributes in commit_query (joined_attribtues).
-        #  This method would be better of not relying on the caller
-        #  making sure passing down all relevant attributes which isn't
-        #  even documented.
-        if pending_changes['object_id'] in touched_objects:
-            # If the object already exists ensure the ACL matches the status
-            # quo and not the wanted changes.
-            to_compare = touched_objects.get(pending_changes['object_id'])
-        else:
-            # Otherwise check if the ACL allows the "to be" object.
-            to_compare = pending_changes
-
-        if not attribute_filter.matches(to_compare.get(attribute_id)):
-            violations.append(
-                'Object is not covered by ACL "{}", Attribute "{}" '
-                'does not match the filter "{}".'.format(
-                    acl, attribute_id, attribute_filter,
-                )
-            )
-
     # If this ACL is not applicable to this object, we can bail out right away
+    if acl_coverage is None:
+        violations = _acl_filter_violations(
+            touched_objects, pending_changes, acl
+        )
+    elif pending_changes['object_id'] not in acl_coverage[acl.pk]:
+        violations = [
+            'Object is not covered by ACL "{}", it does not match '
+            'the filters.'.format(acl)
+        ]
+    else:
+        violations = []
     if violations:
         return violations
 
@@ -428,10 +559,15 @@ def _acl_violations(touched_objects, pending_changes, acl):
     if pending_changes['object_id'] in touched_objects:
         old_object = touched_objects[pending_changes['object_id']]
     else:
-        old_object = get_default_attribute_values(pending_changes['servertype'])
+        servertype_id = pending_changes['servertype']
+        if servertype_id not in default_objects:
+            default_objects[servertype_id] = (
+                get_default_attribute_values(servertype_id)
+            )
+        old_object = default_objects[servertype_id]
 
     # Gather attribute ids this ACL allows changing
-    attribute_ids = acl.get_permissible_attribute_ids()
+    attribute_ids = acl.permissible_attribute_ids
 
     # Check whether all changed attributes are on this ACLs attribute whitelist
     for attribute_id, attribute_value in pending_changes.items():
@@ -439,12 +575,9 @@ def _acl_violations(touched_objects, pending_changes, acl):
             attribute_id not in attribute_ids and
             attribute_value != old_object[attribute_id]
         ):
-            is_related_via: bool = ServertypeAttribute.objects.filter(
-                servertype_id=pending_changes['servertype'],
-                attribute_id=attribute_id,
-                related_via_attribute__isnull=False
-            ).exists()
-            if is_related_via:
+            if attribute_id in registry.get_related_via_attribute_ids(
+                pending_changes['servertype']
+            ):
                 # Attributes which are related via another servertype can be
                 # skipped because permission to change the value is checked
                 # at the target servertype where the actual change takes place.
@@ -460,11 +593,102 @@ def _acl_violations(touched_objects, pending_changes, acl):
     return violations or None
 
 
+def _acl_filter_violations(touched_objects, pending_changes, acl):
+    """Check whether the object matches all the attribute filters of the ACL
+
+    Returns a list of human-readable ACL violations.
+    """
+    violations = []
+    for attribute_id, attribute_filter in acl.filters.items():
+        # TODO: This relies on the object to have all attributes that are
+        #  present in the attribute_filter which currently works because
+        #  commit_query() materializes them (see _get_changed_attributes()).
+        #  This method would be better of not relying on the caller
+        #  making sure passing down all relevant attributes.
+        if pending_changes['object_id'] in touched_objects:
+            # If the object already exists ensure the ACL matches the status
+            # quo and not the wanted changes.
+            to_compare = touched_objects.get(pending_changes['object_id'])
+        else:
+            # Otherwise check if the ACL allows the "to be" object.
+            to_compare = pending_changes
+
+        if not attribute_filter.matches(to_compare.get(attribute_id)):
+            violations.append(
+                'Object is not covered by ACL "{}", Attribute "{}" '
+                'does not match the filter "{}".'.format(
+                    acl, attribute_id, attribute_filter,
+                )
+            )
+
+    return violations
+
+
+def _get_database_acl_groups(user, app, num_objects):
+    """Get the ACLs to evaluate the filters of on the database
+
+    Checking the objects against the filters in memory needs them to be
+    materialized with all of the attributes the ACLs filter on, and
+    evaluates every filter on every object.  It is cheaper to query
+    the database, when many objects are committed by a client with many
+    ACLs.  None is returned, if the objects are to be checked in memory.
+
+    The filters on the multi attributes are compared with all of the values
+    at once in memory, but with every one of them on the database, so those
+    are always checked in memory to get the same decisions.
+    """
+    if (user and user.is_superuser) or (app and app.superuser):
+        return None
+
+    groups = get_access_control().get_groups(user=user, app=app)
+    if len(groups) * num_objects < settings.ACL_DATABASE_MIN_CHECKS:
+        return None
+
+    attributes = get_metadata().attributes
+    for acl in groups:
+        for attribute_id in acl.filters:
+            attribute = attributes.get(attribute_id)
+            if attribute is not None and attribute.multi:
+                return None
+
+    return groups
+
+
+def _get_acl_coverage(acl_groups, object_ids):
+    """Get the given objects covered by the ACLs indexed by the ACLs
+
+    The filters of every ACL are evaluated with a single query on
+    the current state of the database.
+    """
+    if acl_groups is None:
+        return None
+
+    acl_coverage = {acl.pk: set() for acl in acl_groups}
+    _update_acl_coverage(acl_coverage, acl_groups, object_ids)
+
+    return acl_coverage
+
+
+def _update_acl_coverage(acl_coverage, acl_groups, object_ids):
+    if acl_groups is None:
+        return
+
+    object_ids = list(object_ids)
+    for acl in acl_groups:
+        acl_coverage[acl.pk].update(
+            get_matching_object_ids(acl.filters, object_ids)
+        )
+
+
 def _log_changes(user, app, changed, created_objects, deleted_objects):
     changes = list()
     commit = ChangeCommit(user=user, app=app)
 
-    excl_attrs = Attribute.objects.filter(history=False).values_list(flat=True)
+    excl_attrs = {
+        a.attribute_id
+        for a in get_metadata().attributes.values()
+        if not a.history
+    }
     for updates in changed:
         # At least one attribute aside from object_id has changed.
         if len(updates.keys() - excl_attrs) > 1:
@@ -519,14 +743,55 @@ def _materialize(servers, joined_attributes):
     }
 
 
-def _get_servertype_attributes(servers):
-    servertype_attributes = dict()
-    for servertype_id in {s['servertype'] for s in servers.values()}:
-        servertype_attributes[servertype_id] = dict()
-        for sa in Servertype.objects.get(pk=servertype_id).attributes.all():
-            servertype_attributes[servertype_id][sa.attribute_id] = sa
+def _get_attribute_lookup(created, changed):
+    metadata = get_metadata()
+    attribute_ids = {a for o in chain(created, changed) for a in o.keys()}
+    if not attribute_ids.issubset(
+        chain(metadata.attributes.keys(), Attribute.specials.keys())
+    ):
+        # The attributes might be created by another process just now.
+        metadata = get_metadata(reload=True)
+
+    return metadata.attributes
+
+
+def _get_changed_attributes(attribute_lookup, changed, user, app, acl_groups):
+    """Get the attributes needed to commit the changes
+
+    Those are the changed attributes and the ones the ACLs of the user or
+    the app filter on, unless the filters are evaluated on the database.
+    The special attributes are always needed.
+    """
+    attribute_ids = {a for c in changed for a in c.keys()}
+    if acl_groups is None:
+        attribute_ids.update(_get_acl_attribute_ids(user, app))
+
+    changed_attributes = {a: None for a in Attribute.specials.values()}
+    for attribute_id in attribute_ids:
+        if attribute_id in attribute_lookup:
+            changed_attributes[attribute_lookup[attribute_id]] = None
+
+    return changed_attributes
+
+
+def _get_acl_attribute_ids(user, app):
+    """Get the attributes the ACLs of the user or the app filter on
 
-    return servertype_attributes
+    See _access_control() for the ACLs applicable.
+    """
+    if (user and user.is_superuser) or (app and app.superuser):
+        return set()
+
+    groups = get_access_control().get_groups(user=user, app=app)
+    return {a for g in groups for a in g.filters}
+
+
+def _get_servertype_attributes(servers):
+    metadata = get_metadata()
+    return {
+        servertype_id: metadata.get_servertype_attributes(servertype_id)
+        for servertype_id in {s['servertype'] for s in servers.values()}
+    }
 
 
 def _validate_attributes(changes, servers, servertype_attributes):
@@ -664,8 +929,12 @@ def _build_error_message(violations_attribs, violations_readonly,
 
 
 def _get_servertype(attributes):
+    metadata = get_metadata()
+    if attributes['servertype'] not in metadata.servertypes:
+        # The servertype might be created by another process just now.
+        metadata = get_metadata(reload=True)
     try:
-        return Servertype.objects.get(pk=attributes['servertype'])
+        return metadata.get_servertype(attributes['servertype'])
     except Servertype.DoesNotExist:
         raise CommitError('Unknown servertype: ' + attributes['servertype'])
 
@@ -707,7 +976,9 @@ def _validate_real_attributes(servertype, real_attributes):     # NOQA: C901
     violations_regexp = []
     violations_required = []
     servertype_attributes = set()
-    for sa in servertype.attributes.all():
+    for sa in get_metadata().get_servertype_attributes(
+        servertype.servertype_id
+    ).values():
         attribute = sa.attribute
         servertype_attributes.add(attribute)
 
@@ -756,27 +1027,109 @@ def _validate_real_attributes(servertype, real_attributes):     # NOQA: C901
     )
 
 
-def _insert_server(hostname, intern_ip, servertype, attributes):
-
-    if Server.objects.filter(hostname=hostname).exists():
+def _insert_servers(servers):
+    hostnames = {s.hostname for s in servers}
+    if (
+        len(hostnames) != len(servers) or
+        Server.objects.filter(hostname__in=hostnames).exists()
+    ):
         raise CommitError('Server with that hostname already exists')
 
-    server = Server(
-        hostname=hostname,
-        intern_ip=intern_ip,
-        servertype=servertype,
+    for server in servers:
+        # The servertypes are coming from the metadata.
+        server.clean_fields(exclude=['servertype'])
+        server.clean_intern_ip()
+
+    Server.objects.bulk_create(servers)
+
+
+def _get_server_attributes(values):
+    """Validate the attribute values and prepare them to be inserted
+
+    The values are given as tuples of the servers, the attributes and
+    the values.  The attribute values are returned grouped by their models.
+    """
+    relation_targets = _get_relation_targets(
+        v for s, a, v in values if a.type == 'relation'
     )
-    server.full_clean()
-    server.save()
+    server_attributes = {}
+    for server, attribute, value in values:
+        server_attribute = _new_server_attribute(
+            server, attribute, value, relation_targets
+        )
+        if server_attribute is not None:
+            server_attributes.setdefault(
+                type(server_attribute), []
+            ).append(server_attribute)
 
-    for attribute, value in attributes.items():
-        if attribute.multi:
-            for single_value in value:
-                server.add_attribute(attribute, single_value)
-        else:
-            server.add_attribute(attribute, value)
+    return server_attributes
+
+
+def _insert_server_attributes(server_attributes, ignore_conflicts=False):
+    """Insert the attribute values with a single query per table"""
+    try:
+        for model, objs in server_attributes.items():
+            model.objects.bulk_create(objs, ignore_conflicts=ignore_conflicts)
+    except IntegrityError as error:
+        raise CommitError(
+            'Cannot insert the attribute values: {}'.format(error)
+        )
+
+
+def _get_inet_values(server_attributes):
+    return [
+        (sa.server, sa.attribute_id, sa.value)
+        for sa in server_attributes.get(ServerInetAttribute, ())
+    ]
+
+
+def _get_relation_targets(hostnames):
+    """Get the servers to relate to indexed by their hostnames"""
+    hostnames = set(hostnames)
+    if not hostnames:
+        return {}
+
+    return {
+        s.hostname: s for s in Server.objects.filter(hostname__in=hostnames)
+    }
+
+
+def _new_server_attribute(server, attribute, value, relation_targets):
+    """Prepare the attribute value to be inserted
+
+    It is validated the same way as Server.add_attribute() does except
+    for the queries.  None is returned for the false booleans.
+    """
+    model = ServerAttribute.get_model(attribute.type)
+    server_attribute = model(server=server, attribute=attribute)
+    if model is ServerBooleanAttribute:
+        return server_attribute if value else None
+
+    exclude = ['server', 'attribute']
+    if model is ServerRelationAttribute:
+        target_server = relation_targets.get(value)
+        if target_server is None:
+            raise ValidationError(
+                'No server with hostname "{0}" exist.'.format(value)
+            )
+        target_servertype_id = attribute.target_servertype_id
+        if (
+            target_servertype_id and
+            target_server.servertype_id != target_servertype_id
+        ):
+            raise ValidationError(
+                'Attribute "{0}" has to be from servertype "{1}".'
+                .format(attribute, target_servertype_id)
+            )
+        value = target_server
+        exclude.append('value')
+
+    server_attribute.set_value(value)
+    server_attribute.clean_fields(exclude=exclude)
+    if model is ServerInetAttribute:
+        server_attribute.clean_value()
 
-    return server
+    return server_attribute
 
 
 def handle_violations(
@@ -3,17 +3,507 @@
 Copyright (c) 2019 InnoGames GmbH
 """
 
+import re
+from collections import OrderedDict
+from hashlib import sha1
+from contextlib import contextmanager
+from itertools import count, islice
+from weakref import WeakKeyDictionary
+
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from django.db import DataError, connection, transaction
-
-from adminapi.filters import Any
-from serveradmin.serverdb.models import Attribute, ServertypeAttribute, Server
-from serveradmin.serverdb.sql_generator import get_server_query
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    DatabaseError,
+    DataError,
+    connections,
+    transaction,
+)
+
+from adminapi.exceptions import DatasetError
+from adminapi.filters import Any, BaseFilter
+from serveradmin.serverdb.metadata import get_metadata
+from serveradmin.serverdb.models import Attribute, Server
+from serveradmin.serverdb import query_cache
+from serveradmin.serverdb.query_profile import measure
+from serveradmin.serverdb.routers import (
+    choose_read_database,
+    get_read_database,
+    read_from_replica,
+)
+from serveradmin.serverdb.sql_generator import (
+    get_server_count_query,
+    get_server_ids_query,
+    get_server_lookup_query,
+    get_server_query,
+)
 from serveradmin.serverdb.query_materializer import QueryMaterializer
 
+# The prepared statements live as long as the database session, so we keep
+# them per connection.  The queries have a small number of shapes in
+# practice, but the number of statements is limited anyway to avoid filling
+# up the memory of the database session with unusual ones.
+PREPARED_STATEMENTS_LIMIT = 256
+_prepared_statements = WeakKeyDictionary()
+
+# The special attributes the objects can be looked up by without generating
+# the SQL, and the types of their values
+LOOKUP_TYPES = {'object_id': int, 'hostname': str}
+
+# The attribute types the servers can be ordered by on the database
+SQL_ORDER_BY_TYPES = [
+    'boolean',
+    'date',
+    'datetime',
+    'inet',
+    'macaddr',
+    'number',
+    'relation',
+    'string',
+]
+
+# Number of servers to fetch and materialize at once while streaming
+STREAM_CHUNK_SIZE = 1000
+
+
+def execute_query(
+    filters, restrict, order_by, limit=None, offset=0, profile=None
+):
+    """The main function to execute queries
+
+    Only the page of the results selected by the limit and the offset
+    is materialized.  If a QueryProfile is passed, the details of
+    the execution are recorded on it.
+    """
+
+    if (limit is not None and limit < 0) or offset < 0:
+        raise ValidationError('Limit and offset cannot be negative')
+
+    # The results read from a replica might be older than the generation
+    # they would be cached with, and the clients pinned to the primary would
+    # get them from the cache, so only the ones from the primary are cached.
+    # The queries going to a replica are executed there without the cache.
+    using = get_read_database() or choose_read_database()
+    if (
+        profile is not None or
+        not query_cache.is_enabled() or
+        using != DEFAULT_DB_ALIAS
+    ):
+        return _execute_query(
+            filters, restrict, order_by, limit, offset, profile, using=using
+        )
+
+    # The generation has to be fetched before the database transaction
+    # starts.  If a commit happens in between, the results we would cache
+    # are going to be considered stale already.
+    cache_key = query_cache.get_cache_key(
+        filters, restrict, order_by, limit, offset
+    )
+    generation = query_cache.get_generation(), get_metadata().version
+    results = query_cache.query_results.get(cache_key, generation)
+    if results is None:
+        results = _execute_query(
+            filters, restrict, order_by, limit, offset, using=using
+        )
+        query_cache.query_results.set(cache_key, generation, results)
+
+    return results
+
+
+def execute_queries(queries):
+    """Execute multiple queries on the same snapshot of the database
+
+    The queries are given as (filters, restrict, order_by) tuples.  They
+    share the metadata and the database transaction, so their results are
+    consistent with each other.  The results are returned in order.
+    """
+
+    # The attributes of all of the queries are collected first, so that
+    # the metadata is loaded at most once.
+    attribute_ids = set()
+    for filters, restrict, order_by in queries:
+        joins = None if restrict is None else list(_get_joins(restrict))
+        attribute_ids.update(_collect_attribute_ids(joins, filters, order_by))
+    metadata = _get_metadata(attribute_ids)
+    prepared = [
+        _prepare_query(f, r, o, metadata=metadata) for f, r, o in queries
+    ]
+
+    with _read_transaction():
+        results = []
+        for attribute_lookup, filters, related_vias, args in prepared:
+            servers = _get_servers(
+                filters, attribute_lookup, related_vias, [], None, 0
+            )
+            results.append(list(QueryMaterializer(servers, *args)))
+
+        return results
+
+
+def execute_count(filters):
+    """Count the objects matching the filters without materializing them"""
+
+    attribute_lookup, filters, related_vias = _prepare_filters(
+        filters, set(_collect_attribute_ids(filters=filters))
+    )
+    with _read_transaction() as connection:
+        attribute_filters = _get_attribute_filters(filters, attribute_lookup)
+        if attribute_filters is None:
+            return 0
+
+        sql_query, sql_params = get_server_count_query(
+            attribute_filters, related_vias
+        )
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(
+                    _get_execute_sql(sql_query, sql_params), sql_params
+                )
+            except DataError as error:
+                raise ValidationError(error)
+
+            return cursor.fetchone()[0]
+
+
+def get_matching_object_ids(filters, object_ids):
+    """Return the ones of the given object_ids matching the filters
+
+    Unlike the other functions in here, this one doesn't open a transaction
+    of its own.  It runs on the current one of the primary database, so it
+    sees its uncommitted changes.  It is used to check the commits against
+    the filters of the access control groups.
+
+    The filters have to match the same objects as BaseFilter.matches() on
+    the objects in memory.  The attributes the servertype of an object
+    doesn't have are compared as None, instead of excluding the object like
+    the queries do.
+    """
+    object_ids = list(object_ids)
+    if not object_ids:
+        return set()
+
+    attribute_ids = set(_collect_attribute_ids(filters=filters))
+    metadata = _get_metadata(attribute_ids)
+    _check_attributes_exist(attribute_ids, _get_attribute_lookup(metadata))
+
+    matching_object_ids = set()
+    for group_filters, group_object_ids in _group_by_missing_attributes(
+        filters, object_ids, metadata
+    ):
+        matching_object_ids.update(_get_matching_object_ids(
+            group_filters, group_object_ids, metadata
+        ))
+
+    return matching_object_ids
+
+
+def _group_by_missing_attributes(filters, object_ids, metadata):
+    """Group the objects by the filtered attributes their servertypes miss
+
+    The filters on the missing attributes are evaluated on None.  The groups
+    are yielded with the rest of the filters, unless they cannot match.
+    """
+    servertype_attribute_ids = {}
+    for attribute_id in filters:
+        if attribute_id in Attribute.specials:
+            continue
+        for sa in metadata.get_attribute_servertype_attributes(attribute_id):
+            servertype_attribute_ids.setdefault(
+                sa.servertype_id, set()
+            ).add(attribute_id)
+
+    groups = {}
+    for object_id, servertype_id in Server.objects.filter(
+        server_id__in=object_ids
+    ).values_list('server_id', 'servertype_id'):
+        present = servertype_attribute_ids.get(servertype_id, set())
+        missing = frozenset(
+            a for a in filters
+            if a not in Attribute.specials and a not in present
+        )
+        groups.setdefault(missing, []).append(object_id)
+
+    for missing, group_object_ids in groups.items():
+        if all(_matches_none(filters[a]) for a in missing):
+            yield (
+                {a: f for a, f in filters.items() if a not in missing},
+                group_object_ids,
+            )
+
+
+def _matches_none(filt):
+    try:
+        return filt.matches(None)
+    except TypeError:
+        # The comparison filters cannot compare None.
+        return False
+
+
+def _get_matching_object_ids(filters, object_ids, metadata):
+    attribute_lookup, filters, related_vias = _prepare_filters(
+        filters, set(filters), metadata=metadata
+    )
+    attribute_filters = _get_attribute_filters(filters, attribute_lookup)
+    if attribute_filters is None:
+        return set()
+
+    sql_query, sql_params = get_server_ids_query(
+        attribute_filters, related_vias, object_ids
+    )
+    with connections[Server.objects.db].cursor() as cursor:
+        try:
+            cursor.execute(
+                _get_execute_sql(sql_query, sql_params), sql_params
+            )
+        except DataError as error:
+            raise ValidationError(error)
+
+        return {r[0] for r in cursor.fetchall()}
+
+
+def execute_query_stream(filters, restrict, order_by):
+    """Execute the query yielding the results in chunks
+
+    The servers are read through a server-side cursor, and materialized
+    chunk by chunk, so that the complete results don't need to be kept in
+    memory.  The query is validated before the generator is returned,
+    so the errors in it are raised right away.
+    """
+    attribute_lookup, filters, related_vias, materializer_args = (
+        _prepare_query(filters, restrict, order_by)
+    )
+    sql_order_by = _get_sql_order_by(order_by, attribute_lookup)
+
+    # The database is chosen right away, because the generator may be
+    # consumed after the client context of the request is gone.
+    return _stream_query(
+        filters,
+        attribute_lookup,
+        related_vias,
+        materializer_args,
+        sql_order_by,
+        choose_read_database(),
+    )
+
+
+class QuerySnapshot:
+    """A snapshot of the database kept to read from it later
+
+    The snapshot is exported by a transaction on a connection of its own,
+    and it is available as long as that transaction is open.  It should be
+    closed as soon as it is not needed anymore, because the open
+    transaction holds the database back from cleaning up the old rows.
+    The database terminates the transaction anyway, if it is left idle for
+    longer than QUERY_SNAPSHOT_TIMEOUT.
+    """
+
+    def __init__(self, using=None):
+        if using is None:
+            using = choose_read_database()
+        self.using = using
+        self._connection = connections.create_connection(using)
+        # The snapshot may be closed by the garbage collector on another
+        # thread.
+        self._connection.inc_thread_sharing()
+        with self._connection.cursor() as cursor:
+            cursor.execute(
+                'SET idle_in_transaction_session_timeout = %s',
+                [settings.QUERY_SNAPSHOT_TIMEOUT * 1000],
+            )
+        self._connection.set_autocommit(False)
+        with self._connection.cursor() as cursor:
+            cursor.execute(
+                'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY'
+            )
+            cursor.execute('SELECT pg_export_snapshot()')
+            self.snapshot_id = cursor.fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+
+def execute_lazy_query(filters, order_by=None, limit=None, offset=0):
+    """Execute the query materializing only the special attributes
+
+    The rest of the attributes can be materialized later on the same
+    snapshot of the database using materialize_attributes().  The snapshot
+    is returned together with the results.  It is the callers
+    responsibility to close it.
+    """
+    snapshot = QuerySnapshot()
+    try:
+        results = _execute_query(
+            filters,
+            list(Attribute.specials),
+            order_by,
+            limit,
+            offset,
+            snapshot=snapshot,
+        )
+    except BaseException:
+        snapshot.close()
+        raise
+
+    return snapshot, results
+
+
+def materialize_attributes(snapshot, object_ids, attribute_ids):
+    """Materialize the attributes of the objects on the snapshot
+
+    The attributes of all of the objects are materialized at once.  Only
+    the objects having any of the attributes are returned.
+    """
+    attribute_lookup = _get_attribute_lookup(_get_metadata(attribute_ids))
+    _check_attributes_exist(attribute_ids, attribute_lookup)
+    joined_attributes = {attribute_lookup[a]: None for a in attribute_ids}
+
+    with _read_transaction(snapshot=snapshot):
+        servers = Server.objects.filter(server_id__in=object_ids)
+        return list(QueryMaterializer(servers, joined_attributes))
+
+
+def _execute_query(
+    filters,
+    restrict,
+    order_by,
+    limit,
+    offset,
+    profile=None,
+    snapshot=None,
+    using=None,
+):
+    attribute_lookup, filters, related_vias, materializer_args = (
+        _prepare_query(filters, restrict, order_by, profile)
+    )
+
+    # The pagination can only be done on the database, if the ordering
+    # can be done there too.  Otherwise, we have to materialize all of
+    # the results, and paginate them afterwards.  The materializer only
+    # needs to materialize the first ones completely.
+    sql_order_by = _get_sql_order_by(order_by, attribute_lookup)
+    if sql_order_by is None:
+        sql_pagination = (None, 0)
+        if limit is not None:
+            materializer_args.append(offset + limit)
+    else:
+        sql_pagination = (limit, offset)
+        materializer_args = materializer_args[:1]
+
+    with _read_transaction(using, snapshot):
+        # The actual query execution procedure is 2 steps: first filtering
+        # the objects, and then materializing the requested attributes.
+        # The joined attributes and ordering are also handled on
+        # the materialization step.  Ordering has to be handled by it, because
+        # some properties of the attribute values which might be relevant
+        # for ordering may be lost after the materialization.  See the query
+        # materializer module for its details.  The functions on this module
+        # continues with the filtering step.
+        servers = _get_servers(
+            filters,
+            attribute_lookup,
+            related_vias,
+            sql_order_by or [],
+            *sql_pagination,
+            profile=profile
+        )
+        with measure(profile, 'materializing'):
+            results = QueryMaterializer(
+                servers, *materializer_args, profile=profile
+            )
+            if sql_order_by is None and (limit is not None or offset):
+                stop = None if limit is None else offset + limit
+                results = islice(results, offset, stop)
+
+            return list(results)
+
+
+def _stream_query(
+    filters,
+    attribute_lookup,
+    related_vias,
+    materializer_args,
+    sql_order_by,
+    using,
+):
+    # See _execute_query() for the explanation of the steps.
+    with _read_transaction(using) as connection:
+
+        # If the results are not ordered on the database, the materializer
+        # needs all of them at once to order them.
+        if sql_order_by is None:
+            servers = _get_servers(
+                filters, attribute_lookup, related_vias, [], None, 0
+            )
+            yield list(QueryMaterializer(servers, *materializer_args))
+            return
+        materializer_args = materializer_args[:1]
+
+        sql = _get_server_query(
+            filters, attribute_lookup, related_vias, sql_order_by
+        )
+        if sql is None:
+            return
+
+        # The prepared statements cannot be used for cursors, so we pass
+        # the query directly in here.  The cursor is closed together with
+        # the transaction, if we are interrupted.
+        sql_query, sql_params = sql
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(
+                    'DECLARE server_stream NO SCROLL CURSOR FOR ' + sql_query,
+                    sql_params,
+                )
+            except DataError as error:
+                raise ValidationError(error)
+
+            while True:
+                servers = list(Server.objects.raw(
+                    'FETCH %s FROM server_stream', [STREAM_CHUNK_SIZE]
+                ))
+                if not servers:
+                    break
+                yield list(QueryMaterializer(servers, *materializer_args))
+
+            cursor.execute('CLOSE server_stream')
+
+
+@contextmanager
+def _read_transaction(using=None, snapshot=None):
+    """Open a read only transaction on the database to read from
+
+    REPEATABLE READ isolation level ensures Postgres to give us a consistent
+    snapshot for the database transaction.  We also set READ ONLY as this
+    is a query operation.  Perhaps this is also enabling some optimization
+    on the Postgres side.  The database is a replica, if one is configured,
+    and the client doesn't need to read its own writes.  If a QuerySnapshot
+    is given, the transaction reads from it instead.
+    """
+    if snapshot is not None:
+        using = snapshot.using
+    with read_from_replica(using) as using, transaction.atomic(using=using):
+        connection = connections[using]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY'
+            )
+            if snapshot is not None:
+                _set_snapshot(cursor, snapshot)
+        yield connection
+
+
+def _set_snapshot(cursor, snapshot):
+    try:
+        cursor.execute('SET TRANSACTION SNAPSHOT %s', [snapshot.snapshot_id])
+    except DatabaseError as error:
+        raise DatasetError(
+            'The snapshot of the query is not available anymore: {}'
+            .format(error)
+        ) from error
+
 
-def execute_query(filters, restrict, order_by):
-    """The main function to execute queries"""
+def _prepare_query(filters, restrict, order_by, profile=None, metadata=None):
+    """Prepare the arguments for the SQL generator and the materializer"""
 
     # We need the restrict argument in slightly different structure.
     if restrict is None:
@@ -25,48 +515,13 @@ def execute_query(filters, restrict, order_by):
     # modules.  We start by collecting the attributes we need on all parts
     # of the query.
     attribute_ids = set(_collect_attribute_ids(joins, filters, order_by))
-
-    # We can fetch the attributes altogether before starting the database
-    # transaction.  None on the restrict argument is special meaning
-    # materialize all possible attributes, so we query them all.  The database
-    # transaction doesn't have to be started yet, because the metadata like
-    # the attributes are mostly stable, and the data model wouldn't let us
-    # see anything in inconsistent state, even while it is being changed
-    # concurrently.  We start by the special attributes and fetch more
-    # if necessary.
-    attribute_lookup = dict(Attribute.specials)
-    if restrict is None:
-        _update_attribute_lookup(attribute_lookup)
-    elif any(a not in attribute_lookup for a in attribute_ids):
-        _update_attribute_lookup(attribute_lookup, attribute_ids)
-    _check_attributes_exist(attribute_ids, attribute_lookup)
-
-    # If we have real attributes on the query filter, we can use them to
-    # get the possible servertypes.  This is necessary to eliminate
-    # not-desired objects.  We also use them to eliminate the servertype
-    # attribute relations passed to the SQL generator module in "related_vias".
-    # This is an optimization that matters, because all of those in
-    # "related_vias" hit the database as complicated sub-queries.
-    related_vias = {}
-    real_attribute_ids = [a for a in filters if a not in Attribute.specials]
-    if real_attribute_ids:
-        servertype_attributes = list(ServertypeAttribute.objects.filter(
-            attribute_id__in=real_attribute_ids
-        ))
-        servertype_ids = _get_possible_servertype_ids(servertype_attributes)
-        filters = dict(filters)
-        servertype_ids = _override_servertype_filter(filters, servertype_ids)
-        servertype_attributes = [
-            sa for sa in servertype_attributes
-            if sa.servertype_id in servertype_ids
-        ]
-        _update_related_vias(
-            related_vias, servertype_attributes, attribute_lookup
-        )
+    attribute_lookup, filters, related_vias = _prepare_filters(
+        filters, attribute_ids, profile, metadata
+    )
 
     # Here we prepare the join dictionary for the query materializer.
-    # For None on the restrict argument, we just use the complete list of
-    # attributes prepared by the previous step.
+    # None on the restrict argument is special meaning materialize all
+    # possible attributes, so we just use the complete list of attributes.
     if restrict is None:
         materializer_args = [{a: None for a in attribute_lookup.values()}]
     else:
@@ -80,25 +535,53 @@ def execute_query(filters, restrict, order_by):
     if order_by is not None:
         materializer_args.append([attribute_lookup[a] for a in order_by])
 
-    # REPEATABLE READ isolation level ensures Postgres to give us a consistent
-    # snapshot for the database transaction.  We also set READ ONLY as this
-    # is a query operation.  Perhaps this is also enabling some optimization
-    # on the Postgres side.
-    with transaction.atomic():
-        connection.cursor().execute(
-            'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY'
-        )
+    return attribute_lookup, filters, related_vias, materializer_args
+
+
+def _prepare_filters(filters, attribute_ids, profile=None, metadata=None):
+    """Prepare the filters and the metadata for the SQL generator module"""
+
+    with measure(profile, 'attribute lookup'):
+        if metadata is None:
+            metadata = _get_metadata(attribute_ids)
+        attribute_lookup = _get_attribute_lookup(metadata)
+        _check_attributes_exist(attribute_ids, attribute_lookup)
+
+    # If we have real attributes on the query filter, we can use them to
+    # get the possible servertypes.  This is necessary to eliminate
+    # not-desired objects.  We also use them to eliminate the servertype
+    # attribute relations passed to the SQL generator module in "related_vias".
+    # This is an optimization that matters, because all of those in
+    # "related_vias" hit the database as complicated sub-queries.
+    related_vias = {}
+    real_attribute_ids = [a for a in filters if a not in Attribute.specials]
+    if real_attribute_ids:
+        with measure(profile, 'related vias'):
+            filters = dict(filters)
+            _update_related_vias(related_vias, _get_servertype_attributes(
+                metadata, filters, real_attribute_ids
+            ))
+
+    return attribute_lookup, filters, related_vias
 
-        # The actual query execution procedure is 2 steps: first filtering
-        # the objects, and then materializing the requested attributes.
-        # The joined attributes and ordering are also handled on
-        # the materialization step.  Ordering has to be handled by it, because
-        # some properties of the attribute values which might be relevant
-        # for ordering may be lost after the materialization.  See the query
-        # materializer module for its details.  The functions on this module
-        # continues with the filtering step.
-        servers = _get_servers(filters, attribute_lookup, related_vias)
-        return list(QueryMaterializer(servers, *materializer_args))
+
+def _get_servertype_attributes(metadata, filters, attribute_ids):
+    """Get the servertype attributes possible to match with the filters
+
+    The servertype filter is overridden with the possible servertypes.
+    """
+    servertype_attributes = [
+        sa
+        for attribute_id in attribute_ids
+        for sa in metadata.get_attribute_servertype_attributes(attribute_id)
+    ]
+    servertype_ids = _get_possible_servertype_ids(servertype_attributes)
+    servertype_ids = _override_servertype_filter(filters, servertype_ids)
+
+    return [
+        sa for sa in servertype_attributes
+        if sa.servertype_id in servertype_ids
+    ]
 
 
 def _get_joins(restrict):
@@ -134,14 +617,29 @@ def _collect_attribute_ids(joins=None, filters=None, order_by=None):
             yield attribute_id
 
 
-def _update_attribute_lookup(attribute_lookup, attribute_ids=None):
-    if attribute_ids is None:
-        queryset = Attribute.objects.all()
-    else:
-        queryset = Attribute.objects.filter(attribute_id__in=attribute_ids)
+def _get_metadata(attribute_ids):
+    """Get the metadata including the attributes, if they exist
 
-    for attribute in queryset:
-        attribute_lookup[attribute.attribute_id] = attribute
+    We get the attributes from the metadata cached by the process outside
+    of the database transaction.  This is fine, because the metadata like
+    the attributes are mostly stable, and the data model wouldn't let us
+    see anything in inconsistent state, even while it is being changed
+    concurrently.  If an attribute is not found, we load the metadata
+    again, in case it has just been created by another process.
+    """
+    metadata = get_metadata()
+    attribute_lookup = _get_attribute_lookup(metadata)
+    if any(a not in attribute_lookup for a in attribute_ids):
+        metadata = get_metadata(reload=True)
+
+    return metadata
+
+
+def _get_attribute_lookup(metadata):
+    attribute_lookup = dict(Attribute.specials)
+    attribute_lookup.update(metadata.attributes)
+
+    return attribute_lookup
 
 
 def _check_attributes_exist(attribute_ids, attribute_lookup):
@@ -194,46 +692,150 @@ def _override_servertype_filter(filters, servertype_ids):
     return servertype_ids
 
 
-def _update_related_vias(
-    related_vias, servertype_attributes, attribute_lookup
-):
+def _update_related_vias(related_vias, servertype_attributes):
     """Prepare the related_vias dictionary for the SQL generator module
 
     It is lists in dictionaries of dictionaries indexed first by attribute_id
-    and then by the related_via_attribute.  The attribute lookup dictionary
-    passed to here may not have all of the related via attributes we need.
-    In this case we recursively query them and repeat the process for
-    the remaining object.
+    and then by the related_via_attribute.  The servertype attributes are
+    coming from the metadata, so their related via attributes are already
+    there.
     """
-    to_be_looked_up = []
     for sa in servertype_attributes:
-        related_via_attribute_id = sa.related_via_attribute_id
-        if not related_via_attribute_id:
-            related_via_attribute = None
-        elif related_via_attribute_id not in attribute_lookup:
-            to_be_looked_up.append(sa)
-            continue
-        else:
-            related_via_attribute = attribute_lookup[related_via_attribute_id]
-
         (
             related_vias
             .setdefault(sa.attribute_id, {})
-            .setdefault(related_via_attribute, [])
+            .setdefault(sa.related_via_attribute, [])
             .append(sa.servertype_id)
         )
 
-    if to_be_looked_up:
-        _update_attribute_lookup(
-            attribute_lookup,
-            {sa.related_via_attribute_id for sa in to_be_looked_up},
+
+def _get_sql_order_by(order_by, attribute_lookup):
+    """Return the attributes to order the servers by on the database
+
+    The special attributes and the single value attributes stored on
+    the attribute tables sort the same way on the database as on the query
+    materializer.  None is returned, if the ordering cannot be done on
+    the database.
+    """
+    if order_by is None:
+        return []
+
+    attributes = [attribute_lookup[a] for a in order_by]
+    if not all(map(_can_order_by_on_sql, attributes)):
+        return None
+
+    return attributes
+
+
+def _can_order_by_on_sql(attribute):
+    if attribute.special:
+        return True
+    if attribute.multi or attribute.type not in SQL_ORDER_BY_TYPES:
+        return False
+
+    # The values of the related attributes are stored on other servers.
+    return not any(
+        sa.related_via_attribute_id
+        for sa in get_metadata().get_attribute_servertype_attributes(
+            attribute.attribute_id
         )
-        _update_related_vias(related_vias, to_be_looked_up, attribute_lookup)
+    )
 
 
-def _get_servers(filters, attribute_lookup, related_vias):
+def _get_servers(
+    filters,
+    attribute_lookup,
+    related_vias,
+    order_by,
+    limit,
+    offset,
+    profile=None,
+):
     """Evaluate the filters to fetch the matching servers"""
 
+    # If you managed to read this so far, the last step is refreshingly
+    # easy: get and execute the raw SQL query.
+    sql = _get_server_query(
+        filters, attribute_lookup, related_vias, order_by, limit, offset
+    )
+    if sql is None:
+        return []
+    sql_query, sql_params = sql
+    execute_sql = _get_execute_sql(sql_query, sql_params)
+    try:
+        with measure(profile, 'filtering'):
+            servers = list(Server.objects.raw(execute_sql, sql_params))
+    except DataError as error:
+        raise ValidationError(error)
+
+    if profile is not None:
+        profile.sql = sql_query
+        profile.sql_params = sql_params
+        with connections[Server.objects.db].cursor() as cursor:
+            cursor.execute(
+                'EXPLAIN (ANALYZE, BUFFERS) ' + execute_sql, sql_params
+            )
+            profile.explain = '\n'.join(r[0] for r in cursor.fetchall())
+
+    return servers
+
+
+def _get_server_query(
+    filters, attribute_lookup, related_vias, order_by, limit=None, offset=None
+):
+    """Return the SQL query and its parameters to filter the servers
+
+    None is returned, if the filters can never match.
+    """
+    lookup = _get_lookup_values(filters)
+    if lookup is not None:
+        attribute_id, values = lookup
+        return get_server_lookup_query(
+            attribute_lookup[attribute_id], values, order_by, limit, offset
+        )
+
+    attribute_filters = _get_attribute_filters(filters, attribute_lookup)
+    if attribute_filters is None:
+        return None
+
+    return get_server_query(
+        attribute_filters, related_vias, order_by, limit, offset
+    )
+
+
+def _get_lookup_values(filters):
+    """Return the attribute and the values, if the query is a point lookup
+
+    Looking up the objects by their object_ids or hostnames is the most
+    common query by far.  We don't need to generate the SQL for those.
+    We only take the plain values of the correct type, and let the rest
+    to go through the usual way, so the errors are the same.
+    """
+    if len(filters) != 1:
+        return None
+
+    for attribute_id, filt in filters.items():
+        break
+    if attribute_id not in LOOKUP_TYPES:
+        return None
+
+    values = filt.values if type(filt) is Any else [filt]
+    value_type = LOOKUP_TYPES[attribute_id]
+    if not values or any(
+        type(v) is not BaseFilter or type(v.value) is not value_type
+        for v in values
+    ):
+        return None
+
+    return attribute_id, [v.value for v in values]
+
+
+def _get_attribute_filters(filters, attribute_lookup):
+    """Return the filters to pass to the SQL generator module
+
+    None is returned, if the filters can never match.
+    """
+
     # From now on, we will pass the filters dictionary using the attribute
     # objects as the keys.  The SQL generator module will repeatedly need
     # the properties of the attributes.
@@ -248,16 +850,59 @@ def _get_servers(filters, attribute_lookup, related_vias):
         # nonexistent attributes.
         destiny = filt.destiny()
         if destiny is False:
-            return []
+            return None
         if destiny is True:
             continue
 
         attribute_filters.append((attribute_lookup[attribute_id], filt))
 
-    # If you managed to read this so far, the last step is refreshingly
-    # easy: get and execute the raw SQL query.
-    sql_query = get_server_query(attribute_filters, related_vias)
-    try:
-        return list(Server.objects.defer('intern_ip').raw(sql_query))
-    except DataError as error:
-        raise ValidationError(error)
+    return attribute_filters
+
+
+def _get_execute_sql(sql_query, sql_params):
+    """Return the SQL to execute the query through a prepared statement
+
+    The filter values are passed as parameters to the query, so the queries
+    with the same shape are going to produce the same SQL.  We prepare
+    the statement once per connection, and execute it with the new values
+    to avoid Postgres planning the query again and again.
+    """
+    connection = connections[Server.objects.db]
+    connection.ensure_connection()
+    statements = _prepared_statements.setdefault(
+        connection.connection, OrderedDict()
+    )
+
+    statement_name = statements.get(sql_query)
+    if statement_name is None:
+        statement_name = (
+            'server_query_' + sha1(sql_query.encode()).hexdigest()[:16]
+        )
+        with connection.cursor() as cursor:
+            if len(statements) >= PREPARED_STATEMENTS_LIMIT:
+                cursor.execute(
+                    'DEALLOCATE ' + statements.popitem(last=False)[1]
+                )
+            cursor.execute('PREPARE {} AS {}'.format(
+                statement_name, _number_placeholders(sql_query)
+            ))
+        statements[sql_query] = statement_name
+    else:
+        statements.move_to_end(sql_query)
+
+    execute_sql = 'EXECUTE ' + statement_name
+    if sql_params:
+        execute_sql += ' ({})'.format(', '.join(['%s'] * len(sql_params)))
+
+    return execute_sql
+
+
+def _number_placeholders(sql_query):
+    """Convert the DB-API placeholders to the ones PREPARE expects"""
+    numbers = count(1)
+
+    return re.sub(
+        '%[%s]',
+        lambda m: '%' if m.group() == '%%' else '${}'.format(next(numbers)),
+        sql_query,
+    )
@@ -7,244 +7,374 @@ Copyright (c) 2019 InnoGames GmbH
 # a good idea to refactor this by using more top level functions instead of
 # object methods.
 
+from concurrent.futures import ThreadPoolExecutor
+from heapq import nsmallest
 from ipaddress import IPv4Address, IPv6Address
 
+from django.conf import settings
+from django.db import connections, transaction
+
 from adminapi.dataset import DatasetObject
+from serveradmin.serverdb.metadata import get_metadata
+from serveradmin.serverdb.query_profile import measure
 from serveradmin.serverdb.models import (
-    Servertype,
     Attribute,
-    ServertypeAttribute,
     Server,
     ServerAttribute,
+    ServerMACAddressAttribute,
     ServerRelationAttribute,
+    inet_to_python,
+)
+
+
+# The attribute types with values stored on the attribute tables, and
+# the database types of their values
+VALUE_TYPES = ['string', 'number', 'inet', 'macaddr', 'date', 'datetime']
+VALUE_DB_TYPES = [
+    'character varying',
+    'numeric',
+    'inet',
+    'macaddr',
+    'date',
+    'timestamp with time zone',
+]
+MACADDR_FIELD = ServerMACAddressAttribute._meta.get_field('value')
+
+# The columns of the related servers of the relations
+RELATED_COLUMNS = ['server_id', 'hostname', 'intern_ip', 'servertype_id']
+RELATED_DB_TYPES = [
+    'integer',
+    'character varying',
+    'inet',
+    'character varying',
+]
+
+# The pool of the threads to materialize the attributes in parallel.  It is
+# created on the first use.
+_executor = None
+
+# The marker for the attributes the servertype of the server doesn't have
+MISSING = object()
+
+# The related attributes can be related via the attributes of the related
+# servers again.  We stop following them after this many hops to protect
+# against the circular relations.
+RELATED_VIA_MAX_HOPS = 8
+
+# The GiST index on the intern_ip is used to find the networks
+SUPERNET_QUERY = (
+    'SELECT DISTINCT ON (server.server_id)'
+    ' server.server_id,'
+    ' supernet.server_id,'
+    ' supernet.hostname,'
+    ' supernet.intern_ip,'
+    ' supernet.servertype_id'
+    ' FROM server'
+    ' JOIN server AS supernet'
+    ' ON supernet.intern_ip >>= server.intern_ip'
+    ' WHERE server.server_id = ANY(%s) AND supernet.servertype_id = %s'
+    ' ORDER BY server.server_id, masklen(supernet.intern_ip) DESC'
 )
 
 
 class QueryMaterializer:
-    def __init__(self, servers, joined_attributes, order_by_attributes=[]):
-        self._servers = servers
+    def __init__(
+        self,
+        servers,
+        joined_attributes,
+        order_by_attributes=[],
+        limit=None,
+        profile=None,
+    ):
+        self._servers = list(servers)
         self._joined_attributes = joined_attributes
         self._order_by_attributes = order_by_attributes
-        # XXX: Optimize this query out
-        self._servertype_lookup = {
-            servertype.servertype_id: servertype
-            for servertype in Servertype.objects.all()
-        }
-
-        self._server_attributes = {}
+        self._profile = profile
+
+        # If only the first servers are needed, we order the servers by
+        # materializing only the attributes to order by first, and then
+        # materialize the rest only for the first ones.
+        if (
+            order_by_attributes and
+            limit is not None and
+            limit < len(self._servers)
+        ):
+            with measure(profile, 'ordering'):
+                self._servers = type(self)(
+                    self._servers,
+                    {a: None for a in order_by_attributes},
+                    order_by_attributes,
+                    profile=profile,
+                )._get_ordered_servers(limit)
+
+        self._metadata = get_metadata()
+        self._servertype_lookup = self._metadata.servertypes
+
+        # The results are stored in columns.  The servers are indexed by
+        # their rows.  Every attribute has a list of values, and a bitmap
+        # of the servers having it.  The special attributes are taken from
+        # the servers themselves.
+        self._rows = {}
+        self._columns = {}
+        self._present = {}
         servers_by_type = {}
-        for server in self._servers:
-            self._server_attributes[server] = {
-                Attribute.specials['object_id']: server.server_id,
-                Attribute.specials['hostname']: server.hostname,
-                Attribute.specials['intern_ip']: server.intern_ip,
-                Attribute.specials['servertype']: server.servertype_id,
-            }
+        for row, server in enumerate(self._servers):
+            self._rows[server.server_id] = row
             servers_by_type.setdefault(server.servertype_id, []).append(server)
 
         self._select_attributes(servers_by_type.keys())
         self._initialize_attributes(servers_by_type)
         self._add_attributes(servers_by_type)
-        self._add_related_attributes(servers_by_type)
+        with measure(self._profile, 'materializing related attributes'):
+            self._add_related_attributes(servers_by_type)
 
     def __iter__(self):
-        servers = self._servers
-        if self._order_by_attributes:
-            def order_by_key(key):
-                return tuple(
-                    self._get_order_by_attribute(key, a)
-                    for a in self._order_by_attributes
-                )
-
-            servers = sorted(servers, key=order_by_key)
-
-        join_results = self._get_join_results()
+        servers = self._get_ordered_servers()
+        with measure(self._profile, 'materializing joins'):
+            join_results = self._get_join_results()
         return (
             DatasetObject(self._get_attributes(s, join_results), s.server_id)
             for s in servers
         )
 
+    def _get_ordered_servers(self, limit=None):
+        """Return the servers in order
+
+        A heap is used to get the first ones, if a limit is given.
+        """
+        if not self._order_by_attributes:
+            return self._servers[:limit]
+
+        def order_by_key(key):
+            return tuple(
+                self._get_order_by_attribute(key, a)
+                for a in self._order_by_attributes
+            )
+
+        if limit is None:
+            return sorted(self._servers, key=order_by_key)
+        return nsmallest(limit, self._servers, key=order_by_key)
+
     def _select_attributes(self, servertype_ids):
         self._attributes_by_type = {}
         self._servertype_ids_by_attribute = {}
         self._related_servertype_attributes = []
-        attributes = {
-            a.attribute_id: a for a in self._joined_attributes
-        }
-        for sa in ServertypeAttribute.objects.filter(
-            servertype_id__in=servertype_ids,
-            attribute__in=self._joined_attributes,
-        ):
-            attribute = attributes[sa.attribute_id]
-            self._select_servertype_attribute(attribute, sa)
+        for servertype_id in servertype_ids:
+            servertype_attributes = self._metadata.get_servertype_attributes(
+                servertype_id
+            )
+            for attribute in self._joined_attributes:
+                sa = servertype_attributes.get(attribute.attribute_id)
+                if sa is not None:
+                    self._select_servertype_attribute(attribute, sa)
 
     def _select_servertype_attribute(self, attribute, sa):
+        servertype_ids = self._servertype_ids_by_attribute.setdefault(
+            attribute, []
+        )
+        if sa.servertype_id in servertype_ids:
+            return
+        servertype_ids.append(sa.servertype_id)
         self._attributes_by_type.setdefault(attribute.type, set()).add(
             attribute
         )
-        self._servertype_ids_by_attribute.setdefault(attribute, []).append(
-            sa.servertype_id
-        )
 
         related_via_attribute_id = sa.related_via_attribute_id
         if related_via_attribute_id:
-            # TODO: Order the list in a way to support recursive related
-            # attributes.
             self._related_servertype_attributes.append((attribute, sa))
 
             # If we have related attributes in the attribute list, we have
             # to add the relations in there, too.  We are going to use
-            # those to query the related attributes.
-            # TODO: Optimize this to avoid recursion and selecting related
-            # attribute in here
-            sa = ServertypeAttribute.objects.filter(
-                servertype_id=sa.servertype_id,
-                attribute_id=related_via_attribute_id,
-            ).prefetch_related('attribute').get()
+            # those to query the related attributes.  They can be related
+            # via other attributes as well.
+            sa = self._metadata.get_servertype_attribute(
+                sa.servertype_id, related_via_attribute_id
+            )
             self._select_servertype_attribute(sa.attribute, sa)
 
     def _initialize_attributes(self, servers_by_type):
+        """Initialize the columns of the attributes
+
+        The values are initialized to False for the booleans, and None
+        for the rest.  The sets of the multi attributes are only created
+        when a value is added.
+        """
         for attribute, servertype_ids in (
             self._servertype_ids_by_attribute.items()
         ):
-            init = attribute.initializer()
+            init = False if attribute.type == 'boolean' else None
+            self._columns[attribute] = [init] * len(self._servers)
+            present = self._present[attribute] = bytearray(len(self._servers))
             for servertype_id in servertype_ids:
                 for server in servers_by_type[servertype_id]:
-                    self._server_attributes[server][attribute] = init()
+                    present[self._rows[server.server_id]] = 1
+
+        self._output_attributes = [
+            a
+            for a in list(Attribute.specials.values()) + list(self._columns)
+            if a in self._joined_attributes
+        ]
 
     def _add_attributes(self, servers_by_type):
         """Add the attributes to the results"""
-        for key, attributes in self._attributes_by_type.items():
-            if key == 'supernet':
-                for attribute in attributes:
-                    self._add_supernet_attribute(attribute, (
+        with measure(self._profile, 'materializing attributes'):
+            self._add_attribute_values()
+
+        for key, get_values in [
+            ('supernet', _get_supernets),
+            ('domain', _get_domains),
+        ]:
+            for attribute in self._attributes_by_type.get(key, ()):
+                stage = 'materializing {} attributes'.format(key)
+                with measure(self._profile, stage):
+                    for server, value in get_values(attribute, [
                         s
                         for st in self._servertype_ids_by_attribute[attribute]
                         for s in servers_by_type[st]
-                    ))
-            elif key == 'domain':
-                for attribute in attributes:
-                    self._add_domain_attribute(attribute, [
-                        s
-                        for st in self._servertype_ids_by_attribute[attribute]
-                        for s in servers_by_type[st]
-                    ])
-            elif key == 'reverse':
-                reversed_attributes = {
-                    a.reversed_attribute_id: a for a in attributes
-                }
-                for sa in ServerRelationAttribute.objects.filter(
-                    value_id__in=self._server_attributes.keys(),
-                    attribute_id__in=reversed_attributes.keys(),
-                ).prefetch_related('server').defer(
-                    'server__intern_ip',
-                    'server__servertype',
-                ):
-                    self._add_attribute_value(
-                        sa.value,
-                        reversed_attributes[sa.attribute_id],
-                        sa.server,
-                    )
-            else:
-                attribute_lookup = {a.attribute_id: a for a in attributes}
-                for sa in ServerAttribute.get_model(key).objects.filter(
-                    server__in=self._server_attributes.keys(),
-                    attribute__in=attributes,
-                ).prefetch_related('server').defer(
-                    'server__intern_ip',
-                    'server__servertype',
-                ):
-                    self._add_attribute_value(
-                        sa.server,
-                        attribute_lookup[sa.attribute_id],
-                        sa.get_value(),
-                    )
+                    ]):
+                        self._add_attribute_value(server, attribute, value)
 
-    def _add_related_attributes(self, servers_by_type):
-        for attribute, sa in self._related_servertype_attributes:
-            self._add_related_attribute(attribute, sa, servers_by_type)
-
-    def _add_domain_attribute(self, attribute, servers):
-        domain_names = {s.hostname.split('.', 1)[-1] for s in servers}
-        domain_lookup = {
-            domain.hostname: domain
-            for domain in Server.objects.filter(
-                servertype=attribute.target_servertype,
-                hostname__in=domain_names,
-            )
-        }
+    def _add_attribute_values(self):
+        """Add the values of the attributes stored on the attribute tables
 
-        for server in servers:
-            self._server_attributes[server][attribute] = domain_lookup.get(
-                server.hostname.split('.', 1)[-1]
-            )
+        The values of all of the types are fetched with a single query
+        returning plain tuples.  We don't create the model objects for
+        the attribute values.  Only the related servers are created.
+        """
+        attribute_lookup = _get_attribute_lookup(
+            a
+            for k, attributes in self._attributes_by_type.items()
+            if k not in ('supernet', 'domain')
+            for a in attributes
+        )
+        servers = {s.server_id: s for s in self._servers}
+        for server_id, attributes, value in _fetch_attribute_values(
+            attribute_lookup, list(servers)
+        ):
+            for attribute in attributes:
+                self._add_attribute_value(servers[server_id], attribute, value)
 
-    def _add_supernet_attribute(self, attribute, servers):
-        """Merge-join networks to the servers
+    def _add_related_attributes(self, servers_by_type):
+        """Add the attributes related via other attributes
 
-        This function takes advantage of networks in the same servertype not
-        overlapping with each other.
+        The related attributes can be related via the attributes which are
+        related themselves.  We resolve the ones which don't depend on
+        the others on the same servertype first.
         """
-        target = None
-        for source in sorted(servers, key=lambda s: _sort_key(s.intern_ip)):
-            # Check the previous target
-            if target is not None:
-                network = target.intern_ip.network
-                if network.version != source.intern_ip.version:
-                    target = None
-                elif network.broadcast_address < source.intern_ip.ip:
-                    target = None
-                elif source.intern_ip not in network:
-                    continue
-            # Check for a new target
-            if target is None and source.intern_ip:
-                try:
-                    target = source.get_supernet(attribute.target_servertype)
-                except Server.DoesNotExist:
-                    continue
-            self._server_attributes[source][attribute] = target
-
-    def _add_related_attribute(
-        self, attribute, servertype_attribute, servers_by_type
+        pending = self._related_servertype_attributes
+        while pending:
+            pending_keys = {(a, sa.servertype_id) for a, sa in pending}
+            ready = [
+                (a, sa)
+                for a, sa in pending
+                if (sa.related_via_attribute, sa.servertype_id)
+                not in pending_keys
+            ]
+            if not ready:
+                # The attributes are related via each other.
+                break
+            self._add_related_attributes_via(ready, servers_by_type)
+            pending = [p for p in pending if p not in ready]
+
+    def _add_related_attributes_via(
+        self, servertype_attributes, servers_by_type
     ):
-        related_via_attribute = servertype_attribute.related_via_attribute
-
-        # First, index the related servers for fast access later
-        servers_by_related = {}
-        for target in servers_by_type[servertype_attribute.servertype_id]:
-            attributes = self._server_attributes[target]
-            if related_via_attribute in attributes:
-                if related_via_attribute.multi:
-                    for source in attributes[related_via_attribute]:
-                        servers_by_related.setdefault(source, []).append(
-                            target
-                        )
-                else:
-                    source = attributes[related_via_attribute]
-                    servers_by_related.setdefault(source, []).append(target)
-
-        # Then, query and set the related attributes
-        for sa in ServerAttribute.get_model(attribute.type).objects.filter(
-            server__hostname__in=servers_by_related.keys(),
-            attribute=attribute,
-        ).prefetch_related('server').defer(
-            'server__intern_ip',
-            'server__servertype',
-        ):
-            for target in servers_by_related[sa.server]:
-                self._add_attribute_value(target, attribute, sa.get_value())
+        """Add the related attributes by following the relations hop by hop
+
+        On every hop, the values on the related servers are queried all at
+        once.  If the attribute is related via another attribute on
+        the servertype of the related server too, we query the value of
+        that attribute instead, and continue with the next hop.
+        """
+        targets = {}
+        for attribute, sa in servertype_attributes:
+            related_via_attribute = sa.related_via_attribute
+            for target in servers_by_type[sa.servertype_id]:
+                for related in _iter_values(
+                    related_via_attribute,
+                    self._get_value(target, related_via_attribute),
+                ):
+                    targets.setdefault((attribute, related), []).append(target)
+
+        for _ in range(RELATED_VIA_MAX_HOPS):
+            if not targets:
+                break
+            targets = self._add_related_hop(targets)
+
+    def _add_related_hop(self, targets):
+        """Add the values found on the related servers
+
+        The targets are the servers to add the values to indexed by
+        the attributes and the related servers to take them from.
+        The targets for the next hop are returned.
+        """
+        related_vias = {}
+        to_fetch = {}
+        for attribute, related in targets:
+            sa = self._metadata.get_servertype_attributes(
+                related.servertype_id
+            ).get(attribute.attribute_id)
+            related_via_attribute = sa and sa.related_via_attribute
+            related_vias[attribute, related] = related_via_attribute
+            to_fetch.setdefault(related_via_attribute or attribute, []).append(
+                related
+            )
+        values = _fetch_values(to_fetch)
+
+        next_targets = {}
+        for (attribute, related), servers in targets.items():
+            related_via_attribute = related_vias[attribute, related]
+            if related_via_attribute is None:
+                for value in _iter_values(
+                    attribute, values.get((attribute, related))
+                ):
+                    for server in servers:
+                        self._add_attribute_value(server, attribute, value)
+                continue
+
+            for next_related in _iter_values(
+                related_via_attribute,
+                values.get((related_via_attribute, related)),
+            ):
+                next_targets.setdefault((attribute, next_related), []).extend(
+                    servers
+                )
+
+        return next_targets
 
     def _add_attribute_value(self, server, attribute, value):
-        if attribute.multi:
-            try:
-                self._server_attributes[server][attribute].add(value)
-            except KeyError:
-                # If the attribute is removed from the servertype but
-                # left on the servers, this error would occur.  It is not
-                # really expected, but we don't want to crash either.
-                pass
+        row = self._rows[server.server_id]
+        if not self._present[attribute][row]:
+            # If the attribute is removed from the servertype but left on
+            # the servers, this would occur.  It is not really expected,
+            # but we don't want to crash either.
+            return
+
+        column = self._columns[attribute]
+        if not attribute.multi:
+            column[row] = value
+        elif column[row] is None:
+            column[row] = {value}
         else:
-            self._server_attributes[server][attribute] = value
+            column[row].add(value)
+
+    def _get_value(self, server, attribute):
+        """Return the value of the attribute
+
+        MISSING is returned, if the servertype doesn't have the attribute.
+        """
+        if attribute.special:
+            return getattr(server, attribute.special.field)
+
+        present = self._present.get(attribute)
+        row = self._rows[server.server_id]
+        if present is None or not present[row]:
+            return MISSING
+
+        value = self._columns[attribute][row]
+        if value is None and attribute.multi:
+            return set()
+        return value
 
     def _get_order_by_attribute(self, server, attribute):
         """Return a tuple to sort items by the key
@@ -255,9 +385,9 @@ class QueryMaterializer:
         mind that some datatypes are not sortable with each other, some
         not even with None, so we have to so something in here.
         """
-        if attribute not in self._server_attributes[server]:
+        value = self._get_value(server, attribute)
+        if value is MISSING:
             return 1, None
-        value = self._server_attributes[server][attribute]
         if value is None:
             return -1, None
         if attribute.multi:
@@ -266,9 +396,9 @@ class QueryMaterializer:
 
     def _get_attributes(self, server, join_results):   # NOQA: C901
         servertype = self._servertype_lookup[server.servertype_id]
-        server_attributes = self._server_attributes[server]
-        for attribute, value in server_attributes.items():
-            if attribute not in self._joined_attributes:
+        for attribute in self._output_attributes:
+            value = self._get_value(server, attribute)
+            if value is MISSING:
                 continue
 
             if attribute.type == 'inet':
@@ -308,28 +438,340 @@ class QueryMaterializer:
                 continue
 
             servers = self._get_servers_to_join(attribute)
-            server_objs = type(self)(servers, joined_attributes)
+            server_objs = type(self)(
+                servers, joined_attributes, profile=self._profile
+            )
             results[attribute] = dict(zip(servers, server_objs))
 
         return results
 
     def _get_servers_to_join(self, attribute):
         servers = set()
-        for server_attributes in self._server_attributes.values():
-            if attribute in server_attributes:
-                value = server_attributes[attribute]
-                if value is None:
-                    continue
+        for value in self._columns.get(attribute, ()):
+            if value is None:
+                continue
 
-                if attribute.multi:
-                    for server in value:
-                        servers.add(server)
-                else:
-                    servers.add(value)
+            if attribute.multi:
+                servers.update(value)
+            else:
+                servers.add(value)
 
         return servers
 
 
+def _get_attribute_values_query(attribute_lookup, server_ids):
+    """Return the SQL query and its parameters to fetch the values
+
+    The values of every type are selected into their own columns, so that
+    the database driver still converts them to the Python types for us.
+    The last columns are for the related servers of the relations.
+    """
+    selects = []
+    params = []
+    for key, lookup in attribute_lookup.items():
+        if key == 'reverse':
+            model, server_column, related_column = (
+                ServerRelationAttribute, 'value', 'server_id'
+            )
+        elif key == 'relation':
+            model, server_column, related_column = (
+                ServerRelationAttribute, 'server_id', 'value'
+            )
+        else:
+            model, server_column, related_column = (
+                ServerAttribute.get_model(key), 'server_id', None
+            )
+
+        columns = [
+            'sa.{} AS server_id'.format(server_column),
+            'sa.attribute_id',
+            "'{}'".format(key),
+        ]
+        for value_type, db_type in zip(VALUE_TYPES, VALUE_DB_TYPES):
+            if value_type == key:
+                columns.append('sa.value')
+            else:
+                columns.append('NULL::' + db_type)
+        for column, db_type in zip(RELATED_COLUMNS, RELATED_DB_TYPES):
+            if related_column:
+                columns.append('related.' + column)
+            else:
+                columns.append('NULL::' + db_type)
+
+        sql = 'SELECT {} FROM {} AS sa'.format(
+            ', '.join(columns), model._meta.db_table
+        )
+        if related_column:
+            sql += (
+                ' JOIN server AS related'
+                ' ON related.server_id = sa.{}'.format(related_column)
+            )
+        sql += ' WHERE sa.{} = ANY(%s) AND sa.attribute_id = ANY(%s)'.format(
+            server_column
+        )
+        selects.append(sql)
+        params += [server_ids, list(lookup)]
+
+    return ' UNION ALL '.join(selects), params
+
+
+def _get_attribute_lookup(attributes):
+    """Index the attributes stored on the attribute tables
+
+    They are indexed first by the type, and then by the attribute_id
+    they are stored with.
+    """
+    attribute_lookup = {}
+    for attribute in attributes:
+        if attribute.type == 'reverse':
+            attribute_id = attribute.reversed_attribute_id
+        else:
+            attribute_id = attribute.attribute_id
+        (
+            attribute_lookup
+            .setdefault(attribute.type, {})
+            .setdefault(attribute_id, [])
+            .append(attribute)
+        )
+
+    return attribute_lookup
+
+
+def _fetch_attribute_values(attribute_lookup, server_ids):
+    """Yield the server_ids, the attributes and the values
+
+    The multi attributes are yielded once for every value.
+    """
+    if not attribute_lookup or not server_ids:
+        return
+
+    connection = connections[Server.objects.db]
+    related_servers = {}
+    for row in _fetch_attribute_rows(connection, attribute_lookup, server_ids):
+        server_id, attribute_id, key = row[:3]
+        if key in ('relation', 'reverse'):
+            value = _get_related_server(
+                related_servers, connection.alias, row
+            )
+        else:
+            value = _decode_value(key, row)
+
+        yield server_id, attribute_lookup[key][attribute_id], value
+
+
+def _fetch_attribute_rows(connection, attribute_lookup, server_ids):
+    """Yield the rows of the attribute values
+
+    The servers are split between the parallel workers, if they are
+    enabled and there are enough of them.  The workers see the same
+    snapshot of the database as the transaction we are in.
+    """
+    workers = settings.PARALLEL_MATERIALIZER_WORKERS
+    min_servers = settings.PARALLEL_MATERIALIZER_MIN_SERVERS
+    if workers and len(server_ids) >= min_servers:
+        snapshot_id = _export_snapshot(connection)
+        if snapshot_id is not None:
+            futures = [
+                _get_executor().submit(
+                    _fetch_rows_on_snapshot,
+                    connection.alias,
+                    snapshot_id,
+                    *_get_attribute_values_query(
+                        attribute_lookup, server_ids[i::workers]
+                    ),
+                )
+                for i in range(workers)
+            ]
+            for future in futures:
+                yield from future.result()
+            return
+
+    sql_query, sql_params = _get_attribute_values_query(
+        attribute_lookup, server_ids
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql_query, sql_params)
+        yield from cursor
+
+
+def _export_snapshot(connection):
+    """Export the snapshot of the transaction for the workers
+
+    None is returned, if we are not in a read only transaction with
+    a consistent snapshot.  The workers wouldn't see the changes made
+    by the transaction.
+    """
+    if not connection.in_atomic_block:
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT current_setting('transaction_isolation'),"
+            " current_setting('transaction_read_only')"
+        )
+        if cursor.fetchone() != ('repeatable read', 'on'):
+            return None
+        cursor.execute('SELECT pg_export_snapshot()')
+        return cursor.fetchone()[0]
+
+
+def _fetch_rows_on_snapshot(using, snapshot_id, sql_query, sql_params):
+    """Execute the query on the snapshot on the worker thread
+
+    Every worker thread has its own database connection.  It is reused by
+    the following tasks of the thread, as long as the CONN_MAX_AGE of
+    the database allows, like the connections of the requests.
+    """
+    connection = connections[using]
+    try:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(
+                'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY'
+            )
+            cursor.execute('SET TRANSACTION SNAPSHOT %s', [snapshot_id])
+            cursor.execute(sql_query, sql_params)
+            return cursor.fetchall()
+    finally:
+        connection.close_if_unusable_or_obsolete()
+
+
+def _get_executor():
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.PARALLEL_MATERIALIZER_WORKERS,
+            thread_name_prefix='query_materializer',
+        )
+
+    return _executor
+
+
+def _fetch_values(servers_by_attribute):
+    """Fetch the values of the attributes of the given servers
+
+    The values are returned indexed by the attributes and the servers.
+    The values of the multi attributes are returned as sets.
+    """
+    values = {}
+
+    def add_value(attribute, server, value):
+        if attribute.multi:
+            values.setdefault((attribute, server), set()).add(value)
+        else:
+            values[attribute, server] = value
+
+    servers = {
+        s.server_id: s
+        for a, servers in servers_by_attribute.items()
+        if a.type not in ('supernet', 'domain')
+        for s in servers
+    }
+    for server_id, attributes, value in _fetch_attribute_values(
+        _get_attribute_lookup(
+            a
+            for a in servers_by_attribute
+            if a.type not in ('supernet', 'domain')
+        ),
+        list(servers),
+    ):
+        for attribute in attributes:
+            add_value(attribute, servers[server_id], value)
+
+    for attribute, servers in servers_by_attribute.items():
+        if attribute.type == 'supernet':
+            pairs = _get_supernets(attribute, servers)
+        elif attribute.type == 'domain':
+            pairs = _get_domains(attribute, servers)
+        else:
+            continue
+        for server, value in pairs:
+            add_value(attribute, server, value)
+
+    return values
+
+
+def _get_supernets(attribute, servers):
+    """Yield the servers and the networks containing them
+
+    The networks of all of the servers are fetched with a single query.
+    The networks in the same servertype are not expected to overlap,
+    but if they do, the most specific one is chosen.
+    """
+    servers = {s.server_id: s for s in servers if s.intern_ip}
+    if not servers:
+        return
+
+    connection = connections[Server.objects.db]
+    related_servers = {}
+    with connection.cursor() as cursor:
+        cursor.execute(SUPERNET_QUERY, [
+            list(servers), attribute.target_servertype_id
+        ])
+        for row in cursor:
+            yield servers[row[0]], _get_related_server(
+                related_servers, connection.alias, row
+            )
+
+
+def _get_domains(attribute, servers):
+    """Yield the servers and their domains"""
+    domain_names = {s.hostname.split('.', 1)[-1] for s in servers}
+    domain_lookup = {
+        domain.hostname: domain
+        for domain in Server.objects.filter(
+            servertype_id=attribute.target_servertype_id,
+            hostname__in=domain_names,
+        )
+    }
+
+    for server in servers:
+        domain = domain_lookup.get(server.hostname.split('.', 1)[-1])
+        if domain is not None:
+            yield server, domain
+
+
+def _iter_values(attribute, value):
+    if value is None:
+        return ()
+    if attribute.multi:
+        return value
+    return (value, )
+
+
+def _decode_value(key, row):
+    if key == 'boolean':
+        return True
+
+    value = row[3 + VALUE_TYPES.index(key)]
+    if key == 'number':
+        return int(value) if value.as_tuple().exponent == 0 else float(value)
+    if key == 'inet':
+        return inet_to_python(value)
+    if key == 'macaddr':
+        return MACADDR_FIELD.to_python(value)
+    return value
+
+
+def _get_related_server(related_servers, using, row):
+    """Get the related server on the last columns of the row
+
+    The same server object is used for all of the rows referring to it.
+    """
+    server_id, hostname, intern_ip, servertype_id = row[-4:]
+    server = related_servers.get(server_id)
+    if server is None:
+        if intern_ip is not None:
+            intern_ip = inet_to_python(intern_ip)
+        server = related_servers[server_id] = Server.from_db(
+            using, RELATED_COLUMNS, (
+                server_id, hostname, intern_ip, servertype_id
+            )
+        )
+
+    return server
+
+
 def _sort_key(value):
     if isinstance(value, (IPv4Address, IPv6Address)):
         return value.version, value
@@ -339,7 +781,11 @@ def _sort_key(value):
 
 
 def get_default_attribute_values(servertype_id):
-    servertype = Servertype.objects.get(servertype_id=servertype_id)
+    metadata = get_metadata()
+    if servertype_id not in metadata.servertypes:
+        # The servertype might be created by another process just now.
+        metadata = get_metadata(reload=True)
+    servertype = metadata.get_servertype(servertype_id)
     attribute_values = {}
 
     for attribute_id in Attribute.specials:
@@ -349,7 +795,9 @@ def get_default_attribute_values(servertype_id):
             value = None
         attribute_values[attribute_id] = value
 
-    for sa in servertype.attributes.all():
+    for sa in metadata.get_servertype_attributes(
+        servertype.servertype_id
+    ).values():
         attribute_values[sa.attribute_id] = sa.get_default_value()
 
     return attribute_values
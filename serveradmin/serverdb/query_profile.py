@@ -0,0 +1,48 @@
+"""Serveradmin - Query Profile
+
+Copyright (c) 2024 InnoGames GmbH
+"""
+
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+
+class QueryProfile:
+    """Details of a query execution to find out why it is slow
+
+    The stages are recorded in the order they finish, so the nested ones
+    appear before the stage including them.
+    """
+
+    def __init__(self):
+        self.sql = None
+        self.sql_params = None
+        self.explain = None
+        self.timings = []
+
+    @contextmanager
+    def measure(self, stage):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((stage, perf_counter() - start))
+
+    def serialize(self):
+        return {
+            'sql': self.sql,
+            'sql_params': self.sql_params,
+            'explain': self.explain,
+            'timings': [
+                {'stage': stage, 'seconds': seconds}
+                for stage, seconds in self.timings
+            ],
+        }
+
+
+def measure(profile, stage):
+    """Measure the stage, if the query is being profiled"""
+    if profile is None:
+        return nullcontext()
+
+    return profile.measure(stage)
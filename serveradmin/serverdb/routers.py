@@ -0,0 +1,162 @@
+"""Serveradmin - Database Routers
+
+Copyright (c) 2024 InnoGames GmbH
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from random import choice
+from time import monotonic
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.template.response import SimpleTemplateResponse
+from django.dispatch import receiver
+
+from serveradmin.serverdb.signals import post_commit
+
+PIN_CACHE_KEY_PREFIX = 'serveradmin_primary_pin:'
+
+# The database to read from is chosen once for the whole query, so that all
+# of its parts see the same snapshot.
+_read_database = ContextVar('read_database', default=None)
+
+# The client is the application or the user the request is made by.  We
+# use it to send the clients that have just committed to the primary, so
+# that they can read their own writes despite the replication lag.
+_client = ContextVar('client', default=None)
+
+# Without a client, we pin the whole process to the primary.  This is
+# the case for the scripts using serveradmin.dataset directly.
+_process_pinned_until = 0.0
+
+
+class ReplicaRouter:
+    """Route the reads inside read_from_replica() to the replicas
+
+    Everything else, including all writes, goes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_database.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas have the same data as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in settings.REPLICA_DATABASES:
+            return False
+        return None
+
+
+@contextmanager
+def read_from_replica(using=None):
+    """Send the reads to a replica, unless the primary is needed
+
+    See replica_view() to use it for the views.
+    """
+    if _read_database.get() is not None:
+        # We are already inside another one.
+        yield _read_database.get()
+        return
+
+    if using is None:
+        using = choose_read_database()
+    token = _read_database.set(using)
+    try:
+        yield using
+    finally:
+        _read_database.reset(token)
+
+
+def replica_view(view):
+    """Decorator to send the reads of the view to a replica
+
+    The template responses are rendered inside, because their querysets
+    are only evaluated while rendering.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with read_from_replica():
+            response = view(*args, **kwargs)
+            if isinstance(response, SimpleTemplateResponse):
+                response.render()
+
+        return response
+
+    return wrapper
+
+
+def get_read_database():
+    """Return the database chosen by the enclosing read_from_replica()"""
+    return _read_database.get()
+
+
+def choose_read_database():
+    replicas = settings.REPLICA_DATABASES
+    if (
+        not replicas or
+        # We must be able to read our own changes inside a transaction.
+        connections[DEFAULT_DB_ALIAS].in_atomic_block or
+        _is_pinned()
+    ):
+        return DEFAULT_DB_ALIAS
+
+    return choice(replicas)
+
+
+@contextmanager
+def client_context(app=None, user=None):
+    token = _client.set(_get_client_key(app, user))
+    try:
+        yield
+    finally:
+        _client.reset(token)
+
+
+def client_middleware(get_response):
+    """Middleware to identify the clients of the web interface"""
+    def middleware(request):
+        with client_context(user=getattr(request, 'user', None)):
+            return get_response(request)
+
+    return middleware
+
+
+def _get_client_key(app=None, user=None):
+    if app is not None:
+        return 'app:{}'.format(app.pk)
+    if user is not None and user.is_authenticated:
+        return 'user:{}'.format(user.pk)
+    return None
+
+
+def _is_pinned():
+    client_key = _client.get()
+    if client_key is None:
+        return _process_pinned_until > monotonic()
+    return bool(cache.get(PIN_CACHE_KEY_PREFIX + client_key))
+
+
+@receiver(post_commit)
+def pin_to_primary(sender, **kwargs):
+    global _process_pinned_until
+
+    if not settings.REPLICA_DATABASES:
+        return
+
+    client_key = _client.get()
+    if client_key is None:
+        _process_pinned_until = monotonic() + settings.REPLICA_PIN_TIMEOUT
+    else:
+        cache.set(
+            PIN_CACHE_KEY_PREFIX + client_key,
+            True,
+            timeout=settings.REPLICA_PIN_TIMEOUT,
+        )
@@ -2,8 +2,9 @@
 
 Copyright (c) 2019 InnoGames GmbH
 """
-# XXX: It is terrible to generate SQL this way.  We should make this use
-# parameterized queries at least.
+# XXX: It is terrible to generate SQL this way.  At least the filter values
+# are passed as query parameters, so the generated SQL only depends on
+# the shape of the query.
 # XXX: The code in this module is almost randomly split into functions.  Do
 # not try to guess what they would do.
 
@@ -34,9 +35,77 @@ from serveradmin.serverdb.models import (
 
 # XXX: The "related_vias" argument is carried all the way through most of
 # the functions to optimize related_via_attribute selection.  We should find
-# a nicer way to achieve this.
-def get_server_query(attribute_filters, related_vias):
+# a nicer way to achieve this.  The same goes for the "params" list the filter
+# values are collected into.  The values must be appended in the same order
+# as their placeholders appear on the SQL.
+def get_server_query(
+    attribute_filters, related_vias, order_by=(), limit=None, offset=None
+):
+    """Return the SQL query and its parameters to filter the servers
+
+    The servers are ordered by the given special attributes, and then by
+    the hostname.  The limit and the offset are passed as parameters too,
+    so the paginated queries have the same SQL for all of the pages.
+    """
+    params = []
+    sql = _get_select_clause()
+    sql += _get_where_clause(attribute_filters, related_vias, params)
+    sql += _get_order_by_clause(order_by, limit, offset, params)
+
+    return sql, params
+
+
+def get_server_lookup_query(
+    attribute, values, order_by=(), limit=None, offset=None
+):
+    """Return the SQL query and its parameters to look up the servers
+
+    This is a shortcut for the most common queries: the ones looking up
+    the servers by their object_ids or hostnames.  The values are passed
+    as a single array parameter, so the query has the same SQL no matter
+    how many values are looked up.
+    """
+    params = [list(values)]
+    sql = _get_select_clause()
+    sql += ' WHERE server.{} = ANY(%s)'.format(attribute.special.field)
+    sql += _get_order_by_clause(order_by, limit, offset, params)
+
+    return sql, params
+
+
+def get_server_ids_query(attribute_filters, related_vias, object_ids):
+    """Return the SQL query and its parameters to select the ones of
+    the given servers matching the filters
+
+    The object_ids are passed as a single array parameter like on
+    get_server_lookup_query(), so the query has the same SQL no matter
+    how many servers are given.
+    """
+    params = [list(object_ids)]
     sql = (
+        'SELECT server.server_id'
+        ' FROM server'
+        ' WHERE server.server_id = ANY(%s)'
+    )
+    for attribute, filt in attribute_filters:
+        sql += ' AND ' + _get_sql_condition(
+            attribute, filt, related_vias, params
+        )
+
+    return sql, params
+
+
+def get_server_count_query(attribute_filters, related_vias):
+    """Return the SQL query and its parameters to count the servers"""
+    params = []
+    sql = 'SELECT count(*) FROM server'
+    sql += _get_where_clause(attribute_filters, related_vias, params)
+
+    return sql, params
+
+
+def _get_select_clause():
+    return (
         'SELECT'
         ' server.server_id,'
         ' server.hostname,'
@@ -44,21 +113,87 @@ def get_server_query(attribute_filters, related_vias):
         ' server.servertype_id'
         ' FROM server'
     )
-    if attribute_filters:
-        sql += ' WHERE ' + ' AND '.join(
-            _get_sql_condition(a, f, related_vias)
-            for a, f in attribute_filters
-        )
-    sql += ' ORDER BY server.hostname'
+
+
+def _get_order_by_clause(order_by, limit, offset, params):
+    sql = ' ORDER BY ' + ', '.join(
+        [_get_order_by_sql(a, params) for a in order_by] +
+        ['server.hostname COLLATE "C"']
+    )
+    if limit is not None:
+        sql += ' LIMIT %s'
+        params.append(limit)
+    if offset:
+        sql += ' OFFSET %s'
+        params.append(offset)
 
     return sql
 
 
-def _get_sql_condition(attribute, filt, related_vias):
+def _get_order_by_sql(attribute, params):
+    """Return the SQL to order the servers by the attribute
+
+    The servers without the attribute on their servertype come last, and
+    the ones the attribute is not set come first.  This is the same as
+    the ordering of the query materializer.  The strings are compared
+    by their bytes as on Python.
+    """
+    if attribute.special:
+        if attribute.type == 'string':
+            return 'server.{} COLLATE "C" NULLS FIRST'.format(
+                attribute.special.field
+            )
+        return 'server.{} NULLS FIRST'.format(attribute.special.field)
+
+    model = ServerAttribute.get_model(attribute.type)
+    if attribute.type == 'boolean':
+        value_sql = 'EXISTS ({})'
+        value_column = '1'
+    else:
+        value_sql = '({}) NULLS FIRST'
+        if attribute.type == 'relation':
+            value_column = 'related.hostname COLLATE "C"'
+        elif attribute.type == 'string':
+            value_column = 'sub.value COLLATE "C"'
+        else:
+            value_column = 'sub.value'
+
+    sub_sql = 'SELECT {} FROM {} AS sub'.format(
+        value_column, model._meta.db_table
+    )
+    if attribute.type == 'relation':
+        sub_sql += ' JOIN server AS related ON related.server_id = sub.value'
+    sub_sql += (
+        ' WHERE sub.server_id = server.server_id AND sub.attribute_id = %s'
+    )
+    params.extend([attribute.attribute_id, attribute.attribute_id])
+
+    return (
+        'NOT EXISTS ('
+        ' SELECT 1 FROM servertype_attribute AS sa'
+        ' WHERE sa.servertype_id = server.servertype_id'
+        ' AND sa.attribute_id = %s'
+        '), ' + value_sql.format(sub_sql)
+    )
+
+
+def _get_where_clause(attribute_filters, related_vias, params):
+    if not attribute_filters:
+        return ''
+
+    return ' WHERE ' + ' AND '.join(
+        _get_sql_condition(a, f, related_vias, params)
+        for a, f in attribute_filters
+    )
+
+
+def _get_sql_condition(attribute, filt, related_vias, params):
     assert isinstance(filt, BaseFilter)
 
     if isinstance(filt, (Not, Any)):
-        return _logical_filter_sql_condition(attribute, filt, related_vias)
+        return _logical_filter_sql_condition(
+            attribute, filt, related_vias, params
+        )
 
     negate = False
     template = ''
@@ -80,16 +215,16 @@ def _get_sql_condition(attribute, filt, related_vias):
         negate = not filt.value
 
     elif isinstance(filt, Regexp):
-        template = '{0}::text ~ E' + _raw_sql_escape(filt.value)
+        template = '{0}::text ~ ' + _sql_param(params, filt.value)
     elif isinstance(filt, (GreaterThanOrEquals, LessThanOrEquals)):
-        template = _basic_comparison_filter_template(attribute, filt)
+        template = _basic_comparison_filter_template(attribute, filt, params)
     elif isinstance(filt, Overlaps):
-        template = _containment_filter_template(attribute, filt)
+        template = _containment_filter_template(attribute, filt, params)
     elif isinstance(filt, Empty):
         negate = True
         template = '{0} IS NOT NULL'
     else:
-        template = '{0} = ' + _raw_sql_escape(filt.value)
+        template = '{0} = ' + _sql_param(params, filt.value)
 
     return _covered_sql_condition(attribute, template, negate, related_vias)
 
@@ -111,10 +246,10 @@ def _covered_sql_condition(attribute, template, negate, related_vias):
     )
 
 
-def _logical_filter_sql_condition(attribute, filt, related_vias):
+def _logical_filter_sql_condition(attribute, filt, related_vias, params):
     if isinstance(filt, Not):
         return 'NOT ({0})'.format(
-            _get_sql_condition(attribute, filt.value, related_vias)
+            _get_sql_condition(attribute, filt.value, related_vias, params)
         )
 
     if isinstance(filt, All):
@@ -132,19 +267,19 @@ def _logical_filter_sql_condition(attribute, filt, related_vias):
             simple_values.append(value)
         else:
             templates.append(
-                _get_sql_condition(attribute, value, related_vias)
+                _get_sql_condition(attribute, value, related_vias, params)
             )
 
     if simple_values:
         if len(simple_values) == 1:
             template = _get_sql_condition(
-                attribute, simple_values[0], related_vias
+                attribute, simple_values[0], related_vias, params
             )
         else:
             template = _covered_sql_condition(
                 attribute,
                 '{{0}} IN ({0})'.format(', '.join(
-                    _raw_sql_escape(v.value) for v in simple_values
+                    _sql_param(params, v.value) for v in simple_values
                 )),
                 False,
                 related_vias,
@@ -154,7 +289,7 @@ def _logical_filter_sql_condition(attribute, filt, related_vias):
     return '({0})'.format(joiner.join(templates))
 
 
-def _basic_comparison_filter_template(attribute, filt):
+def _basic_comparison_filter_template(attribute, filt, params):
     if isinstance(filt, GreaterThan):
         operator = '>'
     elif isinstance(filt, LessThan):
@@ -164,18 +299,16 @@ def _basic_comparison_filter_template(attribute, filt):
     else:
         operator = '<='
 
-    return '{{}} {} {}'.format(
-        operator, _raw_sql_escape(filt.value)
-    )
+    return '{{}} {} {}'.format(operator, _sql_param(params, filt.value))
 
 
-def _containment_filter_template(attribute, filt):
+def _containment_filter_template(attribute, filt, params):
     template = None     # To be formatted 2 times
     value = filt.value
 
     if attribute.type == 'inet':
         if isinstance(filt, StartsWith):
-            template = "{{0}} >>= {0} AND host({{0}}) = host(0{})"
+            template = "{{0}} >>= {0} AND host({{0}}) = host({0})"
         elif isinstance(filt, Contains):
             template = "{{0}} >>= {0}"
         elif isinstance(filt, ContainedOnlyBy):
@@ -207,7 +340,12 @@ def _containment_filter_template(attribute, filt):
             .format(type(filt).__name__, attribute)
         )
 
-    return template.format(_raw_sql_escape(value))
+    # The templates may refer to the value multiple times.  Every one of
+    # the placeholders needs its own parameter, so we repeat it.
+    template = template.format(_sql_param(params, value))
+    params.extend(params[-1:] * (template.count('%s') - 1))
+
+    return template
 
 
 def _condition_sql(attribute, template, related_vias):
@@ -309,20 +447,13 @@ def _exists_sql(model, alias, conditions):
     )
 
 
-def _raw_sql_escape(value):
+def _sql_param(params, value):
+    """Add the value to the query parameters and return its placeholder"""
     try:
         value = str(value)
     except UnicodeEncodeError as error:
         raise FilterValueError(str(error))
 
-    if "'" in value:
-        raise FilterValueError('Single quote cannot be used')
-
-    if value.endswith('\\'):
-        raise FilterValueError(
-            'Escape character cannot be used in the end'
-        )
-
-    value = value.replace('{', '{{').replace('}', '}}').replace('%', '%%')
+    params.append(value)
 
-    return "'" + value + "'"
+    return '%s'
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
-from django.test import TransactionTestCase
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
 
 from serveradmin.access_control.models import AccessControlGroup
 from serveradmin.apps.models import Application
@@ -522,3 +523,68 @@ class ACLTestCase(TransactionTestCase):
             query_committer._access_control(
                 user, None, unchanged_objects, {}, changed_objects, {}
             )
+
+    @override_settings(ACL_DATABASE_MIN_CHECKS=0)
+    def test_acl_filters_evaluated_on_database(self):
+        user = User.objects.first()
+        user.is_superuser = False
+
+        acl = AccessControlGroup.objects.create(
+            name='app test', query='servertype=test0', is_whitelist=False
+        )
+        acl.members.add(user)
+
+        covered = Query({'hostname': 'test0'}, ['os'])
+        covered.update(os='bullseye')
+        covered.commit(user=user)
+
+        not_covered = Query({'hostname': 'test2'}, ['os'])
+        not_covered.update(os='bullseye')
+        with self.assertRaises(PermissionDenied) as error:
+            not_covered.commit(user=user)
+        self.assertEqual(
+            'Insufficient access rights to object "test2" for user '
+            '"hannah.acker": Object is not covered by ACL "app test", '
+            'it does not match the filters.',
+            str(error.exception),
+        )
+
+    def test_acl_filters_evaluated_the_same_on_database(self):
+        user = User.objects.first()
+        user.is_superuser = False
+
+        # The servertype test0 has no game_world, and test2 no database.
+        for query in [
+            'game_world=1',
+            'game_world=not(1)',
+            'game_world=empty()',
+            'game_world=not(empty())',
+            'database=empty()',
+            'os=not(wheezy) game_world=not(1)',
+            'servertype=test2 game_world=not(empty())',
+        ]:
+            acl = AccessControlGroup.objects.create(
+                name='acl', query=query, is_whitelist=False
+            )
+            acl.members.add(user)
+            for hostname in ['test0', 'test1', 'test2']:
+                with self.subTest(query=query, hostname=hostname):
+                    with override_settings(ACL_DATABASE_MIN_CHECKS=10 ** 9):
+                        in_memory = self._commit_permitted(user, hostname)
+                    with override_settings(ACL_DATABASE_MIN_CHECKS=0):
+                        on_database = self._commit_permitted(user, hostname)
+                    self.assertEqual(in_memory, on_database)
+            acl.delete()
+
+    def _commit_permitted(self, user, hostname):
+        query = Query({'hostname': hostname}, ['os'])
+        query.update(os='bullseye')
+        with transaction.atomic():
+            try:
+                query.commit(user=user)
+            except PermissionDenied:
+                return False
+            finally:
+                transaction.set_rollback(True)
+
+        return True
@@ -110,6 +110,16 @@ class TestIpAddrTypeHostForInternIp(TestIpAddrType):
         with self.assertRaises(ValidationError):
             second.commit(user=User.objects.first())
 
+    def test_servers_with_duplicate_intern_ip_in_one_commit(self):
+        query = Query()
+        for _ in range(2):
+            server = query.new_object('host')
+            server['hostname'] = self.faker.hostname()
+            server['intern_ip'] = '10.0.0.1/32'
+
+        with self.assertRaises(ValidationError):
+            query.commit(user=User.objects.first())
+
     def test_server_with_duplicate_inet_ip(self):
         first = self._get_server('host')
         first['intern_ip'] = '10.0.0.1/32'
@@ -378,6 +388,17 @@ class TestIpAddrTypeNetworkForInternIp(TestIpAddrType):
         with self.assertRaises(ValidationError):
             overlaps.commit(user=User.objects.first())
 
+    def test_servers_network_overlaps_in_one_commit(self):
+        query = Query()
+        for intern_ip in ['10.0.0.0/24', '10.0.1.0/24', '10.0.0.128/25']:
+            server = query.new_object('network')
+            server['hostname'] = self.faker.hostname()
+            server['intern_ip'] = intern_ip
+
+        with self.assertRaises(ValidationError) as error:
+            query.commit(user=User.objects.first())
+        self.assertEqual(len(error.exception.messages), 2)
+
     def test_change_server_network_overlaps(self):
         first = self._get_server('network')
         first['intern_ip'] = '10.0.0.0/30'
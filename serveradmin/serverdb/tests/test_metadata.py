@@ -0,0 +1,48 @@
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+
+from serveradmin.serverdb.metadata import VERSION_CACHE_KEY, get_metadata
+from serveradmin.serverdb.models import Attribute, ServertypeAttribute
+
+
+class MetadataTest(TransactionTestCase):
+    fixtures = ['test_dataset.json']
+
+    def test_snapshot_is_reused(self):
+        self.assertIs(get_metadata(), get_metadata())
+
+    def test_related_via_is_linked(self):
+        metadata = get_metadata()
+        for sa in ServertypeAttribute.objects.exclude(
+            related_via_attribute=None
+        ):
+            cached = metadata.get_servertype_attribute(
+                sa.servertype_id, sa.attribute_id
+            )
+            self.assertEqual(
+                cached.related_via_attribute, sa.related_via_attribute
+            )
+
+    def test_save_invalidates(self):
+        metadata = get_metadata()
+        attribute = Attribute.objects.get(attribute_id='os')
+        attribute.history = not attribute.history
+        attribute.save()
+
+        self.assertIsNot(get_metadata(), metadata)
+        self.assertEqual(
+            get_metadata().attributes['os'].history, attribute.history
+        )
+
+    def test_version_checked_once_per_interval(self):
+        metadata = get_metadata()
+        # Another process changes the metadata.
+        cache.incr(VERSION_CACHE_KEY)
+        self.assertIs(get_metadata(), metadata)
+
+        with override_settings(CACHE_VERSION_CHECK_INTERVAL=0):
+            self.assertIsNot(get_metadata(), metadata)
+
+    def test_unknown_servertype(self):
+        with self.assertRaises(ServertypeAttribute.DoesNotExist):
+            get_metadata().get_servertype_attribute('nonexistent', 'os')
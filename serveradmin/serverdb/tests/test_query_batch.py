@@ -0,0 +1,27 @@
+from django.core.exceptions import ObjectDoesNotExist
+from django.test import TransactionTestCase
+
+from adminapi.filters import BaseFilter, StartsWith
+from serveradmin.serverdb.query_executer import execute_queries, execute_query
+
+
+class QueryBatchTest(TransactionTestCase):
+    fixtures = ['test_dataset.json']
+
+    def test_results_in_order(self):
+        queries = [
+            ({'servertype': StartsWith('tes')}, ['os'], ['os']),
+            ({'hostname': BaseFilter('test0')}, ['hostname'], None),
+            ({'hostname': BaseFilter('nonexistent')}, None, None),
+        ]
+        self.assertEqual(
+            execute_queries(queries),
+            [execute_query(*q) for q in queries],
+        )
+
+    def test_unknown_attribute(self):
+        with self.assertRaises(ObjectDoesNotExist):
+            execute_queries([
+                ({'hostname': BaseFilter('test0')}, ['hostname'], None),
+                ({'nonexistent': BaseFilter('test0')}, ['hostname'], None),
+            ])
@@ -0,0 +1,114 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TransactionTestCase, override_settings
+
+from serveradmin.dataset import Query
+from serveradmin.serverdb import query_executer, routers
+from serveradmin.serverdb.query_cache import (
+    GENERATION_CACHE_KEY,
+    query_results,
+)
+from serveradmin.serverdb.query_committer import commit_query
+from serveradmin.serverdb.routers import client_context
+
+
+@override_settings(QUERY_CACHE_MAX_OBJECTS=10)
+class QueryCacheTest(TransactionTestCase):
+    fixtures = ['test_dataset.json', 'auth_user.json']
+
+    def setUp(self):
+        query_results.clear()
+
+    def test_cache_hit(self):
+        hits = query_results.hits
+        first = Query({'hostname': 'test1'}, ['os']).get()
+        second = Query({'hostname': 'test1'}, ['os']).get()
+        self.assertEqual(query_results.hits, hits + 1)
+        self.assertEqual(first, second)
+
+        # The cached results must not be shared with the callers
+        second['os'] = 'wheezy'
+        self.assertNotEqual(Query({'hostname': 'test1'}, ['os']).get(), second)
+
+    def test_commit_invalidates(self):
+        q = Query({'hostname': 'test1'}, ['os'])
+        s = q.get()
+        s['os'] = 'wheezy'
+        q.commit(user=User.objects.first())
+
+        s = Query({'hostname': 'test1'}, ['os']).get()
+        self.assertEqual(s['os'], 'wheezy')
+
+    def test_generation_checked_once_per_interval(self):
+        Query({'hostname': 'test1'}, ['os']).get()
+        # Another process commits.
+        cache.incr(GENERATION_CACHE_KEY)
+        hits = query_results.hits
+        Query({'hostname': 'test1'}, ['os']).get()
+        self.assertEqual(query_results.hits, hits + 1)
+
+        with override_settings(CACHE_VERSION_CHECK_INTERVAL=0):
+            Query({'hostname': 'test1'}, ['os']).get()
+        self.assertEqual(query_results.hits, hits + 1)
+
+    def test_expired(self):
+        with override_settings(QUERY_CACHE_TIMEOUT=-1):
+            Query({'hostname': 'test1'}, ['os']).get()
+        hits = query_results.hits
+        Query({'hostname': 'test1'}, ['os']).get()
+        self.assertEqual(query_results.hits, hits)
+
+    def test_size_limit(self):
+        Query({}, ['hostname']).get_lookup('hostname')
+        Query({'hostname': 'test1'}, ['os']).get()
+        self.assertLessEqual(query_results._num_objects, 10)
+
+
+@override_settings(QUERY_CACHE_MAX_OBJECTS=10, REPLICA_DATABASES=['replica'])
+class QueryCacheReplicaTest(TransactionTestCase):
+    fixtures = ['test_dataset.json', 'auth_user.json']
+
+    def setUp(self):
+        cache.clear()
+        query_results.clear()
+        routers._process_pinned_until = 0.0
+
+    def test_cached_from_primary(self):
+        # The process is pinned to the primary after committing.
+        commit_query(user=User.objects.first())
+        hits = query_results.hits
+        with patch.object(
+            query_executer,
+            '_read_transaction',
+            wraps=query_executer._read_transaction,
+        ) as read_transaction:
+            Query({'hostname': 'test1'}, ['os']).get()
+            Query({'hostname': 'test1'}, ['os']).get()
+        self.assertEqual(read_transaction.call_args[0][0], 'default')
+        self.assertEqual(query_results.hits, hits + 1)
+
+    def test_not_cached_from_replica(self):
+        with patch.object(
+            query_executer, '_execute_query', return_value=[]
+        ) as execute_query:
+            list(Query({'hostname': 'test1'}, ['os']))
+            with routers.read_from_replica('replica'):
+                list(Query({'hostname': 'test1'}, ['os']))
+        self.assertEqual(execute_query.call_count, 2)
+        for call in execute_query.call_args_list:
+            self.assertEqual(call.kwargs['using'], 'replica')
+
+    def test_read_own_writes(self):
+        user = User.objects.first()
+        with routers.read_from_replica('default'):
+            Query({'hostname': 'test1'}, ['os']).get()
+            q = Query({'hostname': 'test1'}, ['os'])
+            s = q.get()
+        with client_context(user=user):
+            s['os'] = 'wheezy'
+            q.commit(user=user)
+
+            s = Query({'hostname': 'test1'}, ['os']).get()
+            self.assertEqual(s['os'], 'wheezy')
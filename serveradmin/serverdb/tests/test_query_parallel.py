@@ -0,0 +1,27 @@
+from unittest.mock import patch
+
+from django.test import TransactionTestCase, override_settings
+
+from adminapi.filters import StartsWith
+from serveradmin.serverdb import query_materializer
+from serveradmin.serverdb.query_executer import execute_query
+
+
+class ParallelMaterializerTest(TransactionTestCase):
+    fixtures = ['test_dataset.json']
+
+    def test_same_results(self):
+        args = ({'servertype': StartsWith('tes')}, None, ['hostname'])
+        results = execute_query(*args)
+
+        with override_settings(
+            PARALLEL_MATERIALIZER_WORKERS=2,
+            PARALLEL_MATERIALIZER_MIN_SERVERS=1,
+        ), patch.object(
+            query_materializer,
+            '_fetch_rows_on_snapshot',
+            wraps=query_materializer._fetch_rows_on_snapshot,
+        ) as fetch_rows:
+            self.assertEqual(execute_query(*args), results)
+
+        self.assertEqual(fetch_rows.call_count, 2)
@@ -0,0 +1,53 @@
+import json
+from io import BytesIO
+from unittest.mock import patch
+
+from django.test import TransactionTestCase
+
+from adminapi.filters import Any, StartsWith
+from adminapi.request import _iter_stream, STREAM_HEADER
+from serveradmin.api.views import _stream_results
+from serveradmin.serverdb.query_executer import (
+    execute_query,
+    execute_query_stream,
+)
+
+
+class QueryStreamTest(TransactionTestCase):
+    fixtures = ['test_dataset.json']
+
+    def test_chunks(self):
+        filters = {'servertype': StartsWith('tes')}
+        with patch(
+            'serveradmin.serverdb.query_executer.STREAM_CHUNK_SIZE', 2
+        ):
+            chunks = list(execute_query_stream(filters, ['os'], None))
+
+        self.assertEqual([len(c) for c in chunks], [2, 2, 1])
+        self.assertEqual(
+            [o for c in chunks for o in c],
+            execute_query(filters, ['os'], None),
+        )
+
+    def test_order_by_attribute(self):
+        filters = {'servertype': StartsWith('tes')}
+        chunks = list(execute_query_stream(filters, ['os'], ['os']))
+        self.assertEqual(chunks, [execute_query(filters, ['os'], ['os'])])
+
+    def test_framing(self):
+        filters = {'servertype': StartsWith('tes')}
+        body = ''.join(_stream_results(
+            execute_query_stream(filters, ['os'], None)
+        ))
+        results = json.loads(body)['result']
+        self.assertEqual(len(results), 5)
+
+        response = BytesIO(body.encode())
+        self.assertEqual(response.readline().decode(), STREAM_HEADER + '\n')
+        self.assertEqual(list(_iter_stream(response)), results)
+
+    def test_empty(self):
+        body = ''.join(_stream_results(
+            execute_query_stream({'os': Any()}, ['os'], None)
+        ))
+        self.assertEqual(json.loads(body)['result'], [])
@@ -0,0 +1,53 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+from serveradmin.serverdb import routers
+from serveradmin.serverdb.query_committer import commit_query
+from serveradmin.serverdb.routers import (
+    choose_read_database,
+    client_context,
+    get_read_database,
+    read_from_replica,
+    replica_view,
+)
+
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaRouterTest(TransactionTestCase):
+    fixtures = ['auth_user.json']
+
+    def setUp(self):
+        cache.clear()
+        routers._process_pinned_until = 0.0
+
+    def test_replica(self):
+        self.assertEqual(choose_read_database(), 'replica')
+        with read_from_replica() as using:
+            self.assertEqual(using, 'replica')
+            with read_from_replica('default') as nested:
+                self.assertEqual(nested, 'replica')
+
+    def test_replica_view(self):
+        @replica_view
+        def view(request):
+            return get_read_database()
+
+        self.assertEqual(view(None), 'replica')
+        self.assertIsNone(get_read_database())
+
+    def test_inside_transaction(self):
+        with transaction.atomic():
+            self.assertEqual(choose_read_database(), 'default')
+
+    def test_client_pinned_after_commit(self):
+        user = User.objects.first()
+        with client_context(user=user):
+            commit_query(user=user)
+            self.assertEqual(choose_read_database(), 'default')
+        self.assertEqual(choose_read_database(), 'replica')
+
+    def test_process_pinned_after_commit(self):
+        commit_query(user=User.objects.first())
+        self.assertEqual(choose_read_database(), 'default')
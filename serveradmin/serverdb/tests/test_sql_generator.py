@@ -0,0 +1,72 @@
+from django.test import SimpleTestCase
+
+from adminapi.filters import Any, BaseFilter, ContainedOnlyBy, Regexp
+from serveradmin.serverdb.models import Attribute
+from serveradmin.serverdb.sql_generator import (
+    get_server_ids_query,
+    get_server_lookup_query,
+    get_server_query,
+)
+
+
+class SqlGeneratorTest(SimpleTestCase):
+    def test_values_are_parameters(self):
+        sql, params = get_server_query([
+            (Attribute.specials['hostname'], BaseFilter('test0')),
+        ], {})
+        self.assertNotIn('test0', sql)
+        self.assertEqual(params, ['test0'])
+
+    def test_same_shape_same_sql(self):
+        sql0, params0 = get_server_query([
+            (Attribute.specials['hostname'], Any('test0', 'test1')),
+            (Attribute.specials['servertype'], Regexp('^vm')),
+        ], {})
+        sql1, params1 = get_server_query([
+            (Attribute.specials['hostname'], Any('test2', 'test3')),
+            (Attribute.specials['servertype'], Regexp('^hv')),
+        ], {})
+        self.assertEqual(sql0, sql1)
+        self.assertEqual(params0, ['test0', 'test1', '^vm'])
+        self.assertEqual(params1, ['test2', 'test3', '^hv'])
+
+    def test_repeated_value(self):
+        sql, params = get_server_query([
+            (Attribute.specials['intern_ip'], ContainedOnlyBy('10.0.0.0/8')),
+        ], {})
+        self.assertEqual(sql.count('%s'), 2)
+        self.assertEqual(params, ['10.0.0.0/8', '10.0.0.0/8'])
+
+    def test_lookup_same_sql(self):
+        attribute = Attribute.specials['hostname']
+        sql0, params0 = get_server_lookup_query(attribute, ['test0'])
+        sql1, params1 = get_server_lookup_query(attribute, ['test0', 'test1'])
+        self.assertEqual(sql0, sql1)
+        self.assertEqual(params0, [['test0']])
+        self.assertEqual(params1, [['test0', 'test1']])
+
+    def test_order_by_attribute(self):
+        sql, params = get_server_query([
+            (Attribute.specials['hostname'], BaseFilter('test0')),
+        ], {}, [Attribute(attribute_id='os', type='string')], 5)
+        self.assertEqual(sql.count('%s'), len(params))
+        self.assertEqual(params, ['test0', 'os', 'os', 5])
+
+    def test_ids_same_sql(self):
+        attribute_filters = [
+            (Attribute.specials['servertype'], BaseFilter('vm')),
+        ]
+        sql0, params0 = get_server_ids_query(attribute_filters, {}, [1])
+        sql1, params1 = get_server_ids_query(attribute_filters, {}, [1, 2])
+        self.assertEqual(sql0, sql1)
+        self.assertEqual(params0, [[1], 'vm'])
+        self.assertEqual(params1, [[1, 2], 'vm'])
+
+    def test_order_by_special_bytewise(self):
+        sql, params = get_server_query([], {}, [
+            Attribute.specials['servertype'],
+            Attribute.specials['object_id'],
+        ])
+        self.assertIn('server.servertype_id COLLATE "C"', sql)
+        self.assertIn('server.hostname COLLATE "C"', sql)
+        self.assertNotIn('server.server_id COLLATE', sql)
@@ -25,9 +25,11 @@ from serveradmin.serverdb.models import (
     Change,
 )
 from serveradmin.serverdb.query_committer import CommitError, commit_query
+from serveradmin.serverdb.routers import replica_view
 
 
 @login_required
+@replica_view
 def changes(request):
     commits = ChangeCommit.objects.all().order_by('-change_on')
     date_settings = {
@@ -112,6 +114,7 @@ def changes(request):
 
 
 @login_required
+@replica_view
 def history(request):
     if 'object_id' in request.GET:
         query = Q(server_id=request.GET['object_id'])
@@ -31,7 +31,13 @@ from django.views.decorators.http import require_http_methods
 from django.views.defaults import bad_request
 
 from adminapi.datatype import DatatypeError
-from adminapi.filters import Any, ContainedOnlyBy, filter_classes, Not
+from adminapi.filters import (
+    All,
+    Any,
+    ContainedOnlyBy,
+    filter_classes,
+    Not,
+)
 from adminapi.parse import parse_query
 from adminapi.request import json_encode_extra
 
@@ -43,12 +49,12 @@ from serveradmin.serverdb.models import (
     Server
 )
 from serveradmin.serverdb.query_committer import commit_query
+from serveradmin.serverdb.routers import replica_view
 from serveradmin.servershell.helper import get_default_shown_attributes
 from serveradmin.servershell.helper.autocomplete import (
     attribute_value_startswith,
     attribute_startswith
 )
-from serveradmin.servershell.merged_query_iterator import MergedQuery
 from serveradmin.servershell.utils import servershell_plugins
 
 MAX_DISTINGUISHED_VALUES = 50
@@ -113,6 +119,7 @@ def index(request):
 
 
 @login_required
+@replica_view
 def autocomplete(request):
     hostname = request.GET.get('hostname')
 
@@ -161,17 +168,11 @@ def get_results(request):
         restrict = shown_attributes.copy()
         if 'servertype' not in restrict:
             restrict.append('servertype')
-        main_query = Query(parse_query(term), restrict, order_by)
-
-        merged_query = MergedQuery([
-            Query({'object_id': Any(*pinned)}, restrict),
-            main_query,
-        ])
-
-        # TODO: Using len is terribly slow for large datasets because it has
-        #  to query all objects but we cannot use count which is available on
-        #  Django QuerySet
-        num_servers = len(list(merged_query))
+        filters = parse_query(term)
+        main_query = Query(filters, restrict, order_by)
+        servers, num_servers = _get_page(
+            filters, restrict, order_by, pinned, offset, limit
+        )
     except (DatatypeError, ObjectDoesNotExist, ValidationError) as error:
         return HttpResponse(json.dumps({
             'status': 'error',
@@ -181,8 +182,6 @@ def get_results(request):
     # Query successful term must be valid here, so we can save it safely now.
     request.session['term'] = term
 
-    servers = list(islice(merged_query, offset, offset + limit))
-
     # Add information about available, editable attributes on servertypes
     servertype_ids = {s['servertype'] for s in servers}
 
@@ -211,6 +210,45 @@ def get_results(request):
     }, default=json_encode_extra), content_type='application/x-json')
 
 
+def _get_page(filters, restrict, order_by, pinned, offset, limit):
+    """Return the servers on the page and the total number of them
+
+    The pinned objects are shown before the others on the first pages.
+    We exclude them from the main query, so that the database can count
+    and paginate the rest of the objects for us.
+    """
+    if pinned:
+        pinned_servers = list(Query({'object_id': Any(*pinned)}, restrict))
+        filters = _exclude_objects(filters, pinned_servers)
+    else:
+        pinned_servers = []
+    num_servers = len(pinned_servers) + Query(filters).count()
+
+    servers = pinned_servers[offset:offset + limit]
+    if len(servers) < limit:
+        servers.extend(Query(
+            filters,
+            restrict,
+            order_by,
+            limit=limit - len(servers),
+            offset=max(offset - len(pinned_servers), 0),
+        ))
+
+    return servers, num_servers
+
+
+def _exclude_objects(filters, servers):
+    """Return the filters excluding the given objects"""
+    filters = dict(filters)
+    exclusion = Not(Any(*(s.object_id for s in servers)))
+    if 'object_id' in filters:
+        filters['object_id'] = All(filters['object_id'], exclusion)
+    else:
+        filters['object_id'] = exclusion
+
+    return filters
+
+
 @login_required
 @require_http_methods(['GET'])
 def inspect(request):
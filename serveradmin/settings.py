@@ -42,11 +42,22 @@ DATABASES = {
     },
 }
 
+# The queries are sent to the read replicas listed in here, if they are also
+# configured on DATABASES.  The commits always go to the default database.
+# The clients are kept on the default database for REPLICA_PIN_TIMEOUT seconds
+# after they commit to be able to read their own changes.  It should be longer
+# than the expected replication lag.  The clients are tracked on the CACHES,
+# so a shared backend is needed for this to work across processes.
+DATABASE_ROUTERS = ['serveradmin.serverdb.routers.ReplicaRouter']
+REPLICA_DATABASES = []
+REPLICA_PIN_TIMEOUT = 10
+
 MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'serveradmin.serverdb.routers.client_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -188,6 +199,60 @@ LOGGING = {
 
 OBJECTS_PER_PAGE = 25
 
+# Seconds every process waits before checking the versions of the data it
+# caches again.  The versions are kept on CACHES, so checking them costs
+# a round trip to the shared backend.
+CACHE_VERSION_CHECK_INTERVAL = 1
+
+# Seconds the attributes, servertypes and access control groups are cached
+# by every process.  They are invalidated immediately on changes, but it can
+# only reach the other processes, if a shared backend is configured on CACHES.
+METADATA_CACHE_TIMEOUT = 60
+
+# Seconds the applications and their public keys are cached by every process
+# to authenticate the API requests.  They are invalidated immediately on
+# changes, but it can only reach the other processes, if a shared backend is
+# configured on CACHES.
+AUTH_CACHE_TIMEOUT = 60
+
+# Seconds the last logins of the applications are buffered by every process
+# before they are written to the database.
+LAST_LOGINS_FLUSH_INTERVAL = 60
+
+# Seconds the sessions created for the API clients authenticated with their
+# SSH keys are valid.  The clients sign the requests with the session tokens
+# instead of the keys, until the sessions expire.
+API_SESSION_TIMEOUT = 300
+
+# Maximum number of objects the query results cache may hold per process.
+# The cache is invalidated by every commit.  Set it to 0 to disable it.  When
+# running multiple processes, a shared backend has to be configured on CACHES
+# for the commits on one of them to invalidate the results on the others.
+QUERY_CACHE_MAX_OBJECTS = 0
+
+# Seconds the query results are cached.  They are invalidated immediately by
+# the commits, but not by the changes made bypassing them, like the ones on
+# the Django admin.
+QUERY_CACHE_TIMEOUT = 60
+
+# Seconds the snapshots of the lazy queries are kept open without being read
+# from.  The attributes of the objects of a lazy query cannot be materialized
+# after its snapshot is closed.
+QUERY_SNAPSHOT_TIMEOUT = 60
+
+# Number of additional database connections to materialize the attribute
+# values of a query in parallel.  They are only used for the queries with at
+# least PARALLEL_MATERIALIZER_MIN_SERVERS servers.  Set it to 0 to disable it.
+# The connections are kept open between the queries for the CONN_MAX_AGE of
+# the database.
+PARALLEL_MATERIALIZER_WORKERS = 0
+PARALLEL_MATERIALIZER_MIN_SERVERS = 10000
+
+# Number of the objects of a commit times the access control groups of its
+# user or application, from which on the objects are checked against
+# the filters of the groups on the database instead of in memory.
+ACL_DATABASE_MIN_CHECKS = 1000
+
 GRAPHITE_SPRITE_WIDTH = 150
 GRAPHITE_SPRITE_HEIGHT = 100
 GRAPHITE_SPRITE_PARAMS = (
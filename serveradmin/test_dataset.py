@@ -10,6 +10,7 @@ from django.core.exceptions import ValidationError
 from django.test import TransactionTestCase
 from netaddr import EUI
 
+from adminapi.exceptions import DatasetError
 from adminapi.filters import (
     Any,
     Not,
@@ -17,6 +18,15 @@ from adminapi.filters import (
     StartsWith,
 )
 from serveradmin.dataset import Query
+from serveradmin.serverdb.query_committer import CommitError, commit_query
+from serveradmin.serverdb.models import (
+    Attribute,
+    Server,
+    ServerRelationAttribute,
+    ServerStringAttribute,
+    Servertype,
+    ServertypeAttribute,
+)
 
 
 class TestQuery(TransactionTestCase):
@@ -40,6 +50,23 @@ class TestQuery(TransactionTestCase):
         self.assertIn('test2', hostnames)
         self.assertIn('test3', hostnames)
 
+    def test_query_lookup(self):
+        q = Query({'hostname': Any('test3', 'test1', 'nonexistent')}, ['os'])
+        self.assertEqual(
+            list(q), list(Query({'hostname': Regexp('^test[13]$')}, ['os']))
+        )
+
+        q = Query({'object_id': list(q)[0].object_id}, profile=True)
+        self.assertEqual(q.get()['hostname'], 'test1')
+        self.assertIn('ANY', q.profile.sql)
+
+    def test_query_join(self):
+        s = Query({'hostname': 'vm-1'}, [{'hypervisor': ['vms']}]).get()
+        self.assertEqual(s['hypervisor']['vms'], {'vm-1'})
+
+        s = Query({'hostname': 'hv-1'}, [{'vms': ['hypervisor']}]).get()
+        self.assertEqual([v['hypervisor'] for v in s['vms']], ['hv-1'])
+
     def test_filter_regexp(self):
         hostnames = set()
         for s in Query({'hostname': Regexp('^test[02]$')}):
@@ -79,6 +106,112 @@ class TestQuery(TransactionTestCase):
         q = Query({'servertype': StartsWith('tes')})
         self.assertEqual(len(q), 5)
 
+    def test_count(self):
+        q = Query({'servertype': StartsWith('tes')}, limit=2)
+        self.assertEqual(q.count(), 5)
+        self.assertEqual(Query({'os': Any()}).count(), 0)
+
+    def test_limit_offset(self):
+        q = Query({'servertype': StartsWith('tes')}, limit=2, offset=1)
+        self.assertEqual(
+            [s['hostname'] for s in q], ['test1', 'test2']
+        )
+
+    def test_limit_offset_order_by(self):
+        q = Query(
+            {'servertype': StartsWith('tes')},
+            ['hostname', 'os'],
+            ['os'],
+            limit=1,
+            offset=3,
+        )
+        self.assertEqual([s['hostname'] for s in q], ['test0'])
+
+    def test_order_by_hostname_bytewise(self):
+        q = Query({'hostname': Any('test1', 'test2')}, ['hostname'])
+        for obj, hostname in zip(q, ['test-1', 'test.2']):
+            obj['hostname'] = hostname
+        q.commit(user=User.objects.first())
+
+        q = Query(
+            {'servertype': StartsWith('tes')}, ['hostname'], limit=5
+        )
+        hostnames = [s['hostname'] for s in q]
+        self.assertEqual(hostnames, sorted(hostnames))
+        self.assertEqual(hostnames[:2], ['test-1', 'test.2'])
+
+    def test_order_by_attribute(self):
+        q = Query(
+            {'servertype': StartsWith('tes')},
+            ['hostname', 'game_world'],
+            ['game_world'],
+            profile=True,
+        )
+        self.assertEqual(
+            [s['hostname'] for s in q],
+            ['test1', 'test2', 'test3', 'test0', 'test4'],
+        )
+        self.assertIn('server_number_attribute', q.profile.sql)
+
+    def test_order_by_multi_attribute_limit(self):
+        filters = {'servertype': StartsWith('tes')}
+        restrict = ['hostname', 'database']
+        hostnames = [s['hostname'] for s in Query(
+            filters, restrict, ['database', 'hostname']
+        )]
+        q = Query(
+            filters,
+            restrict,
+            ['database', 'hostname'],
+            limit=2,
+            offset=1,
+            profile=True,
+        )
+        self.assertEqual([s['hostname'] for s in q], hostnames[1:3])
+
+        stages = [t['stage'] for t in q.profile.serialize()['timings']]
+        self.assertIn('ordering', stages)
+
+    def test_profile(self):
+        q = Query({'os': 'wheezy'}, ['hostname', 'os'], profile=True)
+        self.assertEqual(q.get()['hostname'], 'test0')
+        self.assertIn('SELECT', q.profile.sql)
+        self.assertIn('wheezy', q.profile.sql_params)
+        self.assertIn('Buffers', q.profile.explain)
+
+        stages = [t['stage'] for t in q.profile.serialize()['timings']]
+        self.assertIn('filtering', stages)
+        self.assertIn('materializing attributes', stages)
+
+    def test_lazy(self):
+        filters = {'hostname': Regexp('^test[0-3]$')}
+        expected = {o.object_id: dict(o) for o in Query(filters, None)}
+        objects = list(Query(filters, None, lazy=True))
+        self.assertIn('os', objects[0])
+
+        # The values are read from the snapshot of the query.
+        ServerStringAttribute.objects.filter(value='wheezy').update(
+            value='buster'
+        )
+        self.assertIn('wheezy', {o['os'] for o in objects})
+        self.assertEqual({o.object_id: dict(o) for o in objects}, expected)
+
+    def test_lazy_close(self):
+        with Query({'hostname': 'test0'}, None, lazy=True) as q:
+            obj = q.get()
+        self.assertEqual(obj['hostname'], 'test0')
+        with self.assertRaises(DatasetError):
+            obj['os']
+
+    def test_lazy_collected(self):
+        obj = Query({'hostname': 'test0'}, None, lazy=True).get()
+        snapshot = obj._loader._snapshot
+        self.assertIsNotNone(snapshot._connection.connection)
+
+        # The snapshot is closed right away without a cycle to collect.
+        del obj
+        self.assertIsNone(snapshot._connection.connection)
+
 
 class TestCommit(TransactionTestCase):
     fixtures = ['test_dataset.json', 'auth_user.json']
@@ -94,6 +227,81 @@ class TestCommit(TransactionTestCase):
         self.assertEqual(s['os'], 'wheezy')
         self.assertEqual(s['intern_ip'], IPv4Address('10.16.2.1'))
 
+    def test_commit_created(self):
+        q = Query()
+        hv = q.new_object('hypervisor')
+        hv['hostname'] = 'hv-new'
+        hv['intern_ip'] = IPv4Address('10.99.0.1')
+        for i in range(3):
+            vm = q.new_object('vm')
+            vm['hostname'] = 'vm-new-{}'.format(i)
+            vm['intern_ip'] = IPv4Address('10.99.1.{}'.format(i))
+            vm['hypervisor'] = 'hv-new'
+        q.commit(user=User.objects.first())
+
+        s = Query({'hostname': 'hv-new'}, ['vms']).get()
+        self.assertEqual(s['vms'], {'vm-new-0', 'vm-new-1', 'vm-new-2'})
+
+    def test_commit_changed(self):
+        user = User.objects.first()
+        q = Query({'servertype': 'test2'}, ['game_world', 'has_monitoring'])
+        for s in q:
+            s['game_world'] += 100
+            s['has_monitoring'] = s['game_world'] > 105
+        q.commit(user=user)
+
+        q = Query({'hostname': 'test0'}, ['database'])
+        q.get()['database'].update({'db0', 'db1', 'db2'})
+        q.commit(user=user)
+        q.get()['database'].discard('db1')
+        q.commit(user=user)
+
+        self.assertEqual(
+            {
+                s['hostname']: (s['game_world'], s['has_monitoring'])
+                for s in Query(
+                    {'servertype': 'test2'},
+                    ['hostname', 'game_world', 'has_monitoring'],
+                )
+            },
+            {
+                'test1': (101, False),
+                'test2': (102, False),
+                'test3': (110, True),
+            },
+        )
+        self.assertEqual(
+            Query({'hostname': 'test0'}, ['database']).get()['database'],
+            {'db0', 'db2'},
+        )
+
+    def test_commit_remove_invalid_value(self):
+        ports = Attribute.objects.create(
+            attribute_id='ports', type='number', multi=True, regexp=r'\A.*\Z'
+        )
+        ServertypeAttribute.objects.create(
+            servertype_id='test0', attribute=ports
+        )
+        q = Query({'hostname': 'test0'}, ['ports'])
+        q.get()['ports'].add(80)
+        q.commit(user=User.objects.first())
+
+        s = Query({'hostname': 'test0'}, ['ports']).get()
+        changes = s._serialize_changes()
+        changes['ports'] = {'action': 'multi', 'add': [], 'remove': ['http']}
+        with self.assertRaises(CommitError):
+            commit_query(changed=[changes], user=User.objects.first())
+
+    def test_commit_changed_attributes(self):
+        s = Query({'hostname': 'test1'}, ['game_world']).get()
+        s['game_world'] = 5
+        commit = commit_query(
+            changed=[s._serialize_changes()], user=User.objects.first()
+        )
+        self.assertEqual(
+            set(commit.changed[0]), set(Attribute.specials) | {'game_world'}
+        )
+
     def test_commit_regexp_violation(self):
         pass
 
@@ -320,3 +528,94 @@ class TestReverseAttribute(TransactionTestCase):
 
         s = Query({'hostname': 'hv-1'}, ['vms']).get()
         self.assertIn('vm-1', s['vms'])
+
+
+class TestRelatedAttribute(TransactionTestCase):
+    fixtures = ['test_dataset.json', 'auth_user.json']
+
+    def setUp(self):
+        location = Attribute.objects.create(
+            attribute_id='location', type='string', regexp=r'\A.*\Z'
+        )
+        vm = Attribute.objects.create(
+            attribute_id='vm',
+            type='relation',
+            target_servertype_id='vm',
+            regexp=r'\A.*\Z',
+        )
+        Servertype.objects.create(
+            servertype_id='container', ip_addr_type='host'
+        )
+        for servertype_id, attribute, related_via_attribute in [
+            ('hypervisor', location, None),
+            ('vm', location, 'hypervisor'),
+            ('container', vm, None),
+            ('container', location, 'vm'),
+        ]:
+            ServertypeAttribute.objects.create(
+                servertype_id=servertype_id,
+                attribute=attribute,
+                related_via_attribute_id=related_via_attribute,
+            )
+
+        ServerStringAttribute.objects.create(
+            server=Server.objects.get(hostname='hv-1'),
+            attribute=location,
+            value='dc1',
+        )
+        container = Server.objects.create(
+            hostname='container-1',
+            intern_ip='10.0.3.1',
+            servertype_id='container',
+        )
+        ServerRelationAttribute.objects.create(
+            server=container,
+            attribute=vm,
+            value=Server.objects.get(hostname='vm-1'),
+        )
+
+    def test_related_attribute(self):
+        s = Query({'hostname': 'vm-1'}, ['location']).get()
+        self.assertEqual(s['location'], 'dc1')
+
+    def test_recursive_related_attribute(self):
+        s = Query({'hostname': 'container-1'}, ['location']).get()
+        self.assertEqual(s['location'], 'dc1')
+
+        s = Query({'hostname': 'container-1'}, None).get()
+        self.assertEqual(s['vm'], 'vm-1')
+        self.assertEqual(s['location'], 'dc1')
+
+
+class TestSupernetAttribute(TransactionTestCase):
+    fixtures = ['test_dataset.json', 'auth_user.json']
+
+    def setUp(self):
+        attribute = Attribute.objects.create(
+            attribute_id='network',
+            type='supernet',
+            target_servertype_id='test1',
+            readonly=True,
+            regexp=r'\A.*\Z',
+        )
+        ServertypeAttribute.objects.create(
+            servertype_id='test2', attribute=attribute
+        )
+        for hostname, intern_ip in [
+            ('net-wide', '10.16.0.0/16'),
+            ('net-narrow', '10.16.0.0/30'),
+        ]:
+            Server.objects.create(
+                hostname=hostname, intern_ip=intern_ip, servertype_id='test1'
+            )
+
+    def test_most_specific_network(self):
+        q = Query({'servertype': 'test2'}, ['hostname', 'network'])
+        self.assertEqual(
+            {s['hostname']: s['network'] for s in q},
+            {
+                'test1': 'net-narrow',
+                'test2': 'net-narrow',
+                'test3': 'net-wide',
+            },
+        )